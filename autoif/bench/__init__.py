@@ -0,0 +1,4 @@
+from .mock_server import MockServer, MockServerConfig, run_mock_server
+from .bench import run_bench
+
+__all__ = ['MockServer', 'MockServerConfig', 'run_mock_server', 'run_bench']
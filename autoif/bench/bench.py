@@ -0,0 +1,187 @@
+# 吞吐基准测试：在模拟服务器和合成数据上测量各步骤的吞吐
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional
+import requests
+from autoif.utils import save_jsonl
+from .mock_server import run_mock_server
+from .templates import sample_instruction, render_eval_func, render_query_answer, random_sentence
+
+# 基准指标及其单位
+METRICS = {
+    'batch_process_async': 'requests/s',
+    'cross_validation': 'instructions/s',
+    'query_verification': 'responses/s',
+}
+
+
+def start_mock_server(port: int, **kwargs) -> multiprocessing.Process:
+    """在独立进程中启动模拟服务器，避免与客户端争用事件循环"""
+    process = multiprocessing.get_context('spawn').Process(
+        target=run_mock_server, kwargs={'port': port, **kwargs}, daemon=True
+    )
+    process.start()
+    return process
+
+
+def wait_for_server(base_url: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/models", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"服务器未在 {timeout} 秒内就绪: {base_url}")
+
+
+def synthetic_verification_records(num_instructions: int, rng: random.Random, samples: int = 8) -> List[Dict]:
+    """合成步骤2的输出：每条指令8个```json包裹的函数与测试用例"""
+    records = []
+    for i in range(num_instructions):
+        instruction = f"{sample_instruction(rng)} (#{i})"
+        records.append({
+            "prompt": instruction,
+            "instruction": instruction,
+            "gpt-answer": [render_eval_func(instruction, rng) for _ in range(samples)]
+        })
+    return records
+
+
+def synthetic_query_records(cross_validation: List[Dict], queries: int, responses: int, rng: random.Random) -> List[Dict]:
+    """合成步骤6的输出：每条指令若干query，每个query若干回复"""
+    records = []
+    for item in cross_validation:
+        for _ in range(queries):
+            prompt = (f"Please answer the query strictly following the instruction.\n"
+                      f"[instruction] {item['instruction']}\n[Query] {random_sentence(rng)}?")
+            records.append({
+                **item,
+                "prompt": prompt,
+                "gpt-answer": [render_query_answer(item['instruction'], rng) for _ in range(responses)]
+            })
+    return records
+
+
+async def bench_batch_process(autoif, num_requests: int, rng: random.Random) -> float:
+    """测量 batch_process_async 的请求吞吐"""
+    prompts = [f"Please answer the query strictly following the instruction.\n"
+               f"[instruction] {sample_instruction(rng)}\n[Query] {random_sentence(rng)}?"
+               for _ in range(num_requests)]
+    autoif.current_step = 0
+    autoif.set_step_cache(0)
+    try:
+        start = time.perf_counter()
+        await autoif.batch_process_async(
+            messages=[autoif.client.build_messages(prompt) for prompt in prompts],
+            total=num_requests,
+            process_funcs=lambda result: result
+        )
+        return num_requests / (time.perf_counter() - start)
+    finally:
+        autoif.clear_current_cache()
+        await autoif.close_clients()
+
+
+def bench_cross_validation(autoif, num_instructions: int, rng: random.Random) -> float:
+    """测量 cross_validation 的指令吞吐"""
+    save_jsonl(synthetic_verification_records(num_instructions, rng),
+               os.path.join(autoif.output_dir, "verification_funcs_cases.jsonl"))
+    autoif.current_step = 3
+    autoif.set_step_cache(3)
+    try:
+        start = time.perf_counter()
+        autoif.cross_validation()
+        return num_instructions / (time.perf_counter() - start)
+    finally:
+        autoif.clear_current_cache()
+
+
+def bench_query_verification(autoif, queries: int, responses: int, rng: random.Random) -> float:
+    """测量 query_verification 的回复吞吐，使用 cross_validation 基准的输出作为验证函数"""
+    cross_validation = autoif.read_output("cross_validation.jsonl")
+    records = synthetic_query_records(cross_validation, queries, responses, rng)
+    save_jsonl(records, os.path.join(autoif.output_dir, "sharegpt_query.jsonl"))
+    total_responses = sum(len(record['gpt-answer']) for record in records)
+    autoif.current_step = 7
+    start = time.perf_counter()
+    asyncio.run(autoif.query_verification())
+    return total_responses / (time.perf_counter() - start)
+
+
+def compare_with_baseline(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """与基线比较，返回吞吐下降超过tolerance的指标"""
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base and value < base * (1 - tolerance):
+            regressions.append(f"{name}: {value:.1f} < {base:.1f} {METRICS[name]} (-{(1 - value / base) * 100:.1f}%)")
+    return regressions
+
+
+def run_bench(requests_num: int = 2000,
+              instructions: int = 200,
+              queries: int = 16,
+              responses: int = 4,
+              batch_size: int = 256,
+              process_num: int = 4,
+              base_url: Optional[str] = None,
+              model: Optional[str] = None,
+              port: int = 18000,
+              seed: int = 0,
+              server_kwargs: Optional[Dict] = None,
+              http_client: str = 'sdk',
+              client_processes: int = 1) -> Dict[str, float]:
+    """运行全部基准，未指定base_url时自动启动本地模拟服务器"""
+    from autoif.core import AutoIF
+    server = None
+    if base_url is None:
+        base_url = f"http://127.0.0.1:{port}/v1"
+        server = start_mock_server(port, seed=seed, **(server_kwargs or {}))
+    rng = random.Random(seed)
+    try:
+        wait_for_server(base_url)
+        with tempfile.TemporaryDirectory() as work_dir:
+            autoif = AutoIF(
+                N=1,
+                model=model,
+                api_key="EMPTY",
+                base_url=base_url,
+                process_num=process_num,
+                batch_size=batch_size,
+                seed_dir=os.path.join(work_dir, "seed.jsonl"),
+                output_dir=os.path.join(work_dir, "output"),
+                cache_dir=os.path.join(work_dir, ".cache"),
+                http_client=http_client,
+                client_processes=client_processes,
+            )
+            results = {
+                'batch_process_async': asyncio.run(bench_batch_process(autoif, requests_num, rng)),
+                'cross_validation': bench_cross_validation(autoif, instructions, rng),
+                'query_verification': bench_query_verification(autoif, queries, responses, rng),
+            }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+
+    print("\n=== 基准结果 ===")
+    for name, value in results.items():
+        print(f"{name:<24}{value:>12.1f} {METRICS[name]}")
+    return results
+
+
+def save_results(results: Dict[str, float], path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> Dict[str, float]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
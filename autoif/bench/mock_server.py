@@ -0,0 +1,258 @@
+# 本地模拟的OpenAI兼容服务器，用于在没有GPU服务器时测量吞吐
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from typing import Dict, List, Optional
+from aiohttp import web, ClientSession
+from autoif.utils import md5
+from .templates import render_response
+
+
+class MockServerConfig:
+    """模拟服务器配置
+
+    Args:
+        model: /models 返回的模型名
+        latency_median: 首token延迟的中位数（秒），按对数正态分布采样
+        latency_sigma: 对数正态分布的sigma，越大长尾越明显
+        tokens_per_sec: 每个请求的生成速度，n个样本并行生成
+        error_rate: 返回500错误的概率
+        max_n: 单个请求允许的最大n
+        malformed_rate: 请求未约束输出格式时，```json 回复被损坏（去掉代码块或截断）的概率
+        seed: 随机种子
+        record_path: 录制/回放文件路径
+        upstream: 录制模式下转发请求的真实服务地址，如 http://host:8000/v1
+        replay: 是否从record_path回放
+    """
+    def __init__(self,
+                 model: str = "mock-model",
+                 latency_median: float = 0.05,
+                 latency_sigma: float = 0.5,
+                 tokens_per_sec: float = 2000.0,
+                 error_rate: float = 0.0,
+                 max_n: int = 128,
+                 malformed_rate: float = 0.0,
+                 seed: int = 0,
+                 record_path: Optional[str] = None,
+                 upstream: Optional[str] = None,
+                 replay: bool = False):
+        self.model = model
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.max_n = max_n
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        self.record_path = record_path
+        self.upstream = upstream
+        self.replay = replay
+
+
+def request_key(body: Dict) -> str:
+    """录制/回放时标识请求的键：忽略模型名，其余参数规范化后取哈希"""
+    body = {k: v for k, v in body.items() if k not in ('model', 'stream')}
+    return md5(json.dumps(body, sort_keys=True, ensure_ascii=False))
+
+
+def is_structured(body: Dict) -> bool:
+    """请求是否约束了JSON输出（OpenAI response_format 或 vLLM guided_json）"""
+    response_format = body.get('response_format') or {}
+    return response_format.get('type') in ('json_schema', 'json_object') or body.get('guided_json') is not None
+
+
+def prompt_content(prompt: str) -> str:
+    """completions请求的prompt为本地渲染的对话模板，提取其中各回合的内容（ChatML），其他格式原样返回"""
+    contents = re.findall(r'<\|im_start\|>\w+\n(.*?)<\|im_end\|>', prompt, re.DOTALL)
+    return '\n'.join(contents) if contents else prompt
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class MockServer:
+    def __init__(self, config: MockServerConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.request_count = 0
+        self.recordings: Dict[str, List[Dict]] = {}
+        self._replay_pos: Dict[str, int] = {}
+        self._record_file = None
+        self._session: Optional[ClientSession] = None
+        if config.replay:
+            self._load_recordings()
+
+    def _load_recordings(self):
+        with open(self.config.record_path, encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                self.recordings.setdefault(item['key'], []).append(item['response'])
+        print(f"加载录制 {sum(len(v) for v in self.recordings.values())} 条")
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/v1/models', self.handle_models)
+        app.router.add_post('/v1/chat/completions', self.handle_chat_completions)
+        app.router.add_post('/v1/completions', self.handle_completions)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    async def _cleanup(self, app):
+        if self._session is not None:
+            await self._session.close()
+        if self._record_file is not None:
+            self._record_file.close()
+
+    async def handle_models(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "object": "list",
+            "data": [{"id": self.config.model, "object": "model", "owned_by": "autoif"}]
+        })
+
+    async def _sleep_latency(self, completion_tokens: int):
+        config = self.config
+        latency = config.latency_median * math.exp(self.rng.gauss(0, config.latency_sigma))
+        if config.tokens_per_sec > 0:
+            latency += completion_tokens / config.tokens_per_sec
+        await asyncio.sleep(latency)
+
+    def _error(self, status: int, message: str) -> web.Response:
+        return web.json_response({"error": {"message": message, "type": "mock_error", "code": status}}, status=status)
+
+    def malform(self, content: str) -> str:
+        """模拟自由生成时常见的格式错误：代码块前后多出说明文字、缺少代码块标记或JSON被截断"""
+        if '```json' not in content:
+            return content
+        body = content.replace('```json', '').replace('```', '').strip()
+        kind = self.rng.randrange(3)
+        if kind == 0:
+            return f"Sure! Here is the evaluation function:\n{body}\nHope this helps."
+        if kind == 1:
+            return body
+        return content[:int(len(content) * self.rng.uniform(0.3, 0.9))]
+
+    def render_chat_completion(self, body: Dict) -> Dict:
+        """按prompt类型生成n个模板回复"""
+        prompt = '\n'.join(message.get('content') or '' for message in body.get('messages', []))
+        n = body.get('n') or 1
+        structured = is_structured(body)
+        contents = [render_response(prompt, self.rng, structured) for _ in range(n)]
+        if not structured and self.config.malformed_rate > 0:
+            contents = [self.malform(content) if self.rng.random() < self.config.malformed_rate else content
+                        for content in contents]
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = sum(count_tokens(content) for content in contents)
+        return {
+            "id": f"chatcmpl-mock-{self.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', self.config.model),
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                for i, content in enumerate(contents)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    async def _forward(self, body: Dict) -> Dict:
+        """录制模式：转发到真实服务并记录结果"""
+        if self._session is None:
+            self._session = ClientSession()
+        async with self._session.post(f"{self.config.upstream}/chat/completions", json=body) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        if self._record_file is None:
+            self._record_file = open(self.config.record_path, 'a', encoding='utf-8')
+        self._record_file.write(json.dumps({"key": request_key(body), "response": data}, ensure_ascii=False) + '\n')
+        self._record_file.flush()
+        return data
+
+    def _replay(self, body: Dict) -> Optional[Dict]:
+        """回放模式：同一请求的多次录制按顺序循环返回"""
+        key = request_key(body)
+        responses = self.recordings.get(key)
+        if not responses:
+            return None
+        pos = self._replay_pos.get(key, 0)
+        self._replay_pos[key] = pos + 1
+        return responses[pos % len(responses)]
+
+    def render_completion(self, body: Dict) -> Dict:
+        """completions接口：prompt可以是字符串或列表，第i个prompt的第j个样本的index为 i*n+j"""
+        prompts = body.get('prompt') or ''
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        n = body.get('n') or 1
+        structured = is_structured(body)
+        choices = []
+        prompt_tokens = completion_tokens = 0
+        for i, prompt in enumerate(prompts):
+            content = prompt_content(prompt)
+            prompt_tokens += count_tokens(content)
+            for j in range(n):
+                text = render_response(content, self.rng, structured)
+                if not structured and self.config.malformed_rate > 0 and self.rng.random() < self.config.malformed_rate:
+                    text = self.malform(text)
+                completion_tokens += count_tokens(text)
+                choices.append({"index": i * n + j, "text": text, "finish_reason": "stop", "logprobs": None})
+        return {
+            "id": f"cmpl-mock-{self.request_count}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": body.get('model', self.config.model),
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    async def handle_completions(self, request: web.Request) -> web.Response:
+        self.request_count += 1
+        body = await request.json()
+        if (body.get('n') or 1) > self.config.max_n:
+            return self._error(400, f"n must be <= {self.config.max_n}")
+        data = self.render_completion(body)
+        # 同一请求中的prompt并行生成，延迟取决于最长的样本
+        await self._sleep_latency(max([count_tokens(choice['text']) for choice in data['choices']] or [0]))
+        if self.config.error_rate > 0 and self.rng.random() < self.config.error_rate:
+            return self._error(500, "mock server error")
+        return web.json_response(data)
+
+    async def handle_chat_completions(self, request: web.Request) -> web.Response:
+        self.request_count += 1
+        body = await request.json()
+        config = self.config
+        if (body.get('n') or 1) > config.max_n:
+            return self._error(400, f"n must be <= {config.max_n}")
+
+        if config.replay:
+            data = self._replay(body)
+            if data is None:
+                return self._error(404, "request not found in recording")
+        elif config.upstream:
+            return web.json_response(await self._forward(body))
+        else:
+            data = self.render_chat_completion(body)
+
+        await self._sleep_latency(max(count_tokens(choice['message']['content'] or '')
+                                      for choice in data['choices']))
+        if config.error_rate > 0 and self.rng.random() < config.error_rate:
+            return self._error(500, "mock server error")
+        return web.json_response(data)
+
+
+def run_mock_server(host: str = '127.0.0.1', port: int = 8000, **kwargs) -> None:
+    """启动模拟服务器（阻塞）"""
+    server = MockServer(MockServerConfig(**kwargs))
+    print(f"模拟服务器: http://{host}:{port}/v1 (model={server.config.model})")
+    web.run_app(server.build_app(), host=host, port=port, print=None)
@@ -0,0 +1,231 @@
+# 模拟服务器的模板回复：为每个步骤生成可被解析的输出
+import json
+import random
+import re
+from typing import Dict, List, Optional, Tuple
+
+WORDS = [
+    'apple', 'river', 'mountain', 'story', 'system', 'garden', 'window', 'market',
+    'signal', 'planet', 'silver', 'forest', 'engine', 'letter', 'bridge', 'summer',
+    'travel', 'number', 'coffee', 'answer', 'pencil', 'ocean', 'museum', 'rocket',
+]
+
+
+def random_sentence(rng: random.Random, min_words: int = 4, max_words: int = 12) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+class ConstraintFamily:
+    """一类可验证的指令：负责生成指令文本、满足/违反指令的文本以及结构不同的验证函数"""
+    name = ''
+    pattern = None
+
+    def sample_params(self, rng: random.Random) -> Dict:
+        return {}
+
+    def instruction(self, params: Dict) -> str:
+        raise NotImplementedError
+
+    def parse(self, instruction: str) -> Optional[Dict]:
+        match = self.pattern.search(instruction)
+        return None if match is None else self.params_from_match(match)
+
+    def params_from_match(self, match) -> Dict:
+        return {}
+
+    def make_text(self, params: Dict, follow: bool, rng: random.Random) -> str:
+        raise NotImplementedError
+
+    def funcs(self, params: Dict) -> List[str]:
+        raise NotImplementedError
+
+
+class Lowercase(ConstraintFamily):
+    name = 'lowercase'
+    pattern = re.compile(r'entire response should be in lowercase')
+
+    def instruction(self, params):
+        return "Your entire response should be in lowercase letters."
+
+    def make_text(self, params, follow, rng):
+        text = random_sentence(rng)
+        return text if follow else text.capitalize()
+
+    def funcs(self, params):
+        return [
+            "def evaluate(response):\n    return response == response.lower()",
+            "def evaluate(response):\n    return not any(c.isupper() for c in response)",
+            "def evaluate(response):\n    for ch in response:\n        if ch.isupper():\n            return False\n    return True",
+        ]
+
+
+class Uppercase(ConstraintFamily):
+    name = 'uppercase'
+    pattern = re.compile(r'entire response should be in uppercase')
+
+    def instruction(self, params):
+        return "Your entire response should be in uppercase letters."
+
+    def make_text(self, params, follow, rng):
+        text = random_sentence(rng).upper()
+        return text if follow else text.lower()
+
+    def funcs(self, params):
+        return [
+            "def evaluate(response):\n    return response == response.upper()",
+            "def evaluate(response):\n    return not any(c.islower() for c in response)",
+            "def evaluate(response):\n    for ch in response:\n        if ch.islower():\n            return False\n    return True",
+        ]
+
+
+class MinWords(ConstraintFamily):
+    name = 'min_words'
+    pattern = re.compile(r'at least (\d+) words')
+
+    def sample_params(self, rng):
+        return {'k': rng.randint(5, 60)}
+
+    def instruction(self, params):
+        return f"Answer with at least {params['k']} words."
+
+    def params_from_match(self, match):
+        return {'k': int(match.group(1))}
+
+    def make_text(self, params, follow, rng):
+        k = params['k']
+        n = rng.randint(k, k + 10) if follow else rng.randint(1, max(1, k - 1))
+        return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+    def funcs(self, params):
+        k = params['k']
+        return [
+            f"def evaluate(response):\n    return len(response.split()) >= {k}",
+            f"def evaluate(response):\n    return sum(1 for _ in response.split()) >= {k}",
+            f"def evaluate(response):\n    words = response.split()\n    if len(words) < {k}:\n        return False\n    return True",
+        ]
+
+
+class EndsWith(ConstraintFamily):
+    name = 'ends_with'
+    pattern = re.compile(r"End your response with the word '(\w+)'")
+
+    def sample_params(self, rng):
+        return {'word': rng.choice(WORDS)}
+
+    def instruction(self, params):
+        return f"End your response with the word '{params['word']}'."
+
+    def params_from_match(self, match):
+        return {'word': match.group(1)}
+
+    def make_text(self, params, follow, rng):
+        word = params['word']
+        last = word if follow else rng.choice([w for w in WORDS if w != word])
+        return f"{random_sentence(rng)} {last}"
+
+    def funcs(self, params):
+        word = params['word']
+        return [
+            f"def evaluate(response):\n    return response.strip().endswith({word!r})",
+            f"def evaluate(response):\n    words = response.split()\n    return bool(words) and words[-1] == {word!r}",
+            f"def evaluate(response):\n    return response.rstrip()[-{len(word)}:] == {word!r}",
+        ]
+
+
+class NoCommas(ConstraintFamily):
+    name = 'no_commas'
+    pattern = re.compile(r'not use any commas')
+
+    def instruction(self, params):
+        return "Do not use any commas in your response."
+
+    def make_text(self, params, follow, rng):
+        text = random_sentence(rng)
+        if follow:
+            return text
+        words = text.split()
+        return ', '.join(words)
+
+    def funcs(self, params):
+        return [
+            "def evaluate(response):\n    return ',' not in response",
+            "def evaluate(response):\n    return response.count(',') == 0",
+            "def evaluate(response):\n    return not any(c == ',' for c in response)",
+        ]
+
+
+FAMILIES = [Lowercase(), Uppercase(), MinWords(), EndsWith(), NoCommas()]
+
+
+def match_family(instruction: str) -> Tuple[ConstraintFamily, Dict]:
+    """识别指令所属的约束类别，无法识别时退化为最少词数约束"""
+    for family in FAMILIES:
+        params = family.parse(instruction)
+        if params is not None:
+            return family, params
+    return FAMILIES[2], {'k': len(instruction) % 10 + 1}
+
+
+def sample_instruction(rng: random.Random) -> str:
+    family = rng.choice(FAMILIES)
+    return family.instruction(family.sample_params(rng))
+
+
+def render_instructions(rng: random.Random, num: int = 50) -> str:
+    """步骤1：每行一条以'- '开头的指令"""
+    return '\n'.join(f"- {sample_instruction(rng)}" for _ in range(num))
+
+
+def render_eval_func(instruction: str, rng: random.Random, structured: bool = False) -> str:
+    """步骤2：```json 包裹的验证函数和三个测试用例，约束输出格式时只返回JSON"""
+    family, params = match_family(instruction)
+    func = rng.choice(family.funcs(params))
+    cases = []
+    for follow in (True, False, rng.random() < 0.5):
+        cases.append({"input": family.make_text(params, follow, rng), "output": follow})
+    answer = json.dumps({"func": func, "cases": cases})
+    return answer if structured else "```json\n" + answer + "\n```"
+
+
+def render_backtranslation(instruction: str, rng: random.Random) -> str:
+    """步骤4：中文翻译和三条回译"""
+    lines = ["Chinese: 请遵循以下要求作答。"]
+    for prefix in ("", "Please note: ", "Make sure that "):
+        lines.append(f"Back: {prefix}{instruction}")
+    return '\n'.join(lines)
+
+
+def render_nli(rng: random.Random, contradiction_rate: float = 0.05) -> str:
+    """步骤5：NLI判断"""
+    return 'contradiction' if rng.random() < contradiction_rate else 'entailment'
+
+
+def render_query_answer(instruction: str, rng: random.Random, follow_rate: float = 0.7) -> str:
+    """步骤6：按指令回答query，以一定概率违反指令"""
+    family, params = match_family(instruction)
+    return family.make_text(params, rng.random() < follow_rate, rng)
+
+
+def render_score(rng: random.Random) -> str:
+    """步骤8：分析加最后一行分数"""
+    return f"The response follows the instruction and addresses the query.\nScore: {rng.randint(6, 10)}"
+
+
+def render_response(prompt: str, rng: random.Random, structured: bool = False) -> str:
+    """根据prompt识别所属步骤并生成对应格式的回复，structured表示请求约束了JSON输出"""
+    if 'Please provide 50 different instructions' in prompt:
+        return render_instructions(rng)
+    if 'writing evaluation functions in Python' in prompt:
+        match = re.search(r'Here is the instruction: (.*)', prompt)
+        return render_eval_func(match.group(1).strip() if match else '', rng, structured)
+    if 'translate the following instruction into Chinese' in prompt:
+        match = re.search(r'Instruction: (.*)', prompt)
+        return render_backtranslation(match.group(1).strip() if match else '', rng)
+    if 'relationship between the following two sentences' in prompt:
+        return render_nli(rng)
+    if 'answer the query strictly following the instruction' in prompt:
+        match = re.search(r'\[instruction\] (.*)', prompt)
+        return render_query_answer(match.group(1).strip() if match else '', rng)
+    if 'judging whether a response' in prompt:
+        return render_score(rng)
+    return random_sentence(rng, 20, 80)
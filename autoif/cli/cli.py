@@ -1,9 +1,9 @@
 import argparse
 import os
-from typing import Optional
-from autoif.core import AutoIF
-from autoif.utils import ensure_output_dir
-def parse_args():
+import sys
+from typing import Optional, List, Dict, Tuple
+from autoif.utils import ensure_output_dir, get_run_dir
+def parse_args(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
         description="AutoIF: 自动指令生成和过滤工具",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
@@ -21,27 +21,142 @@ def parse_args():
                        help="API认证密钥")
     parser.add_argument("--base-url", 
                        type=str, default="http://localhost:8000/v1",
-                       help="API服务地址")
+                       help="API服务地址，多个地址用逗号分隔时轮询发送")
+    parser.add_argument("--step-model",
+                       type=str, action="append", default=[],
+                       help="为指定步骤使用其他模型，格式 STEPS=MODEL[@BASE_URL]，如 5,8=Qwen2.5-7B-Instruct@http://localhost:8001/v1，可重复指定")
     parser.add_argument("--seed-dir",
                        type=str,
                        required=True,
                        help="参考文件目录路径")
+    parser.add_argument("--seed-instructions",
+                       type=str, default="./sample_data/seed_instruction.txt",
+                       help="步骤1、2使用的种子指令文件，每行一条")
     parser.add_argument("--batch-size", 
                        type=int, default=256,
                        help="批处理大小")
     parser.add_argument("--process-num", 
                        type=int, default=16,
                        help="进程数量")
+    parser.add_argument("--max-n",
+                       type=int, default=128,
+                       help="单个请求的最大样本数，同一批中相同的prompt合并为n更大的请求，设为1时不合并")
+    
+    parser.add_argument("--schedule",
+                       type=str, default="fifo",
+                       choices=["fifo", "longest", "bucket"],
+                       help="请求发送顺序：fifo按输入顺序；longest按预计耗时从长到短；bucket按预计耗时分桶，从长到短逐桶发送")
+    parser.add_argument("--schedule-window",
+                       type=int, default=None,
+                       help="调度时向前查看的任务数，默认为batch-size的4倍")
+    
+    parser.add_argument("--transport",
+                       type=str, default="chat",
+                       choices=["chat", "completions"],
+                       help="请求方式：chat为 /chat/completions；completions在本地应用对话模板，把多个prompt打包为一个 /completions 请求")
+    parser.add_argument("--chat-template",
+                       type=str, default="chatml",
+                       help="completions方式使用的对话模板：chatml（内置）、auto（加载模型的tokenizer）或tokenizer的名称/路径，后两者需要transformers")
+    parser.add_argument("--pack-size",
+                       type=int, default=32,
+                       help="completions方式下每个请求打包的prompt数")
+    parser.add_argument("--http-client",
+                       type=str, default="sdk",
+                       choices=["sdk", "raw"],
+                       help="HTTP客户端：sdk为openai SDK；raw直接用aiohttp发送JSON，只解析回复内容和usage（安装orjson时使用orjson），高并发时CPU开销更小")
+    parser.add_argument("--client-processes",
+                       type=int, default=1,
+                       help="raw方式下HTTP收发和响应解析使用的子进程数，大于1时主进程只负责调度")
+    
+    parser.add_argument("--structured-output",
+                       type=str, default=None,
+                       choices=["json_schema", "guided_json"],
+                       help="步骤2按JSON schema约束生成：json_schema使用OpenAI的response_format，guided_json使用vLLM的guided_json，默认不约束")
+    
+    parser.add_argument("--func-cost-budget",
+                       type=float, default=5.0,
+                       help="验证函数单次调用的平均耗时预算（毫秒），交叉验证时超出预算的函数被淘汰")
+    parser.add_argument("--func-cluster-topk",
+                       type=int, default=1,
+                       help="交叉验证时在测试用例上判断完全一致的函数只保留耗时最低的k个")
+    parser.add_argument("--func-constant-ratio",
+                       type=float, default=0.95,
+                       help="交叉验证时判断中同一取值占比不低于该值的函数视为近似常量并淘汰")
+    
+    # 质量评分
+    parser.add_argument("--no-prefilter",
+                       action="store_true",
+                       help="评分前不做启发式过滤（空、截断、高度重复、与query无关的回复）")
+    parser.add_argument("--rejudge-samples",
+                       type=int, default=2,
+                       help="平均分接近阈值的样本追加的评分次数，0表示不追加")
+    parser.add_argument("--rejudge-margin",
+                       type=float, default=1.0,
+                       help="平均分在 (8 - margin, 8 + margin] 内的样本追加评分")
+    
+    # 跨指令收割
+    parser.add_argument("--harvest",
+                       action="store_true",
+                       help="步骤7用其他指令的验证函数检查回复，通过的回复作为这些指令的额外SFT/DPO样本")
+    parser.add_argument("--harvest-candidates",
+                       type=int, default=64,
+                       help="每条指令探测兼容性的候选指令数")
+    parser.add_argument("--harvest-per-response",
+                       type=int, default=2,
+                       help="每个回复最多收割到的指令数")
+    parser.add_argument("--harvest-max-pass-rate",
+                       type=float, default=0.5,
+                       help="探测回复通过率超过该值的指令视为过于宽松，不收割")
+    
+    # 运行预算
+    parser.add_argument("--budget-tokens",
+                       type=float, default=None,
+                       help="整个运行的token预算（prompt和completion的估计值之和）")
+    parser.add_argument("--budget-requests",
+                       type=int, default=None,
+                       help="整个运行的请求数预算")
+    parser.add_argument("--budget-hours",
+                       type=float, default=None,
+                       help="整个运行的耗时预算（小时）")
+    
+    # 性能剖析
+    parser.add_argument("--profile",
+                       type=str, nargs="?", const="sample", default=None,
+                       choices=["sample", "cprofile"],
+                       help="按步骤剖析主进程和进程池worker并记录事件循环延迟，结果写入输出目录的profile子目录；"
+                            "sample为低开销的调用栈采样（默认），cprofile为确定性剖析")
+    parser.add_argument("--profile-memory",
+                       action="store_true",
+                       help="剖析时同时记录每个步骤结束时的tracemalloc快照（开销较大）")
+    
+    # 对冲请求
+    parser.add_argument("--hedge-percentile",
+                       type=float, default=None,
+                       help="请求耗时超过近期延迟的该百分位时发出对冲副本（优先发往另一个地址），默认不对冲")
+    parser.add_argument("--hedge-max-ratio",
+                       type=float, default=0.05,
+                       help="对冲请求占总请求数的上限")
     
     # 流程控制
     parser.add_argument("--start-step",
                        type=int, default=None,
-                       choices=range(1, 9),
-                       help="起始步骤 (1-8)")
+                       choices=range(1, 13),
+                       help="起始步骤 (1-12)")
     parser.add_argument("--end-step",
                        type=int, default=None,
-                       choices=range(1, 9),
-                       help="结束步骤 (1-8)")
+                       choices=range(1, 13),
+                       help="结束步骤 (1-12)")
+    parser.add_argument("--seed",
+                       type=int, default=42,
+                       help="随机种子")
+    
+    # DPO配置
+    parser.add_argument("--dpo-shards",
+                       type=int, default=1,
+                       help="DPO数据输出分片数")
+    parser.add_argument("--dpo-input",
+                       type=str, default=None,
+                       help="外部DPO打分输入文件(含prompt/eval_func/gpt-answer)，默认复用步骤7的回复得分")
     
     # 输出配置
     parser.add_argument("--output-dir",
@@ -53,22 +168,336 @@ def parse_args():
     parser.add_argument("--no-resume",
                        action="store_true",
                        help="不从缓存中恢复")
+    parser.add_argument("--cache-compress",
+                       action="store_true",
+                       help="压缩缓存条目")
+    
+    # 运行计划
+    parser.add_argument("--dry-run",
+                       action="store_true",
+                       help="只打印运行计划（请求数、token数和预计耗时），不访问服务器")
+    parser.add_argument("--plan-tokens-per-sec",
+                       type=float, default=5000.0,
+                       help="没有实测吞吐时，运行计划使用的completion token吞吐")
+    
+    # 分片配置
+    parser.add_argument("--num-shards",
+                       type=int, default=1,
+                       help="按指令哈希划分的分片数")
+    parser.add_argument("--shard-id",
+                       type=int, default=None,
+                       help="只运行指定分片（多机运行时使用）；不指定且分片数>1时在本机启动全部分片并合并")
     
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    try:
+        args.step_models = parse_step_models(args.step_model)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
 
 
-def main():
-    args = parse_args()
-    
-    # 确保输出目录和缓存目录存在
-    ensure_output_dir(args.output_dir)
-    ensure_output_dir(args.cache_dir)
+def parse_step_models(specs: List[str]) -> Dict[int, Tuple[str, Optional[str]]]:
+    """解析 STEPS=MODEL[@BASE_URL]，返回 {步骤: (模型, 地址或None)}"""
+    from autoif.core.planner import STEP_SPECS
+    step_models = {}
+    for spec in specs:
+        steps, sep, target = spec.partition('=')
+        model, _, base_url = target.partition('@')
+        if not sep or not model:
+            raise ValueError(f"--step-model 格式应为 STEPS=MODEL[@BASE_URL]: {spec}")
+        for step in steps.split(','):
+            if not step.strip().isdigit() or int(step) not in STEP_SPECS:
+                raise ValueError(f"--step-model 只能用于调用模型的步骤 {sorted(STEP_SPECS)}: {spec}")
+            step_models[int(step)] = (model, base_url or None)
+    return step_models
+
+
+def parse_merge_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="autoif merge",
+        description="合并分片运行的输出",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--model",
+                       type=str, default="Qwen2.5-72B-Instruct",
+                       help="使用的模型名称")
+    parser.add_argument("--seed-dir",
+                       type=str,
+                       required=True,
+                       help="参考文件目录路径")
+    parser.add_argument("--output-dir",
+                       type=str, default="./output",
+                       help="输出目录路径")
+    parser.add_argument("--num-shards",
+                       type=int, required=True,
+                       help="分片数")
+    parser.add_argument("--files",
+                       type=str, nargs="*", default=None,
+                       help="只合并指定的文件，默认合并所有JSONL输出")
+    return parser.parse_args(argv)
+
+
+def merge(argv: Optional[List[str]] = None):
+    from autoif.core.shard import merge_shard_outputs
+    args = parse_merge_args(argv)
+    run_dir = get_run_dir(args.output_dir, args.model, args.seed_dir)
+    merge_shard_outputs(run_dir, args.num_shards, args.files)
+
+
+def add_mock_server_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-median",
+                       type=float, default=0.05,
+                       help="模拟延迟的中位数（秒），按对数正态分布采样")
+    parser.add_argument("--latency-sigma",
+                       type=float, default=0.5,
+                       help="延迟对数正态分布的sigma")
+    parser.add_argument("--tokens-per-sec",
+                       type=float, default=2000.0,
+                       help="每个请求的生成速度")
+    parser.add_argument("--error-rate",
+                       type=float, default=0.0,
+                       help="返回500错误的概率")
+    parser.add_argument("--max-n",
+                       type=int, default=128,
+                       help="单个请求允许的最大n")
+    parser.add_argument("--malformed-rate",
+                       type=float, default=0.0,
+                       help="未约束输出格式时，JSON回复被损坏（去掉代码块或截断）的概率")
+
+
+def mock_server_kwargs(args) -> dict:
+    return dict(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate,
+        max_n=args.max_n,
+        malformed_rate=args.malformed_rate,
+    )
+
+
+def mock_server(argv: Optional[List[str]] = None):
+    from autoif.bench import run_mock_server
+    parser = argparse.ArgumentParser(
+        prog="autoif mock-server",
+        description="启动本地模拟的OpenAI兼容服务器",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--model", type=str, default="mock-model", help="模型名")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    add_mock_server_args(parser)
+    parser.add_argument("--record",
+                       type=str, default=None,
+                       help="录制/回放文件路径")
+    parser.add_argument("--upstream",
+                       type=str, default=None,
+                       help="录制模式：将请求转发到该真实服务并写入 --record 文件")
+    parser.add_argument("--replay",
+                       action="store_true",
+                       help="回放模式：从 --record 文件返回录制的响应")
+    args = parser.parse_args(argv)
+    if (args.upstream or args.replay) and not args.record:
+        parser.error("录制或回放模式需要指定 --record")
+    run_mock_server(
+        host=args.host,
+        port=args.port,
+        model=args.model,
+        seed=args.seed,
+        record_path=args.record,
+        upstream=args.upstream,
+        replay=args.replay,
+        **mock_server_kwargs(args)
+    )
+
+
+def bench(argv: Optional[List[str]] = None):
+    from autoif.bench.bench import run_bench, save_results, load_results, compare_with_baseline
+    parser = argparse.ArgumentParser(
+        prog="autoif bench",
+        description="在模拟服务器和合成数据上测量吞吐",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=2000, help="batch_process_async 基准的请求数")
+    parser.add_argument("--instructions", type=int, default=200, help="cross_validation 基准的指令数")
+    parser.add_argument("--queries", type=int, default=16, help="query_verification 基准中每条指令的query数")
+    parser.add_argument("--responses", type=int, default=4, help="每个query的回复数")
+    parser.add_argument("--batch-size", type=int, default=256, help="批处理大小")
+    parser.add_argument("--process-num", type=int, default=4, help="进程数量")
+    parser.add_argument("--base-url", type=str, default=None, help="使用已有服务而不是启动模拟服务器")
+    parser.add_argument("--model", type=str, default=None, help="使用的模型名称")
+    parser.add_argument("--http-client", type=str, default="sdk", choices=["sdk", "raw"], help="HTTP客户端，同run")
+    parser.add_argument("--client-processes", type=int, default=1, help="raw方式下的客户端子进程数，同run")
+    parser.add_argument("--port", type=int, default=18000, help="模拟服务器端口")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    add_mock_server_args(parser)
+    parser.add_argument("--json-out", type=str, default=None, help="将结果写入JSON文件")
+    parser.add_argument("--baseline", type=str, default=None, help="基线结果JSON，吞吐下降超过容差时返回非零退出码")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的吞吐下降比例")
+    args = parser.parse_args(argv)
+
+    results = run_bench(
+        requests_num=args.requests,
+        instructions=args.instructions,
+        queries=args.queries,
+        responses=args.responses,
+        batch_size=args.batch_size,
+        process_num=args.process_num,
+        base_url=args.base_url,
+        model=args.model,
+        port=args.port,
+        seed=args.seed,
+        server_kwargs=mock_server_kwargs(args),
+        http_client=args.http_client,
+        client_processes=args.client_processes
+    )
+    if args.json_out:
+        save_results(results, args.json_out)
+    if args.baseline:
+        regressions = compare_with_baseline(results, load_results(args.baseline), args.tolerance)
+        if regressions:
+            print("\n性能回退:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+
+def reward_server(argv: Optional[List[str]] = None):
+    from autoif.reward import run_reward_server
+    parser = argparse.ArgumentParser(
+        prog="autoif reward-server",
+        description="基于交叉验证输出的验证函数包启动本地打分服务",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--bundle", type=str, required=True, help="验证函数包路径（步骤3输出的verifier_bundle.pkl）")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8100, help="监听端口")
+    parser.add_argument("--process-num", type=int, default=16, help="打分进程数量")
+    parser.add_argument("--chunk-size", type=int, default=256, help="每个进程池任务包含的最大回复数")
+    args = parser.parse_args(argv)
+    run_reward_server(args.bundle, host=args.host, port=args.port,
+                      process_num=args.process_num, chunk_size=args.chunk_size)
+
+
+def profile_report(argv: Optional[List[str]] = None):
+    from autoif.core.profiling import profile_files, merge_profiles, merge_stacks, top_functions, top_allocations
+    parser = argparse.ArgumentParser(
+        prog="autoif profile-report",
+        description="合并 --profile 写出的剖析文件并打印热点",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("profile_dir", type=str, help="剖析文件目录（输出目录下的profile子目录）")
+    parser.add_argument("--step", type=int, default=None, help="只统计指定步骤，默认合并所有步骤")
+    parser.add_argument("--role", type=str, default="*", choices=["*", "main", "worker-*"],
+                       help="只统计主进程（main）或worker（worker-*），默认都统计")
+    parser.add_argument("--sort", type=str, default="cumulative", help="cProfile结果的pstats排序字段，如 cumulative、tottime")
+    parser.add_argument("--limit", type=int, default=30, help="打印的函数数和内存分配位置数")
+    args = parser.parse_args(argv)
+
+    found = False
+    paths = profile_files(args.profile_dir, args.step, args.role, suffix='.stacks')
+    if paths:
+        found = True
+        counts = merge_stacks(paths)
+        total = sum(counts.values()) or 1
+        print(f"合并 {len(paths)} 个调用栈采样文件，共 {total} 次采样")
+        print(f"{'自身':>8}{'包含子调用':>10}  函数")
+        for frame, own, inclusive in top_functions(counts, args.limit):
+            print(f"{own / total:>8.1%}{inclusive / total:>10.1%}  {frame}")
+
+    paths = profile_files(args.profile_dir, args.step, args.role)
+    stats = merge_profiles(paths)
+    if stats is not None:
+        found = True
+        print(f"合并 {len(paths)} 个cProfile文件")
+        stats.sort_stats(args.sort).print_stats(args.limit)
+
+    snapshots = profile_files(args.profile_dir, args.step, args.role, suffix='.tracemalloc')
+    if snapshots:
+        found = True
+        print(f"合并 {len(snapshots)} 个tracemalloc快照，步骤结束时仍占用内存最多的位置:")
+        for filename, lineno, size, count in top_allocations(snapshots, args.limit):
+            print(f"{size / 1024:>12.1f} KiB {count:>10} 次  {filename}:{lineno}")
+    if not found:
+        print(f"{args.profile_dir} 中没有匹配的剖析文件")
+
+
+def job_argv(options: dict) -> List[str]:
+    """任务文件中的参数 -> 命令行参数：键为run命令的长选项名（如 seed-dir），true为开关，列表为重复指定；
+    也可以用 "argv" 直接给出命令行参数列表"""
+    argv = list(options.get('argv', []))
+    for key, value in options.items():
+        if key == 'argv' or value is None or value is False:
+            continue
+        flag = '--' + key.replace('_', '-')
+        if value is True:
+            argv.append(flag)
+        else:
+            for each in (value if isinstance(value, list) else [value]):
+                argv += [flag, str(each)]
+    return argv
+
+
+def serve(argv: Optional[List[str]] = None):
+    from autoif.core.service import run_service
+    argv = sys.argv[1:] if argv is None else argv
+    # "--" 之后为所有任务共用的run参数，任务文件中的参数覆盖它们
+    default_argv = []
+    if '--' in argv:
+        argv, default_argv = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+    parser = argparse.ArgumentParser(
+        prog="autoif serve",
+        description="服务模式：监视任务目录，在一个进程中并发运行多个流程，共享客户端、进程池和并发位置。"
+                    "用法：autoif serve JOB_DIR [选项] -- [所有任务共用的run参数]",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("job_dir", type=str, help="任务目录，任务为其中pending子目录下的JSON文件")
+    parser.add_argument("--max-jobs", type=int, default=4, help="同时运行的最大任务数")
+    parser.add_argument("--max-concurrency", type=int, default=256, help="所有任务合计的最大并发请求数，按任务公平分配")
+    parser.add_argument("--process-num", type=int, default=16, help="共享进程池的进程数")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="检查新任务的间隔（秒）")
+    parser.add_argument("--once", action="store_true", help="处理完任务目录中现有的任务后退出")
+    args = parser.parse_args(argv)
+
+    def build_job(name: str, options: dict, resources):
+        job_args = parse_args(default_argv + job_argv(options))
+        if job_args.num_shards > 1 or job_args.shard_id is not None:
+            raise ValueError("服务模式不支持分片运行")
+        if job_args.dry_run or job_args.profile:
+            raise ValueError("服务模式不支持 --dry-run 和 --profile")
+        # 各任务使用独立的缓存目录，进程数以共享进程池为准
+        job_args.cache_dir = os.path.join(job_args.cache_dir, os.path.splitext(name)[0])
+        job_args.process_num = args.process_num
+        ensure_output_dir(job_args.output_dir)
+        ensure_output_dir(job_args.cache_dir)
+        return build_autoif(job_args, resources=resources), job_args.start_step, job_args.end_step
+
+    run_service(args.job_dir, build_job, process_num=args.process_num, max_concurrency=args.max_concurrency,
+                max_jobs=args.max_jobs, poll_interval=args.poll_interval, once=args.once)
+
+
+def run_local_shards(args, argv: List[str]):
+    """在本机启动所有分片进程：先以非分片方式完成步骤1，再并行运行各分片，最后合并输出"""
+    from autoif.core.shard import launch_local_shards, merge_shard_outputs
+    run_dir = get_run_dir(args.output_dir, args.model, args.seed_dir)
+    start_step = args.start_step or 1
+    end_step = args.end_step or 12
     
-    # 确保参考文件目录存在
-    ensure_output_dir(args.seed_dir)
+    augment_path = os.path.join(run_dir, "augment_instructions.txt")
+    if start_step <= 1 and (args.start_step == 1 or not os.path.exists(augment_path)):
+        build_autoif(args).run(start_step=args.start_step, end_step=1)
+    if end_step <= 1:
+        return
     
-    # 创建AutoIF实例
-    autoif = AutoIF(
+    return_codes = launch_local_shards(argv, args.num_shards, run_dir)
+    failed = [i for i, code in enumerate(return_codes) if code != 0]
+    if failed:
+        raise RuntimeError(f"分片运行失败: {failed}，请查看 {run_dir} 下的日志")
+    merge_shard_outputs(run_dir, args.num_shards)
+
+
+def build_autoif(args, **kwargs):
+    from autoif.core import AutoIF
+    return AutoIF(
         N=args.seed_num,
         model=args.model,
         api_key=args.api_key,
@@ -78,8 +507,88 @@ def main():
         seed_dir=args.seed_dir,
         output_dir=args.output_dir,
         cache_dir=args.cache_dir,
-        resume=not args.no_resume
+        resume=not args.no_resume,
+        seed=args.seed,
+        dpo_shards=args.dpo_shards,
+        dpo_input=args.dpo_input,
+        shard_id=args.shard_id,
+        num_shards=args.num_shards,
+        cache_compress=args.cache_compress,
+        hedge_percentile=args.hedge_percentile,
+        hedge_max_ratio=args.hedge_max_ratio,
+        max_n=args.max_n,
+        step_models=args.step_models,
+        func_cost_budget=args.func_cost_budget,
+        func_cluster_topk=args.func_cluster_topk,
+        func_constant_ratio=args.func_constant_ratio,
+        prefilter=not args.no_prefilter,
+        rejudge_samples=args.rejudge_samples,
+        rejudge_margin=args.rejudge_margin,
+        harvest=args.harvest,
+        harvest_candidates=args.harvest_candidates,
+        harvest_per_response=args.harvest_per_response,
+        harvest_max_pass_rate=args.harvest_max_pass_rate,
+        schedule=args.schedule,
+        schedule_window=args.schedule_window,
+        structured_output=args.structured_output,
+        budget_tokens=args.budget_tokens,
+        budget_requests=args.budget_requests,
+        budget_hours=args.budget_hours,
+        profile=args.profile,
+        profile_memory=args.profile_memory,
+        transport=args.transport,
+        chat_template=args.chat_template,
+        pack_size=args.pack_size,
+        seed_instructions=args.seed_instructions,
+        http_client=args.http_client,
+        client_processes=args.client_processes,
+        **kwargs
+    )
+
+
+def print_plan(args):
+    from autoif.core.planner import plan_run, format_plan
+    plans = plan_run(
+        get_run_dir(args.output_dir, args.model, args.seed_dir),
+        N=args.seed_num,
+        seed_instruction_path=args.seed_instructions,
+        start_step=args.start_step or 1,
+        end_step=args.end_step or 12,
+        tokens_per_sec=args.plan_tokens_per_sec,
+        max_n=args.max_n
     )
+    print(format_plan(plans))
+
+
+def plan(argv: Optional[List[str]] = None):
+    """打印运行计划，参数与run相同"""
+    print_plan(parse_args(argv))
+
+
+def run(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    if args.dry_run:
+        print_plan(args)
+        return
+    
+    # 确保输出目录和缓存目录存在
+    ensure_output_dir(args.output_dir)
+    ensure_output_dir(args.cache_dir)
+    
+    # 确保参考文件目录存在
+    ensure_output_dir(args.seed_dir)
+    
+    try:
+        if args.num_shards > 1 and args.shard_id is None:
+            run_local_shards(args, argv)
+            return
+    except KeyboardInterrupt:
+        print("\n用户中断执行")
+        return
+    
+    # 创建AutoIF实例
+    autoif = build_autoif(args)
     
     try:
         # 运行流程
@@ -93,6 +602,27 @@ def main():
         print(f"\n执行出错: {e}")
         raise
     
+
+COMMANDS = {
+    'run': run,
+    'merge': merge,
+    'plan': plan,
+    'mock-server': mock_server,
+    'bench': bench,
+    'reward-server': reward_server,
+    'profile-report': profile_report,
+    'serve': serve,
+}
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    # 未指定子命令时默认为run，兼容原有用法
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+    else:
+        run(argv)
+
 if __name__ == '__main__':
     main()
        
\ No newline at end of file
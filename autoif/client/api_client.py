@@ -1,10 +1,13 @@
-from typing import Optional, List, Union, Dict
+from typing import Optional, List, Union, Dict, Hashable
 from openai import OpenAI, AsyncOpenAI
 from openai.types.chat.chat_completion import ChatCompletion
 import requests
 import json
 import asyncio
 import aiohttp
+from .hedging import HedgePolicy
+from .chat_template import load_chat_template
+from .raw_http import RawHTTPTransport, ProcessTransport
 
 class OpenAIClient:
     """Chatbot for LLaMA series models with turbomind as inference engine.
@@ -17,12 +20,26 @@ class OpenAIClient:
     """
 
     def __init__(self,
-                 base_url: str,
+                 base_url: str | List[str],
                  api_key: Optional[str] = None,
-                 model: Optional[str] = None):
-        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+                 model: Optional[str] = None,
+                 hedge: Optional[HedgePolicy] = None,
+                 transport: str = 'chat',
+                 chat_template: Optional[str] = None,
+                 http_client: str = 'sdk',
+                 client_processes: int = 1):
+        # 多个endpoint（列表或逗号分隔）时轮询发送请求，对冲请求发往另一个endpoint
+        if isinstance(base_url, str):
+            base_url = [url.strip() for url in base_url.split(',') if url.strip()]
+        self.api_key = api_key
+        self.base_urls = base_url
+        self.base_url = base_url[0]
+        self.clients = [AsyncOpenAI(api_key=api_key, base_url=url) for url in self.base_urls]
+        self.client = self.clients[0]
+        self.hedge = hedge
+        self._next_client = 0
         self.models = asyncio.run(self.get_models())
-        self.chat_completions_v1_url = f'{base_url}/chat/completions'
+        self.chat_completions_v1_url = f'{self.base_url}/chat/completions'
         self.headers = {'content-type': 'application/json'}
         if api_key is not None:
             self.headers['Authorization'] = f'Bearer {api_key}'
@@ -32,9 +49,25 @@ class OpenAIClient:
         else:
             assert model in self.models, f"Model {model} not found in {self.models}"
             self.model = model
+        # transport为completions时在本地应用对话模板，多个prompt打包为一个 /completions 请求
+        self.transport = transport
+        if transport == 'completions':
+            self.render_prompt, self.stop = load_chat_template(chat_template, self.model)
+        # http_client为raw时不经过openai SDK，直接用aiohttp发送JSON并只提取内容和usage；
+        # client_processes>1时HTTP收发和响应解析分散到多个子进程
+        self.raw = None
+        if http_client == 'raw':
+            if client_processes > 1:
+                self.raw = ProcessTransport(client_processes, base_urls=self.base_urls, headers=self.headers)
+            else:
+                self.raw = RawHTTPTransport(self.base_urls, self.headers)
+        # 服务端返回的token用量累计值
+        self.usage = {'prompt_tokens': 0, 'completion_tokens': 0}
             
     async def get_models(self):
-        models = await self.client.models.list()
+        # 使用临时客户端，避免连接池中的连接绑定到已关闭的事件循环
+        async with AsyncOpenAI(api_key=self.api_key, base_url=self.base_url) as client:
+            models = await client.models.list()
         assert models.data is not None, "No models found"
         return [model.id for model in models.data]
         
@@ -43,22 +76,108 @@ class OpenAIClient:
                      "content": inputs}]
         return messages
             
-    async def create_chat_completions(self, messages: List, n: int = 1, top_p: float = 1, temperature: float = 1, repetition_penalty: float = 1.0, frequency_penalty: float = 0.0, max_tokens: int = 2048) -> List[str]:
+    def add_usage(self, usage) -> None:
+        """累计token用量，usage为SDK的CompletionUsage或 {prompt_tokens, completion_tokens}"""
+        if usage is None:
+            return
+        if not isinstance(usage, dict):
+            usage = {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens}
+        for key in self.usage:
+            self.usage[key] += usage.get(key) or 0
+
+    async def aclose(self) -> None:
+        """关闭raw方式的连接池和客户端子进程"""
+        if self.raw is not None:
+            await self.raw.aclose()
+
+    def _pick_client(self) -> int:
+        index = self._next_client
+        self._next_client = (index + 1) % len(self.clients)
+        return index
+
+    async def create_chat_completions(self, messages: List, n: int = 1, top_p: float = 1, temperature: float = 1, repetition_penalty: float = 1.0, frequency_penalty: float = 0.0, max_tokens: int = 2048,
+                                      response_format: Optional[Dict] = None, extra_body: Optional[Dict] = None,
+                                      hedge_key: Hashable = None) -> List[str]:
         assert isinstance(messages, list), "messages must be a list"
-        response = await self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            n=n,
-            top_p=top_p,
-            stream=False,
-            temperature=temperature,
-            frequency_penalty=frequency_penalty,
-            max_tokens=max_tokens,
-            extra_body={"repetition_penalty": repetition_penalty}
-        )
-        responses = [each.message.content for each in response.choices]
-        return responses
-            
-    
+        client_index = self._pick_client()
+        # response_format为OpenAI的结构化输出参数，extra_body中可传入服务端特有的参数（如vLLM的guided_json）
+        optional = {} if response_format is None else {'response_format': response_format}
+        extra_body = {"repetition_penalty": repetition_penalty, **(extra_body or {})}
+
+        async def request(attempt: int) -> List[str]:
+            # 对冲副本发往下一个endpoint（只有一个endpoint时仍发往同一个）
+            url_index = (client_index + attempt) % len(self.clients)
+            if self.raw is not None:
+                payload = {'model': self.model, 'messages': messages, 'n': n, 'top_p': top_p, 'stream': False,
+                           'temperature': temperature, 'frequency_penalty': frequency_penalty,
+                           'max_tokens': max_tokens, **optional, **extra_body}
+                contents, usage = await self.raw.request('chat', url_index, payload)
+                self.add_usage(usage)
+                return contents
+            client = self.clients[url_index]
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                n=n,
+                top_p=top_p,
+                stream=False,
+                temperature=temperature,
+                frequency_penalty=frequency_penalty,
+                max_tokens=max_tokens,
+                extra_body=extra_body,
+                **optional
+            )
+            self.add_usage(response.usage)
+            return [each.message.content for each in response.choices]
+
+        if self.hedge is None:
+            return await request(0)
+        # 对冲阈值和配额按 (调用方给出的key如步骤, 请求方式, n) 分别统计
+        return await self.hedge.run(request, (hedge_key, 'chat', n))
+
+    async def create_completions(self, messages: List[List], n: int = 1, top_p: float = 1, temperature: float = 1, repetition_penalty: float = 1.0, frequency_penalty: float = 0.0, max_tokens: int = 2048,
+                                 response_format: Optional[Dict] = None, extra_body: Optional[Dict] = None,
+                                 hedge_key: Hashable = None) -> List[List[str]]:
+        """在本地应用对话模板后，把多组messages作为prompt列表放在一个 /completions 请求中，返回每个prompt的n个样本"""
+        assert self.transport == 'completions', "create_completions requires transport='completions'"
+        prompts = [self.render_prompt(each) for each in messages]
+        client_index = self._pick_client()
+        # completions接口没有response_format参数，结构化输出参数通过extra_body传给服务端
+        extra_body = {"repetition_penalty": repetition_penalty, **(extra_body or {})}
+        if response_format is not None:
+            extra_body['response_format'] = response_format
+
+        async def request(attempt: int) -> List[List[str]]:
+            url_index = (client_index + attempt) % len(self.clients)
+            if self.raw is not None:
+                payload = {'model': self.model, 'prompt': prompts, 'n': n, 'top_p': top_p, 'stream': False,
+                           'temperature': temperature, 'frequency_penalty': frequency_penalty,
+                           'max_tokens': max_tokens, **extra_body}
+                if self.stop is not None:
+                    payload['stop'] = self.stop
+                results, usage = await self.raw.request('completions', url_index, payload)
+                self.add_usage(usage)
+                return results
+            client = self.clients[url_index]
+            response = await client.completions.create(
+                model=self.model,
+                prompt=prompts,
+                n=n,
+                top_p=top_p,
+                stream=False,
+                temperature=temperature,
+                frequency_penalty=frequency_penalty,
+                max_tokens=max_tokens,
+                stop=self.stop,
+                extra_body=extra_body
+            )
+            self.add_usage(response.usage)
+            # 第i个prompt的样本为 index 在 [i*n, (i+1)*n) 内的choices
+            results = [[] for _ in prompts]
+            for choice in sorted(response.choices, key=lambda choice: choice.index):
+                results[choice.index // n].append(choice.text)
+            return results
 
-        
\ No newline at end of file
+        if self.hedge is None:
+            return await request(0)
+        return await self.hedge.run(request, (hedge_key, 'completions', n, len(prompts)))
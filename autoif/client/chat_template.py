@@ -0,0 +1,33 @@
+# 本地应用对话模板，把messages渲染为completions接口的prompt
+from typing import Callable, Dict, List, Optional, Tuple
+
+ChatTemplate = Callable[[List[Dict]], str]
+
+# 生成停止在ChatML的回合结束标记（服务端通常已将其作为EOS，这里显式指定以防万一）
+CHATML_STOP = ["<|im_end|>"]
+
+
+def render_chatml(messages: List[Dict]) -> str:
+    """ChatML模板（Qwen等模型使用），以assistant回合开头结束"""
+    parts = [f"<|im_start|>{message['role']}\n{message.get('content') or ''}<|im_end|>\n" for message in messages]
+    return ''.join(parts) + "<|im_start|>assistant\n"
+
+
+def load_chat_template(name: Optional[str], model: str) -> Tuple[ChatTemplate, Optional[List[str]]]:
+    """返回 (渲染函数, 停止词)
+
+    name为None或'chatml'时使用内置的ChatML模板；'auto'时加载model的tokenizer，其他值视为tokenizer的名称或路径，
+    这两种情况使用tokenizer自带的对话模板，需要安装transformers。
+    """
+    if name is None or name == 'chatml':
+        return render_chatml, CHATML_STOP
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        raise ImportError("使用tokenizer的对话模板需要安装transformers：pip install transformers，或使用 --chat-template chatml")
+    tokenizer = AutoTokenizer.from_pretrained(model if name == 'auto' else name)
+
+    def render(messages: List[Dict]) -> str:
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    return render, None
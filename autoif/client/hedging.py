@@ -0,0 +1,107 @@
+import asyncio
+import bisect
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+R = TypeVar('R')
+
+
+class HedgeWindow:
+    """一类请求的延迟样本和对冲配额"""
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.sorted = []
+        self.dirty = False
+        self.requests = 0
+        self.hedged = 0
+
+
+class HedgePolicy:
+    """对冲请求策略
+
+    请求耗时超过近期成功请求延迟的指定百分位后，再发出一个副本（优先发往另一个endpoint），
+    取先返回的结果并取消另一个。副本数量不超过总请求数的max_ratio。
+    延迟样本和配额按请求的key（如 (步骤, 请求方式, n)）分别统计，输出长度不同的请求不共用阈值，
+    某类请求的配额也不会被之前其他请求积累的配额放大。
+
+    Args:
+        percentile: 触发对冲的延迟百分位（0-100）
+        max_ratio: 对冲请求占总请求数的上限
+        min_samples: 延迟样本数不足时不对冲
+        window: 统计延迟时使用的最近样本数
+    """
+    def __init__(self,
+                 percentile: float = 95.0,
+                 max_ratio: float = 0.05,
+                 min_samples: int = 50,
+                 window: int = 2000):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self._windows: Dict[Hashable, HedgeWindow] = {}
+        # 所有key合计的计数，用于统计
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _get_window(self, key: Hashable) -> HedgeWindow:
+        if key not in self._windows:
+            self._windows[key] = HedgeWindow(self.window)
+        return self._windows[key]
+
+    def record(self, latency: float, key: Hashable = None) -> None:
+        window = self._get_window(key)
+        window.latencies.append(latency)
+        window.dirty = True
+
+    def threshold(self, key: Hashable = None) -> Optional[float]:
+        """key对应请求当前的对冲延迟阈值，样本不足时返回None"""
+        window = self._get_window(key)
+        if len(window.latencies) < self.min_samples:
+            return None
+        if window.dirty:
+            window.sorted = sorted(window.latencies)
+            window.dirty = False
+        index = min(len(window.sorted) - 1, int(len(window.sorted) * self.percentile / 100))
+        return window.sorted[index]
+
+    def try_acquire(self, key: Hashable = None) -> bool:
+        """在key的对冲配额内时占用一次配额"""
+        window = self._get_window(key)
+        if window.hedged + 1 > self.max_ratio * window.requests:
+            return False
+        window.hedged += 1
+        self.hedged += 1
+        return True
+
+    async def run(self, make_request: Callable[[int], Awaitable[R]], key: Hashable = None) -> R:
+        """执行请求并在需要时对冲，make_request(attempt) 中attempt为0表示主请求，1表示副本"""
+        self.requests += 1
+        self._get_window(key).requests += 1
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(make_request(0))
+        tasks = {primary}
+        try:
+            delay = self.threshold(key)
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                if not primary.done() and self.try_acquire(key):
+                    tasks.add(asyncio.ensure_future(make_request(1)))
+
+            # 取最先成功返回的结果；若先完成的请求失败，则继续等待另一个
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        self.record(time.perf_counter() - start, key)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
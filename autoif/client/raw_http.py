@@ -0,0 +1,250 @@
+# 轻量HTTP传输：直接用aiohttp发送JSON，只从响应中提取内容和usage，不构建SDK的pydantic对象
+import asyncio
+import itertools
+import json
+import multiprocessing
+import random
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import aiohttp
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 与openai SDK一致：这些状态码和连接错误会重试
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+PATHS = {'chat': '/chat/completions', 'completions': '/completions'}
+
+Usage = Dict[str, int]
+
+
+def loads(data: bytes) -> Any:
+    """解析JSON，安装了orjson时使用orjson"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+class RawHTTPError(Exception):
+    """请求失败：非200响应，或子进程中的请求出错"""
+
+
+def parse_usage(body: Dict) -> Usage:
+    usage = body.get('usage') or {}
+    return {'prompt_tokens': usage.get('prompt_tokens') or 0,
+            'completion_tokens': usage.get('completion_tokens') or 0}
+
+
+def parse_chat(body: Dict, payload: Dict) -> Tuple[List[str], Usage]:
+    """chat/completions响应 -> (按index排列的回复内容, usage)"""
+    choices = sorted(body['choices'], key=lambda choice: choice.get('index', 0))
+    return [choice['message'].get('content') for choice in choices], parse_usage(body)
+
+
+def parse_completions(body: Dict, payload: Dict) -> Tuple[List[List[str]], Usage]:
+    """completions响应 -> (每个prompt的n个样本, usage)，第i个prompt的样本为index在 [i*n, (i+1)*n) 内的choices"""
+    n = payload.get('n', 1)
+    results = [[] for _ in payload['prompt']]
+    for choice in sorted(body['choices'], key=lambda choice: choice['index']):
+        results[choice['index'] // n].append(choice['text'])
+    return results, parse_usage(body)
+
+
+PARSERS = {'chat': parse_chat, 'completions': parse_completions}
+
+
+class RawHTTPTransport:
+    """用aiohttp直接发送请求的传输层
+
+    请求体和响应用orjson（未安装时用json）编解码，只提取回复内容和usage。
+    每个事件循环使用一个连接池；失败时按SDK的规则重试（408/409/429/5xx和连接错误，指数退避）。
+
+    Args:
+        base_urls: 服务地址列表，请求时按下标选择
+        headers: 请求头（含认证）
+        timeout: 单个请求的超时（秒）
+        max_retries: 最大重试次数
+        max_connections: 连接池的最大连接数
+    """
+    def __init__(self, base_urls: List[str], headers: Dict[str, str], timeout: float = 600,
+                 max_retries: int = 2, max_connections: int = 1000):
+        self.base_urls = base_urls
+        self.headers = headers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # 连接池绑定创建时的事件循环，事件循环变化（如多次asyncio.run）时重新创建
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._loop = loop
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers
+            )
+        return self._session
+
+    async def request(self, kind: str, url_index: int, payload: Dict) -> Tuple[Any, Usage]:
+        """发送请求，kind为chat或completions，返回 (提取的内容, usage)"""
+        session = self._get_session()
+        url = self.base_urls[url_index] + PATHS[kind]
+        data = dumps(payload)
+        error: Exception = RawHTTPError("no attempt")
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(min(8.0, 0.5 * 2 ** (attempt - 1)) * (0.75 + random.random() / 2))
+            try:
+                async with session.post(url, data=data) as response:
+                    body = await response.read()
+                    if response.status == 200:
+                        return PARSERS[kind](loads(body), payload)
+                    error = RawHTTPError(f"HTTP {response.status}: {body[:500].decode('utf-8', 'replace')}")
+                    if response.status not in RETRY_STATUSES:
+                        raise error
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+        raise error
+
+    async def aclose(self) -> None:
+        if self._session is not None and not self._session.closed and self._loop is asyncio.get_running_loop():
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+
+# 发给子进程的取消消息：(CANCEL, 请求ID)
+CANCEL = 'cancel'
+
+
+def _client_process(requests: multiprocessing.Queue, responses: multiprocessing.Queue, transport_kwargs: Dict) -> None:
+    asyncio.run(_serve_requests(requests, responses, transport_kwargs))
+
+
+async def _serve_requests(requests: multiprocessing.Queue, responses: multiprocessing.Queue, transport_kwargs: Dict) -> None:
+    """子进程：从requests读取 (请求ID, kind, 地址下标, 请求体)，并发发送，结果写入responses；
+    读到 (CANCEL, 请求ID) 时取消该请求（主进程中已取消，不再回传结果）"""
+    transport = RawHTTPTransport(**transport_kwargs)
+    loop = asyncio.get_running_loop()
+    tasks: Dict[int, asyncio.Task] = {}
+
+    async def handle(request_id: int, kind: str, url_index: int, payload: Dict) -> None:
+        try:
+            responses.put((request_id, True, await transport.request(kind, url_index, payload)))
+        except Exception as e:
+            # 只传回错误信息，保证结果总能序列化
+            responses.put((request_id, False, f"{type(e).__name__}: {e}"))
+
+    while True:
+        item = await loop.run_in_executor(None, requests.get)
+        if item is None:
+            break
+        if item[0] == CANCEL:
+            task = tasks.get(item[1])
+            if task is not None:
+                task.cancel()
+            continue
+        request_id = item[0]
+        task = asyncio.create_task(handle(*item))
+        tasks[request_id] = task
+        task.add_done_callback(lambda _, request_id=request_id: tasks.pop(request_id, None))
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    await transport.aclose()
+
+
+def _resolve(future: asyncio.Future, ok: bool, value: Any) -> None:
+    if future.done():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(RawHTTPError(value))
+
+
+class ProcessTransport:
+    """把请求轮流分给多个客户端子进程，每个子进程有自己的事件循环和RawHTTPTransport
+
+    HTTP收发和JSON解析都在子进程中进行，只有请求体和提取出的内容在进程间传输（由队列的后台线程序列化），
+    主进程的事件循环只负责调度。子进程在第一次请求时启动（spawn方式）。
+
+    Args:
+        processes: 子进程数
+        **transport_kwargs: RawHTTPTransport的参数
+    """
+    def __init__(self, processes: int, **transport_kwargs):
+        self.processes = processes
+        self.transport_kwargs = transport_kwargs
+        self._ids = itertools.count()
+        self._pending: Dict[int, Tuple[asyncio.Future, asyncio.AbstractEventLoop]] = {}
+        self._requests: List[multiprocessing.Queue] = []
+        self._responses: Optional[multiprocessing.Queue] = None
+        self._workers: List[multiprocessing.Process] = []
+        self._reader: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._workers:
+                return
+            context = multiprocessing.get_context('spawn')
+            self._responses = context.Queue()
+            self._requests = [context.Queue() for _ in range(self.processes)]
+            self._workers = [context.Process(target=_client_process, args=(queue, self._responses, self.transport_kwargs),
+                                             daemon=True)
+                             for queue in self._requests]
+            for worker in self._workers:
+                worker.start()
+            self._reader = threading.Thread(target=self._read_responses, args=(self._responses,), daemon=True)
+            self._reader.start()
+
+    def _read_responses(self, responses: multiprocessing.Queue) -> None:
+        """后台线程：把子进程的结果交给发出请求的事件循环"""
+        while True:
+            item = responses.get()
+            if item is None:
+                return
+            request_id, ok, value = item
+            entry = self._pending.pop(request_id, None)
+            if entry is None:
+                continue  # 请求已取消（如对冲请求中落后的一方）
+            future, loop = entry
+            try:
+                loop.call_soon_threadsafe(_resolve, future, ok, value)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    async def request(self, kind: str, url_index: int, payload: Dict) -> Tuple[Any, Usage]:
+        if not self._workers:
+            self._start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request_id = next(self._ids)
+        self._pending[request_id] = (future, loop)
+        queue = self._requests[request_id % self.processes]
+        queue.put((request_id, kind, url_index, payload))
+        try:
+            return await future
+        finally:
+            # 仍在等待结果（请求被取消，如对冲请求中落后的一方）时通知子进程取消，释放其连接
+            if self._pending.pop(request_id, None) is not None:
+                queue.put((CANCEL, request_id))
+
+    async def aclose(self) -> None:
+        """等待子进程处理完已发出的请求后退出"""
+        if not self._workers:
+            return
+        for queue in self._requests:
+            queue.put(None)
+        await asyncio.to_thread(lambda: [worker.join() for worker in self._workers])
+        self._responses.put(None)
+        self._reader.join()
+        self._workers, self._requests, self._responses, self._reader = [], [], None, None
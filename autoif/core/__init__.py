@@ -1,3 +1,9 @@
-from .autoif import AutoIF
+__all__ = ['AutoIF']
 
-__all__ = ['AutoIF'] 
\ No newline at end of file
+
+def __getattr__(name):
+    # 延迟导入，使 planner、shard 等轻量模块无需加载客户端依赖
+    if name == 'AutoIF':
+        from .autoif import AutoIF
+        return AutoIF
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,9 +6,12 @@ from .base import BaseAutoIF
 from .rft import RFTMixin
 from .backtranslator import BackTranslatorMixin
 from .query import QueryMixin
+from .dpo import DPOMixin
+from .harvest import HarvestMixin
+from .planner import plan_run
 import os
 import shutil
-class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin):
+class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin, DPOMixin, HarvestMixin):
     """
     AutoIF主类，集成所有功能模块
     
@@ -20,7 +23,11 @@ class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin):
     5. 反向验证过滤
     6. 拼接ShareGPT查询
     7. 查询验证
-    8. 构建SFT数据
+    8. 评分
+    9. 过滤
+    10. 构建SFT数据
+    11. DPO打分（复用步骤7的回复得分）
+    12. 构建DPO数据
     """
     
     async def run_pipeline(self, 
@@ -30,8 +37,8 @@ class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin):
         运行完整的处理流程
         
         Args:
-            start_step: 起始步骤（1-8），默认从头开始
-            end_step: 结束步骤（1-8），默认运行到最后
+            start_step: 起始步骤（1-12），默认从头开始
+            end_step: 结束步骤（1-12），默认运行到最后
         """
         pipeline_steps = [
             (1, self.RFT, "RFT生成指令"),
@@ -43,7 +50,9 @@ class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin):
             (7, self.query_verification, "查询验证"),
             (8, self.score_quality, "评分"),
             (9, self.score_filter, "过滤"),
-            (10, self.construct_sft_data, "构建SFT数据")
+            (10, self.construct_sft_data, "构建SFT数据"),
+            (11, self.dpo_score_responses, "DPO打分"),
+            (12, self.construct_dpo_pairs, "构建DPO数据")
         ]
         
         # 确定起始步骤
@@ -56,15 +65,34 @@ class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin):
                     print(f"发现缓存: 步骤 {i}")
                     break
         else:
-            shutil.rmtree(self.cache_dir)
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
         start_step = start_step or 1
         end_step = end_step or len(pipeline_steps)
         
+        # 分片运行共享运行目录中步骤1生成的指令，各分片从步骤2开始
+        if self.is_sharded and start_step <= 1:
+            if not os.path.exists(os.path.join(self.run_dir, "augment_instructions.txt")):
+                raise RuntimeError("分片运行前需要先以非分片方式完成步骤1")
+            print(f"分片 {self.shard_id}/{self.num_shards}: 复用已有的步骤1结果")
+            start_step = 2
+        
         if start_step > end_step:
             print("end_step 不能小于 start_step")
             return
         
+        # 输出文件仍在后台写入的 (步骤, 文件名)，写入完成后再删除该步骤的缓存，中断后可从缓存恢复
+        deferred_steps = []
+
+        def clear_deferred_caches():
+            for step, names in deferred_steps:
+                for name in names:
+                    self.wait_outputs(name)
+                shutil.rmtree(os.path.join(self.cache_dir, str(step)), ignore_errors=True)
+            deferred_steps.clear()
+
         self.start_time = time.time()
+        if self.budget is not None:
+            self.budget.start()
         print(f"开始运行AutoIF流程 (步骤 {start_step} -> {end_step})")
         if self.resume and start_step > 1:
             print(f"从断点继续: 步骤 {start_step}")
@@ -78,14 +106,42 @@ class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin):
                     # 创建当前步骤的缓存
                     self.set_step_cache(step_num)
                     
+                    # 按剩余步骤的估计工作量为当前步骤分配预算
+                    if self.budget is not None:
+                        plans = plan_run(self.output_dir, self.N, self.seed_instructions,
+                                         start_step=step_num, end_step=end_step, output_counts=self.output_counts,
+                                         max_n=self.max_n)
+                        self.budget.begin_step(step_num, plans)
+                        if any(plan.step == step_num and plan.requests > 0 for plan in plans):
+                            print(f"预算分配: {self.budget.describe()}")
+                    
                     try:
-                        if asyncio.iscoroutinefunction(func):
-                            await func()
-                        else:
-                            func()
+                        is_async = asyncio.iscoroutinefunction(func)
+                        if self.profiler is not None:
+                            # 同步步骤运行时事件循环被阻塞，只对异步步骤采样事件循环延迟
+                            self.profiler.start(step_num, monitor_loop=is_async)
+                        try:
+                            if is_async:
+                                await func()
+                            else:
+                                await self.run_blocking(func)
+                        finally:
+                            if self.profiler is not None:
+                                self.get_step_stats().metrics.update(self.profiler.stop())
+                                self.save_step_stats()
                         
-                        # 步骤成功完成后清理缓存
-                        self.clear_current_cache()
+                        # 步骤成功完成后清理缓存；因预算跳过了部分任务时保留缓存，增加预算后重新运行可从该步骤继续
+                        clear_deferred_caches()
+                        if self.get_step_stats().metrics.get('budget_skipped'):
+                            self._current_cache.close()
+                            self._current_cache = None
+                            print(f"步骤 {step_num} 因预算跳过了部分任务，保留缓存")
+                        elif self._pending_writes:
+                            self._current_cache.close()
+                            self._current_cache = None
+                            deferred_steps.append((step_num, list(self._pending_writes)))
+                        else:
+                            self.clear_current_cache()
                         
                     except Exception as e:
                         print(f"步骤 {step_num} 执行出错: {e}")
@@ -98,8 +154,13 @@ class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin):
             print(f"\n执行出错: {e}")
             raise
         finally:
+            self.wait_outputs()
+            clear_deferred_caches()
+            await self.close_clients()
             total_time = timedelta(seconds=int(time.time() - self.start_time))
             print(f"\n运行结束！总用时: {total_time}")
+            if self.budget is not None:
+                print(f"预算使用: {self.budget.requests} 个请求，约 {self.budget.tokens:.0f} tokens")
 
     def run(self, 
             start_step: Optional[int] = None,
@@ -108,7 +169,7 @@ class AutoIF(BaseAutoIF, RFTMixin, BackTranslatorMixin, QueryMixin):
         运行AutoIF流程的同步包装器
         
         Args:
-            start_step: 起始步骤（1-8），默认从头开始
-            end_step: 结束步骤（1-8），默认运行到最后
+            start_step: 起始步骤（1-12），默认从头开始
+            end_step: 结束步骤（1-12），默认运行到最后
         """
         asyncio.run(self.run_pipeline(start_step, end_step)) 
\ No newline at end of file
@@ -1,12 +1,11 @@
 # 反向翻译相关函数
 import re
 from tqdm import tqdm
-import jsonlines
 from functools import partial
 from typing import Generic
 from .base import T, BaseAutoIFProtocol
 from autoif.client.api_client import OpenAIClient
-from autoif.utils import save_jsonl, load_jsonl
+from autoif.utils import OrderedJsonlSink
 import os
 
 class BackTranslatorMixin(Generic[T]):
@@ -15,7 +14,7 @@ class BackTranslatorMixin(Generic[T]):
     
     async def eval_func_backtranslator(self: T):
         print("开始反向翻译")
-        results = load_jsonl(os.path.join(self.output_dir, "cross_validation.jsonl"))
+        results = self.read_output("cross_validation.jsonl")
         
         # 构建翻译prompt
         translate_prompt = """Please translate the following instruction into Chinese, and then translate it back to English. Please make sure the back-translation maintains the original meaning but uses different wording.
@@ -33,27 +32,26 @@ class BackTranslatorMixin(Generic[T]):
                     trans = line[5:].strip()
                     if trans:
                         translations.append(trans)
-            item['back_instruction'] = translations
-            return item
+            # 输入记录可能仍在后台写入文件，复制后再修改
+            return {**item, 'back_instruction': translations}
         
         print(f"开始处理 {len(results)} 个指令")
-        await self.batch_process_async(
-            messages=[self.client.build_messages(translate_prompt.format(instruction=result['instruction'])) 
-                     for result in results],
-            total=len(results),
-            process_funcs=[partial(process_result, item=result) for result in results]
-        )
-        
-        outputs = list(self._current_cache.values())
+        with OrderedJsonlSink(os.path.join(self.output_dir, "backtranslator.jsonl"), keep=True) as sink:
+            await self.batch_process_async(
+                messages=[self.client.build_messages(translate_prompt.format(instruction=result['instruction'])) 
+                         for result in results],
+                total=len(results),
+                process_funcs=[partial(process_result, item=result) for result in results],
+                sink=sink
+            )
         
-        print(f"翻译完成，保存结果")
-        save_jsonl(outputs, os.path.join(self.output_dir, "backtranslator.jsonl"))
+        self.write_output("backtranslator.jsonl", sink.records, written=True)
+        print(f"翻译完成，共 {sink.count} 个结果")
         
     async def eval_func_backtranslator_filter(self: T):
         print("开始反向验证过滤")
-        data = load_jsonl(os.path.join(self.output_dir, "backtranslator.jsonl"))
+        data = self.read_output("backtranslator.jsonl")
         
-        filter_results = []
         filter_count = 0
         count = 0
         
@@ -71,30 +69,33 @@ class BackTranslatorMixin(Generic[T]):
                 return 'neutral'
             return 'contradiction'  # 默认返回contradiction
         
-        for line in tqdm(data, desc="Processing lines"):
-            back_instructions = line["back_instruction"]
-            ori_ins = line['instruction']
-            
-            # 为每个back_instruction构建prompt
-            messages = [build_nli_prompt(ori_ins, back_ins) 
-                       for back_ins in back_instructions[:3]]
-            
-            # 批量处理NLI判断
+        # 所有指令的NLI判断放在同一批中并发处理，下标为 (行号, 回译序号) 展开后的位置
+        messages = []
+        offsets = []
+        for line in data:
+            back_instructions = line["back_instruction"][:3]
+            offsets.append((len(messages), len(back_instructions)))
+            messages.extend(build_nli_prompt(line['instruction'], back_ins) for back_ins in back_instructions)
+        
+        if messages:
             await self.batch_process_async(
                 messages=messages,
                 total=len(messages),
                 process_funcs=process_nli_result,
                 n=8  # 每个prompt生成8个回复
             )
+        
+        filtered = []
+        for line, (start, num) in zip(tqdm(data, desc="Processing lines"), offsets):
+            line = {**line, "nli_scores": [self._current_cache.get(i) for i in range(start, start + num)]}
             
-            line["nli_scores"] = list(self._current_cache.values())
-            
-            if "contradiction" in line["nli_scores"]:
+            # 请求失败的判断同样视为未通过
+            if "contradiction" in line["nli_scores"] or None in line["nli_scores"]:
                 filter_count += 1
                 continue
             
-            filter_results.append(line)
+            filtered.append(line)
             count += 1
+        self.write_output("backtranslator_filter.jsonl", filtered)
         
         print(f"过滤后剩余: {count}, 过滤掉: {filter_count}")
-        save_jsonl(filter_results, os.path.join(self.output_dir, "backtranslator_filter.jsonl")) 
\ No newline at end of file
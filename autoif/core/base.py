@@ -1,126 +1,559 @@
 # 基础类和通用函数
 from autoif.client.api_client import OpenAIClient   
+from autoif.client.hedging import HedgePolicy
 import concurrent.futures
 import asyncio
-from diskcache import Index
+import contextlib
 from tqdm import tqdm
-from typing import List, Protocol, TypeVar, Any
+from typing import TYPE_CHECKING, List, Protocol, TypeVar, Any, Dict, Iterable, AsyncIterable, Iterator, AsyncIterator, Tuple, Callable
 from concurrent.futures import ProcessPoolExecutor
 import os
 import shutil
-from autoif.utils import AsyncCache, md5, ensure_output_dir
+import time
+from autoif.utils import AsyncCache, OrderedJsonlSink, md5, ensure_output_dir, get_run_dir, save_jsonl, load_jsonl
+from .worker import init_worker
+from .shard import shard_dir_name, shard_of
+from .stats import StepStats, save_run_stats, load_run_stats, CHARS_PER_TOKEN
+from .scheduler import DispatchWindow, LengthModel, split_n
+from .budget import RunBudget
+from .planner import STEP_SPECS
+from .profiling import StepProfiler
+
+if TYPE_CHECKING:
+    from .service import SharedResources
 
 class BaseAutoIFProtocol(Protocol):
     batch_size: int
+    max_n: int
+    func_cost_budget: float
+    func_cluster_topk: int
+    func_constant_ratio: float
+    prefilter: bool
+    rejudge_samples: int
+    rejudge_margin: float
+    harvest: bool
+    harvest_candidates: int
+    harvest_per_response: int
+    harvest_max_pass_rate: float
+    schedule: str
+    schedule_window: int | None
+    structured_output: str | None
+    pack_size: int
+    budget: RunBudget | None
+    profiler: StepProfiler | None
+    resources: 'SharedResources | None'
     N: int
+    seed_instructions: str
     client: OpenAIClient
     process_num: int
     start_time: float | None
     cache_dir: str
+    shard_id: int | None
+    num_shards: int
+    run_dir: str
+    is_sharded: bool
     current_step: int
     output_dir: str
     seed_dir: str
     resume: bool
+    seed: int
+    dpo_shards: int
+    dpo_input: str | None
     _current_cache: AsyncCache
+    step_stats: Dict[int, StepStats]
     async def batch_process_async(
         self, 
-        messages: List[dict] | List[List[dict]], 
-        total: int, 
-        process_funcs: List[callable] | callable,
+        messages: List[dict] | List[List[dict]] | None = None, 
+        total: int | None = None, 
+        process_funcs: List[callable] | callable | None = None,
+        sink: OrderedJsonlSink | None = None,
+        tasks: Iterable | AsyncIterable | None = None,
         **kwargs
     ) -> List[Any]: ...
-    def get_process_pool(self) -> ProcessPoolExecutor: ...
+    def get_process_pool(self, shared: dict | None = None) -> ProcessPoolExecutor: ...
+    async def run_blocking(self, func: Callable, *args) -> Any: ...
+    def num_task_chunks(self, num_items: int) -> int: ...
+    def in_shard(self, key: str) -> bool: ...
+    def get_step_stats(self) -> StepStats: ...
+    def save_step_stats(self) -> None: ...
+    def structured_output_kwargs(self, name: str, schema: dict) -> dict: ...
+    def write_output(self, name: str, records: List[Dict], written: bool = False) -> None: ...
+    def read_output(self, name: str) -> List[Dict]: ...
+    def wait_outputs(self, name: str | None = None) -> None: ...
+    def harvest_responses(self, groups: Dict[str, List[Tuple[str, List[Tuple[str, float]]]]]) -> Tuple[List[Dict], List[Dict]]: ...
     # 添加其他基础方法...
 
 T = TypeVar('T', bound=BaseAutoIFProtocol)
 
 class BaseAutoIF:
-    def __init__(self, N, model, api_key, base_url, batch_size, process_num, seed_dir, output_dir='./output', cache_dir='.cache', resume=True):
+    def __init__(self, N, model, api_key, base_url, batch_size, process_num, seed_dir, output_dir='./output', cache_dir='.cache', resume=True,
+                 seed=42, dpo_shards=1, dpo_input=None, shard_id=None, num_shards=1, cache_compress=False,
+                 hedge_percentile=None, hedge_max_ratio=0.05, max_n=128, step_models=None,
+                 func_cost_budget=5.0, func_cluster_topk=1, func_constant_ratio=0.95,
+                 prefilter=True, rejudge_samples=2, rejudge_margin=1.0, schedule='fifo', schedule_window=None,
+                 structured_output=None, budget_tokens=None, budget_requests=None, budget_hours=None,
+                 profile=None, profile_memory=False, transport='chat', chat_template=None, pack_size=32,
+                 resources=None, seed_instructions='./sample_data/seed_instruction.txt',
+                 http_client='sdk', client_processes=1,
+                 harvest=False, harvest_candidates=64, harvest_per_response=2, harvest_max_pass_rate=0.5):
         self.batch_size = batch_size
+        self.max_n = max_n
+        self.func_cost_budget = func_cost_budget
+        self.func_cluster_topk = func_cluster_topk
+        self.func_constant_ratio = func_constant_ratio
+        self.prefilter = prefilter
+        self.rejudge_samples = rejudge_samples
+        self.rejudge_margin = rejudge_margin
+        # 跨指令收割：步骤7用其他指令的验证函数包检查回复，见 harvest.HarvestMixin
+        self.harvest = harvest
+        self.harvest_candidates = harvest_candidates
+        self.harvest_per_response = harvest_per_response
+        self.harvest_max_pass_rate = harvest_max_pass_rate
+        # 请求调度策略，schedule_window为参与排序的待发送任务数（默认为并发数的4倍）
+        self.schedule = schedule
+        self.schedule_window = schedule_window
+        # 服务模式下各任务共享的客户端、进程池、长度模型和并发位置，见 service.SharedResources
+        self.resources = resources
+        self.length_models: Dict[int, LengthModel] = {}
+        # 结构化输出方式：None、json_schema（OpenAI response_format）或 guided_json（vLLM）
+        self.structured_output = structured_output
+        # completions传输方式下每个请求打包的prompt数
+        self.pack_size = pack_size
+        # 运行预算（token数、请求数、小时数），未指定时不限制
+        self.budget = None
+        if budget_tokens is not None or budget_requests is not None or budget_hours is not None:
+            self.budget = RunBudget(budget_tokens, budget_requests,
+                                    budget_hours * 3600 if budget_hours is not None else None)
         self.N = N
         self.seed_dir = seed_dir
-        self.client = OpenAIClient(base_url, api_key, model)
+        # 步骤1、2使用的种子指令文件
+        self.seed_instructions = seed_instructions
+
+        def create_client(client_base_url, client_model):
+            # 每个客户端单独统计延迟和对冲配额
+            def create():
+                hedge = None
+                if hedge_percentile is not None:
+                    hedge = HedgePolicy(percentile=hedge_percentile, max_ratio=hedge_max_ratio)
+                return OpenAIClient(client_base_url, api_key, client_model, hedge=hedge,
+                                    transport=transport, chat_template=chat_template,
+                                    http_client=http_client, client_processes=client_processes)
+            if resources is None:
+                return create()
+            key = (client_base_url, api_key, client_model, hedge_percentile, hedge_max_ratio, transport, chat_template,
+                   http_client, client_processes)
+            return resources.get_client(key, create)
+
+        # step_models: {步骤: (模型, 地址或None)}，未指定的步骤使用默认模型，相同的 (模型, 地址) 共用客户端
+        self.default_client = create_client(base_url, model)
+        self.step_clients: Dict[int, OpenAIClient] = {}
+        clients = {(model, base_url): self.default_client}
+        for step, (step_model, step_base_url) in (step_models or {}).items():
+            key = (step_model, step_base_url or base_url)
+            if key not in clients:
+                clients[key] = create_client(key[1], key[0])
+            self.step_clients[step] = clients[key]
         self.process_num = process_num
         self.start_time = None
-        self.output_dir = os.path.join(output_dir, f"{model}-{md5(seed_dir)}")
-        ensure_output_dir(self.output_dir)
+        # 分片运行时，各分片的输出和缓存位于运行目录下的独立子目录，步骤1的指令在运行目录中共享
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.run_dir = get_run_dir(output_dir, model, seed_dir)
+        self.output_dir = self.run_dir
         self.cache_dir = cache_dir
+        if self.is_sharded:
+            self.output_dir = os.path.join(self.run_dir, shard_dir_name(shard_id, num_shards))
+            self.cache_dir = os.path.join(cache_dir, shard_dir_name(shard_id, num_shards))
+        ensure_output_dir(self.output_dir)
+        # 按步骤剖析主进程和进程池worker，结果写入输出目录的profile子目录
+        # profile为剖析方式（sample或cprofile），profile_memory为是否记录tracemalloc快照
+        self.profiler = StepProfiler(self.output_dir, profile, profile_memory) if profile else None
         self.resume = resume
+        self.cache_compress = cache_compress
         self.current_step = 0
         self._current_cache = None
+        self.seed = seed
+        self.dpo_shards = dpo_shards
+        self.dpo_input = dpo_input
+        self.step_stats: Dict[int, StepStats] = {}
+        # 步骤间在内存中传递的输出 {文件名: 记录}，文件由后台线程写入
+        self._outputs: Dict[str, List[Dict]] = {}
+        # 本次运行中各输出的记录数，文件可能仍在后台写入，规划预算时代替文件行数
+        self.output_counts: Dict[str, int] = {}
+        self._pending_writes: Dict[str, concurrent.futures.Future] = {}
+        self._output_writer: concurrent.futures.ThreadPoolExecutor | None = None
+
+    @property
+    def clients(self) -> List[OpenAIClient]:
+        """所有步骤使用的客户端（去重）"""
+        return list({id(client): client for client in [self.default_client, *self.step_clients.values()]}.values())
+
+    async def close_clients(self) -> None:
+        """关闭客户端的连接池和子进程，服务模式下客户端由服务统一关闭"""
+        if self.resources is None:
+            for client in self.clients:
+                await client.aclose()
+
+    @property
+    def client(self) -> OpenAIClient:
+        """当前步骤使用的客户端"""
+        return self.step_clients.get(self.current_step, self.default_client)
+
+    @property
+    def is_sharded(self) -> bool:
+        return self.shard_id is not None and self.num_shards > 1
+
+    def in_shard(self, key: str) -> bool:
+        """判断key（指令）是否属于当前分片"""
+        return not self.is_sharded or shard_of(key, self.num_shards) == self.shard_id
+
+    def get_step_stats(self) -> StepStats:
+        """当前步骤的统计"""
+        return self.step_stats.setdefault(self.current_step, StepStats())
+
+    def get_length_model(self) -> LengthModel:
+        """当前步骤的输出长度模型，以上次运行该步骤的平均输出长度（没有时为运行计划的默认估计）为先验
+
+        服务模式下同一模型的同一步骤在任务之间共用长度模型。
+        """
+        if self.resources is not None:
+            key = (self.client.model, self.current_step)
+            if key not in self.resources.length_models:
+                self.resources.length_models[key] = self._new_length_model()
+            return self.resources.length_models[key]
+        if self.current_step not in self.length_models:
+            self.length_models[self.current_step] = self._new_length_model()
+        return self.length_models[self.current_step]
+
+    def _new_length_model(self) -> LengthModel:
+        previous = load_run_stats(self.output_dir).get(self.current_step)
+        prior = previous.completion_chars / previous.samples if previous and previous.samples else None
+        if prior is None and self.current_step in STEP_SPECS:
+            prior = STEP_SPECS[self.current_step]['completion_tokens'] * CHARS_PER_TOKEN
+        return LengthModel(prior)
+
+    @staticmethod
+    def prompt_chars(message: List[dict]) -> int:
+        return sum(len(each.get('content') or '') for each in message)
+
+    def structured_output_kwargs(self, name: str, schema: dict) -> dict:
+        """按结构化输出方式生成约束回复格式的请求参数，未开启时为空"""
+        if self.structured_output == 'json_schema':
+            return {'response_format': {'type': 'json_schema', 'json_schema': {'name': name, 'schema': schema}}}
+        if self.structured_output == 'guided_json':
+            return {'extra_body': {'guided_json': schema}}
+        return {}
+
+    def save_step_stats(self) -> None:
+        if self.current_step in self.step_stats:
+            save_run_stats(self.output_dir, {self.current_step: self.step_stats[self.current_step]})
+
+    def write_output(self, name: str, records: List[Dict], written: bool = False) -> None:
+        """保存步骤输出：记录留在内存中交给下一个步骤，文件在后台线程中写入（先写临时文件再替换）
+
+        written为True表示文件已写好（如OrderedJsonlSink流式写出的结果），只在内存中保留记录。
+        交出的记录会被后台线程序列化，读取方修改记录前需要先复制。
+        """
+        self._outputs[name] = records
+        self.output_counts[name] = len(records)
+        if written:
+            return
+        if self._output_writer is None:
+            self._output_writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='autoif-output')
+        previous = self._pending_writes.get(name)
+        if previous is not None:
+            previous.result()
+        self._pending_writes[name] = self._output_writer.submit(self._write_jsonl_atomic, records, os.path.join(self.output_dir, name))
+
+    @staticmethod
+    def _write_jsonl_atomic(records: List[Dict], path: str) -> None:
+        tmp_path = path + '.tmp'
+        save_jsonl(records, tmp_path)
+        os.replace(tmp_path, path)
+
+    def read_output(self, name: str) -> List[Dict]:
+        """读取上一个步骤的输出：同一进程中刚生成的直接从内存取出（只取一次），否则等待后台写入完成后读文件"""
+        records = self._outputs.pop(name, None)
+        if records is not None:
+            return records
+        self.wait_outputs(name)
+        return load_jsonl(os.path.join(self.output_dir, name))
+
+    def wait_outputs(self, name: str | None = None) -> None:
+        """等待后台写入完成（name为None时等待所有文件），写入出错时抛出异常"""
+        names = list(self._pending_writes) if name is None else [name]
+        for each in names:
+            future = self._pending_writes.pop(each, None)
+            if future is not None:
+                future.result()
 
     def set_step_cache(self, step: int):
         """获取指定步骤的缓存"""
         cache_path = os.path.join(self.cache_dir, str(step))
         os.makedirs(cache_path, exist_ok=True)
-        self._current_cache = AsyncCache(cache_path)
+        self._current_cache = AsyncCache(cache_path, compress=self.cache_compress)
     
     def clear_current_cache(self) -> None:
         """清除当前步骤的缓存"""
         if self._current_cache is not None:
-            self._current_cache.stop()  # 停止缓存线程
+            self._current_cache.close()  # 停止后台写入并关闭数据库
             self._current_cache = None
             cache_path = os.path.join(self.cache_dir, str(self.current_step))
             if os.path.exists(cache_path):
                 shutil.rmtree(cache_path)
     
-    async def batch_process_async(self, messages: List | List[List], total, process_funcs, **kwargs):
-        futures = []
-        next_index = 0
-        completed_count = 0
+    @staticmethod
+    def iter_tasks(messages: List | List[List], total: int, process_funcs) -> Iterator[Tuple[int, List, Callable]]:
+        """把消息列表（或所有任务共用的一条消息）和处理函数转换为 (下标, 消息, 处理函数) 任务"""
+        shared_messages = bool(messages) and isinstance(messages[0], dict)
+        for index in range(total):
+            yield (index,
+                   messages if shared_messages else messages[index],
+                   process_funcs[index] if isinstance(process_funcs, list) else process_funcs)
+
+    @staticmethod
+    async def _aiter(tasks: Iterable | AsyncIterable) -> AsyncIterator:
+        if hasattr(tasks, '__aiter__'):
+            async for task in tasks:
+                yield task
+        else:
+            for task in tasks:
+                yield task
+
+    async def batch_process_async(self, messages: List | List[List] | None = None, total: int | None = None, process_funcs=None,
+                                  sink: OrderedJsonlSink | None = None, tasks: Iterable | AsyncIterable | None = None, **kwargs):
+        """并发处理请求，结果写入步骤缓存
+
+        任务可以是消息列表和处理函数，也可以是 (下标, 消息, 处理函数) 的迭代器或异步迭代器，
+        后者在有空闲并发位置时才逐个读取，内存占用与步骤规模无关；total只用于显示进度。
+        按调度策略（fifo/longest/bucket）从最多schedule_window个待发送任务中选择先发送的任务，
+        预计耗时由prompt长度和当前步骤在线拟合的输出长度估计。
+        同一批中消息相同的任务合并为一个n更大的请求（每个请求的n不超过max_n），返回的样本再按顺序分回各下标。
+        单个任务的n超过max_n时拆分为多个请求。
+        指定sink时（下标需从0开始连续），结果（包括断点续传时缓存中的结果）按下标顺序流式写出；
+        重排缓冲区满时暂停发出新请求，等待最早的未完成请求返回。
+        当前步骤分到的运行预算用完后不再发出新请求，已发出的请求正常完成，其余未缓存的任务被跳过。
+        """
+        if tasks is None:
+            tasks = self.iter_tasks(messages, total, process_funcs)
+        task_iter = self._aiter(tasks)
+        # completions传输方式下，多个prompt打包为一个请求，每个并发位置容纳pack_size个任务（不再按n合并相同的消息）
+        packed = self.client.transport == 'completions'
+        pack = self.pack_size if packed else 1
+        n = kwargs.get('n', 1)
+        window = DispatchWindow(
+            size=self.schedule_window or self.batch_size * 4 * pack,
+            slots=self.batch_size,
+            policy=self.schedule,
+            per_request=1 if packed else max(1, self.max_n // n),  # 单个请求最多合并的任务数
+            pack=pack,
+            request_parts=1 if packed else len(split_n(n, self.max_n)),  # n超过max_n的任务拆分的请求数
+        )
+        exhausted = False
+        over_budget = False
+        reserved = {}  # 请求 -> 预留的预算token数
+        stats = self.get_step_stats()
+        length_model = self.get_length_model()
+        start_time = time.time()
+        hedge = self.client.hedge
+        hedge_counts = (hedge.hedged, hedge.hedge_wins) if hedge is not None else None
+        usage_before = dict(self.client.usage)
+        skipped_before = stats.metrics.get('budget_skipped', 0)
         
         pbar = tqdm(total=total, desc="Processing")
         try:
-            while completed_count < total:
+            while True:
                 results = {}
-                while len(futures) < self.batch_size and next_index < total:
-                    if next_index in self._current_cache:
+                if not over_budget and self.budget is not None and self.budget.exhausted():
+                    over_budget = True
+                    for index, _, _ in window.clear():
+                        self.skip_task(index, sink, stats, pbar)
+                # 读取任务直到窗口填满，已缓存的任务直接跳过
+                while not exhausted and not window.full:
+                    try:
+                        item = await task_iter.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    index, msg, _ = item
+                    if index in self._current_cache:
+                        if sink is not None:
+                            sink.put(index, self._current_cache[index])
                         pbar.update(1)
-                        next_index += 1
                         continue
-                    
-                    msg = messages if isinstance(messages[0], dict) else messages[next_index]
-                    process_func = process_funcs[next_index] if isinstance(process_funcs, list) else process_funcs
-                    task = asyncio.create_task(
-                        self._process_single_task(msg, next_index, process_func, **kwargs)
-                    )
-                    futures.append(task)
-                    next_index += 1
+                    if over_budget:
+                        self.skip_task(index, sink, stats, pbar)
+                        continue
+                    window.add(length_model.expected_cost(self.prompt_chars(msg)), item)
+
+                for request in window.take(sink_full=sink is not None and sink.full):
+                    if self.budget is not None:
+                        # 计入已发出请求的预计用量后预算已用完时，本轮剩余的任务也跳过
+                        over_budget = over_budget or self.budget.exhausted()
+                        if over_budget:
+                            for _, chunk in request:
+                                for index, _ in chunk:
+                                    self.skip_task(index, sink, stats, pbar)
+                            continue
+                    if packed:
+                        task = asyncio.create_task(self._process_packed_task(request, **kwargs))
+                    else:
+                        msg, chunk = request[0]
+                        task = asyncio.create_task(self._process_single_task(msg, chunk, **kwargs))
+                        if len(chunk) > 1:
+                            stats.add_metric('coalesced', len(chunk) - 1)
+                    window.start(task, request)
+                    if self.budget is not None:
+                        expected_chars = 0
+                        for msg, chunk in request:
+                            prompt_chars = self.prompt_chars(msg)
+                            expected_chars += prompt_chars + length_model.predict(prompt_chars) * n * len(chunk)
+                        reserved[task] = self.budget.reserve(expected_chars)
                 
-                if not futures:
+                if not window.in_flight:
                     break
                     
                 done, pending = await asyncio.wait(
-                    futures,
+                    window.in_flight,
                     return_when=asyncio.FIRST_COMPLETED
                 )
                 
-                futures = list(pending)
-                
                 for task in done:
+                    indices = window.finish(task)
+                    if task in reserved:
+                        self.budget.release(reserved.pop(task))
+                    task_results = {}
                     try:
-                        index, result = await task
-                        if result is not None:
-                            results[index] = result
+                        task_results = await task
+                        results.update((index, result) for index, result in task_results.items() if result is not None)
                     except Exception as e:
+                        stats.errors += len(indices)
                         print(f"任务执行出错: {e}")
                     finally:
-                        completed_count += 1
-                        pbar.update(1)
+                        pbar.update(len(indices))
+                    if sink is not None:
+                        for index in indices:
+                            sink.put(index, task_results.get(index))
                 
                 if results:
                     self._current_cache.async_update(results)
                 
         finally:
+            for task in window.in_flight:
+                if task in reserved:
+                    self.budget.release(reserved.pop(task))
             pbar.close()
+            await task_iter.aclose()
             self._current_cache.stop()
+            stats.elapsed += time.time() - start_time
+            skipped = stats.metrics.get('budget_skipped', 0) - skipped_before
+            if skipped:
+                print(f"步骤 {self.current_step} 的预算已用完，跳过 {skipped:.0f} 个任务")
+            if hedge is not None:
+                stats.add_metric('hedged', hedge.hedged - hedge_counts[0])
+                stats.add_metric('hedge_wins', hedge.hedge_wins - hedge_counts[1])
+            # 服务端返回的token用量（服务模式下客户端共享时包含同时运行的其他任务）
+            for key, value in self.client.usage.items():
+                if value > usage_before[key]:
+                    stats.add_metric(f'usage_{key}', value - usage_before[key])
+            self.save_step_stats()
+
+    @staticmethod
+    def skip_task(index: int, sink: OrderedJsonlSink | None, stats: StepStats, pbar) -> None:
+        """因预算用完跳过的任务：不写出结果，但仍占用下标，保证输出按顺序写出"""
+        if sink is not None:
+            sink.put(index, None)
+        stats.add_metric('budget_skipped')
+        pbar.update(1)
+
+    async def _process_single_task(self, message, items, n=1, **kwargs):
+        """发送一个请求（合并的任务共用，n为各任务n之和），返回的样本按顺序分给各 (下标, 处理函数) 并分别处理
+
+        单个任务的n超过max_n时拆分为多个n不超过max_n的请求并发发送，样本按顺序拼接。
+        """
+        async def send(part_n: int) -> List[str]:
+            async with self.request_slot():
+                return await self.client.create_chat_completions(messages=message, n=part_n,
+                                                                 hedge_key=self.current_step, **kwargs)
+
+        parts = split_n(n * len(items), self.max_n)
+        result = [sample for part in await asyncio.gather(*(send(part_n) for part_n in parts)) for sample in part]
+        stats = self.get_step_stats()
+        stats.requests += len(parts)
+        self.record_samples(message, result)
+        if self.budget is not None:
+            self.budget.consume(len(parts), self.prompt_chars(message) * len(parts),
+                                sum(len(each or '') for each in result))
+        return self.apply_process_funcs([(index, process_func, result[i * n:(i + 1) * n])
+                                         for i, (index, process_func) in enumerate(items)])
+
+    async def _process_packed_task(self, request, n=1, **kwargs):
+        """把多个 (消息, [(下标, 处理函数)]) 打包为一个completions请求（每个任务一个prompt），按prompt分回样本"""
+        prompts = [(message, index, process_func) for message, items in request for index, process_func in items]
+        async with self.request_slot():
+            results = await self.client.create_completions([message for message, _, _ in prompts], n=n,
+                                                           hedge_key=self.current_step, **kwargs)
+        stats = self.get_step_stats()
+        stats.requests += 1
+        stats.add_metric('packed_prompts', len(prompts))
+        for (message, _, _), result in zip(prompts, results):
+            self.record_samples(message, result)
+        if self.budget is not None:
+            self.budget.consume(1, sum(self.prompt_chars(message) for message, _, _ in prompts),
+                                sum(len(each or '') for result in results for each in result))
+        return self.apply_process_funcs([(index, process_func, result)
+                                         for (_, index, process_func), result in zip(prompts, results)])
+
+    def request_slot(self):
+        """服务模式下从共享的并发位置中为本任务申请一个（任务之间公平分配），否则不限制"""
+        if self.resources is None:
+            return contextlib.nullcontext()
+        return self.resources.limiter.slot(id(self))
+
+    def record_samples(self, message: List[dict], result: List[str]) -> None:
+        """统计一个prompt的样本数和字符数，并更新输出长度模型"""
+        stats = self.get_step_stats()
+        prompt_chars = self.prompt_chars(message)
+        completion_chars = sum(len(each or '') for each in result)
+        stats.samples += len(result)
+        stats.prompt_chars += prompt_chars
+        stats.completion_chars += completion_chars
+        if result:
+            self.get_length_model().update(prompt_chars, completion_chars / len(result))
+
+    def apply_process_funcs(self, items: List[Tuple[int, Callable, List[str]]]) -> Dict[int, Any]:
+        """对每个 (下标, 处理函数, 样本) 调用处理函数，出错的任务结果为None"""
+        processed = {}
+        for index, process_func, result in items:
+            try:
+                processed[index] = process_func(result)
+            except Exception as e:
+                self.get_step_stats().errors += 1
+                processed[index] = None
+                print(f"任务执行出错: {e}")
+        return processed
+
+
+    def get_process_pool(self, shared: dict | None = None):
+        """创建进程池，shared中的数据通过initializer在每个worker中只传输一次
 
-    async def _process_single_task(self, message, index, process_func, **kwargs):
-        """处理单个任务并保持索引对应关系"""
-        result = await self.client.create_chat_completions(messages=message, **kwargs)
-        processed_result = process_func(result)
-        return index, processed_result
+        服务模式下使用共享的常驻进程池，shared写入临时文件，每个worker只加载一次。
+        """
+        if self.resources is not None:
+            return self.resources.process_pool(shared)
+        profile = self.profiler.worker_config() if self.profiler is not None else None
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.process_num,
+            initializer=init_worker,
+            initargs=(shared or {}, profile)
+        )
 
+    async def run_blocking(self, func: Callable, *args) -> Any:
+        """执行阻塞的函数（同步步骤、等待进程池的循环）：服务模式下放到线程中，不阻塞其他任务的请求"""
+        if self.resources is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
 
-    def get_process_pool(self):
-        return concurrent.futures.ProcessPoolExecutor(max_workers=self.process_num) 
\ No newline at end of file
+    def num_task_chunks(self, num_items: int) -> int:
+        """任务分块数：每个worker至少4块且每块不超过约256项，空闲worker可领取剩余的块"""
+        return min(num_items, max(self.process_num * 4, num_items // 256))
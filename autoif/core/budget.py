@@ -0,0 +1,125 @@
+# 运行预算：限制整个运行的token数、请求数和耗时，按运行计划的估计分配给各步骤
+import math
+import time
+from typing import Dict, List, Optional
+from .planner import StepPlan
+from .stats import estimate_tokens
+
+
+class RunBudget:
+    """运行级预算
+
+    每个LLM步骤开始时，按剩余步骤的估计工作量（见planner）把剩余预算按比例分给当前步骤，
+    前面步骤节省或超出的预算由后面的步骤分摊。步骤用完分到的预算后不再发出新请求，
+    已发出的请求正常完成，未处理的任务被跳过，输出仍是有序且完整的部分结果。
+
+    Args:
+        max_tokens: prompt和completion的估计token总数上限
+        max_requests: 请求数上限
+        max_seconds: 运行耗时上限（秒），从运行开始计时
+    """
+    def __init__(self,
+                 max_tokens: Optional[float] = None,
+                 max_requests: Optional[float] = None,
+                 max_seconds: Optional[float] = None):
+        self.max_tokens = max_tokens
+        self.max_requests = max_requests
+        self.max_seconds = max_seconds
+        self.start_time = time.time()
+        self.tokens = 0.0
+        self.requests = 0
+        # 已发出、尚未返回的请求数和预计token数，判断预算时计入，避免并发请求超出预算
+        self.pending_requests = 0
+        self.pending_tokens = 0.0
+        # 当前步骤的分配：各维度的上限（token数、请求数为累计值，时间为截止时刻）
+        self.step = None
+        self.step_fraction = 1.0
+        self._token_limit = None
+        self._request_limit = None
+        self._deadline = None
+
+    def start(self) -> None:
+        self.start_time = time.time()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.start_time
+
+    def reserve(self, expected_chars: float) -> float:
+        """发出请求时预留预计用量，返回预留的token数，请求结束后用release归还"""
+        tokens = estimate_tokens(expected_chars)
+        self.pending_requests += 1
+        self.pending_tokens += tokens
+        return tokens
+
+    def release(self, tokens: float) -> None:
+        self.pending_requests -= 1
+        self.pending_tokens -= tokens
+
+    def consume(self, requests: int, prompt_chars: float, completion_chars: float) -> None:
+        self.requests += requests
+        self.tokens += estimate_tokens(prompt_chars + completion_chars)
+
+    def begin_step(self, step: int, plans: List[StepPlan]) -> float:
+        """为步骤分配预算，plans为当前步骤及之后各步骤的估计，返回预算能覆盖的估计工作量比例"""
+        llm_plans = [plan for plan in plans if plan.requests > 0]
+        current = next((plan for plan in llm_plans if plan.step == step), None)
+        self.step = step
+        self._token_limit = self._request_limit = self._deadline = None
+        self.step_fraction = 1.0
+        if current is None:
+            return self.step_fraction
+
+        def allocate(remaining: float, need: float, total_need: float) -> float:
+            """按当前步骤的估计占剩余步骤估计的比例分配剩余预算"""
+            if total_need <= 0:
+                return remaining
+            return max(0.0, remaining) * need / total_need
+
+        fractions = []
+        if self.max_tokens is not None:
+            need = current.prompt_tokens + current.completion_tokens
+            share = allocate(self.max_tokens - self.tokens, need,
+                             sum(plan.prompt_tokens + plan.completion_tokens for plan in llm_plans))
+            self._token_limit = self.tokens + share
+            fractions.append(share / need if need > 0 else 1.0)
+        if self.max_requests is not None:
+            remaining = max(0.0, self.max_requests - self.requests)
+            share = allocate(remaining, current.requests, sum(plan.requests for plan in llm_plans))
+            # 请求只能整个发出：分配向上取整（不超过剩余预算），请求很少的步骤（如合并后的步骤1）至少能发出一个请求
+            share = min(remaining, math.ceil(share))
+            self._request_limit = self.requests + share
+            fractions.append(share / current.requests)
+        if self.max_seconds is not None and current.seconds:
+            share = allocate(self.max_seconds - self.elapsed, current.seconds,
+                             sum(plan.seconds or 0 for plan in llm_plans))
+            self._deadline = time.time() + share
+            fractions.append(share / current.seconds)
+        self.step_fraction = min([1.0] + fractions)
+        return self.step_fraction
+
+    def exhausted(self) -> bool:
+        """当前步骤分到的预算（或整个运行的预算）是否已用完，已发出的请求按预计用量计入"""
+        def over(used: float, total: Optional[float], step_limit: Optional[float]) -> bool:
+            if total is None:
+                return False
+            return used >= (total if step_limit is None else min(total, step_limit))
+
+        if (over(self.tokens + self.pending_tokens, self.max_tokens, self._token_limit)
+                or over(self.requests + self.pending_requests, self.max_requests, self._request_limit)):
+            return True
+        if self.max_seconds is not None:
+            if self.elapsed >= self.max_seconds or (self._deadline is not None and time.time() >= self._deadline):
+                return True
+        return False
+
+    def describe(self) -> Dict[str, float]:
+        """当前步骤的分配，用于打印"""
+        allocation = {'fraction': round(self.step_fraction, 3)}
+        if self._token_limit is not None:
+            allocation['tokens'] = round(self._token_limit - self.tokens)
+        if self._request_limit is not None:
+            allocation['requests'] = round(self._request_limit - self.requests)
+        if self._deadline is not None:
+            allocation['seconds'] = round(self._deadline - time.time(), 1)
+        return allocation
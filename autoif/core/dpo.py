@@ -0,0 +1,120 @@
+# DPO数据构建相关函数
+import itertools
+import random
+from collections import Counter
+import jsonlines
+from typing import Generic, Dict, List, Tuple
+from .base import T, BaseAutoIFProtocol
+from .query import QueryMixin
+from autoif.utils import md5
+import os
+
+class DPOMixin(Generic[T]):
+    """DPO数据构建的Mixin类，复用查询验证阶段的并行验证和逐回复得分"""
+    def __init__(self: T):
+        self: BaseAutoIFProtocol
+
+    def dpo_scores_path(self: T) -> str:
+        """DPO使用的回复得分：步骤7的query_scores.jsonl，指定dpo_input时为外部数据的得分dpo_scores.jsonl"""
+        name = "query_scores.jsonl" if self.dpo_input is None else "dpo_scores.jsonl"
+        return os.path.join(self.output_dir, name)
+
+    async def dpo_score_responses(self: T):
+        """计算每个回复的通过率
+
+        步骤7已经写出query_scores.jsonl时直接复用，不再重复执行验证函数；
+        指定了dpo_input（包含prompt、eval_func和gpt-answer的外部数据）时对其并行打分，
+        得分写入dpo_scores.jsonl，不覆盖步骤7的得分。
+        """
+        scores_path = self.dpo_scores_path()
+        if self.dpo_input is None:
+            if not os.path.exists(scores_path):
+                raise FileNotFoundError(f"未找到 {scores_path}，请先运行步骤7或指定 dpo_input")
+            print(f"复用查询验证的回复得分: {scores_path}")
+            return
+
+        print(f"开始为DPO数据打分: {self.dpo_input}")
+        def score() -> int:
+            with jsonlines.open(self.dpo_input) as reader:
+                return sum(1 for _ in self.verify_responses(reader, scores_path, extract_query=False))
+
+        count = await self.run_blocking(score)
+        print(f"打分完成，共 {count} 个查询")
+
+    @staticmethod
+    def sample_dpo_pairs(responses: List[Tuple[str, float]], rng: random.Random) -> List[Tuple[str, str]]:
+        """从带通过率的回复中采样正负样本对：通过率>=0.5为正例，0为负例"""
+        positive_cases = sorted({response for response, acc in responses if acc >= 0.5})
+        negative_cases = sorted({response for response, acc in responses if acc == 0})
+
+        if len(positive_cases) >= 2 or len(negative_cases) >= 2:
+            k = 2
+        elif len(positive_cases) >= 1 or len(negative_cases) >= 1:
+            k = 1
+        else:
+            return []
+        positive_samples = rng.sample(positive_cases, min(k, len(positive_cases)))
+        negative_samples = rng.sample(negative_cases, min(k, len(negative_cases)))
+        return sorted(set(itertools.product(positive_samples, negative_samples)))
+
+    def construct_dpo_pairs(self: T):
+        """构建DPO正负样本对，按prompt哈希分片写出
+
+        prompt相同的记录合并回复后一起采样；每个prompt的随机数种子由全局seed和prompt共同决定，结果与记录顺序和分片数无关。
+        """
+        print("开始构建DPO数据")
+        scores_path = self.dpo_scores_path()
+        num_shards = self.dpo_shards
+        shard_paths = [os.path.join(self.output_dir, f"dpo_pairs-{i:05d}-of-{num_shards:05d}.jsonl")
+                       for i in range(num_shards)]
+        writers = [jsonlines.open(path, mode='w') for path in shard_paths]
+
+        # 开启跨指令收割时，步骤7的得分之后再读取收割的打分记录
+        paths = [scores_path]
+        harvest_path = os.path.join(self.output_dir, "harvest_scores.jsonl")
+        self.wait_outputs("harvest_scores.jsonl")
+        if self.harvest and self.dpo_input is None and os.path.exists(harvest_path):
+            paths.append(harvest_path)
+
+        def read_items():
+            for path in paths:
+                with jsonlines.open(path) as reader:
+                    for item in reader:
+                        if 'prompt' in item:
+                            prompt = item['prompt']
+                        else:
+                            prompt = QueryMixin.build_sft_input(item['query'], item['instruction'])
+                        yield prompt, md5(prompt), item['response']
+
+        # prompt相同的记录（如同一指令下重复的query）合并回复后再采样：先统计各prompt的记录数，
+        # 只出现一次的直接写出，重复的暂存到读完后合并
+        counts = Counter(key for _, key, _ in read_items())
+        merged: Dict[str, Tuple[str, List]] = {}
+
+        pair_count = 0
+
+        def write_pairs(prompt: str, key: str, responses: List) -> None:
+            nonlocal pair_count
+            rng = random.Random(f"{self.seed}-{key}")
+            shard = int(key, 16) % num_shards
+            for positive, negative in self.sample_dpo_pairs(responses, rng):
+                writers[shard].write({
+                    "instruction": prompt,
+                    "positive": positive,
+                    "negative": negative
+                })
+                pair_count += 1
+
+        try:
+            for prompt, key, responses in read_items():
+                if counts[key] == 1:
+                    write_pairs(prompt, key, responses)
+                else:
+                    merged.setdefault(key, (prompt, []))[1].extend(responses)
+            for key, (prompt, responses) in merged.items():
+                write_pairs(prompt, key, responses)
+        finally:
+            for writer in writers:
+                writer.close()
+
+        print(f"生成DPO数据 {pair_count} 条, 保存到 {num_shards} 个分片: {shard_paths[0]} ...")
@@ -0,0 +1,230 @@
+# 验证函数的静态分析：基于AST的安全检查、语义去重与正则灾难性回溯检查
+import ast
+from typing import Iterable, List, Optional
+try:
+    import re._parser as _re_parser
+    import re._constants as _re_constants
+except ImportError:  # Python < 3.11
+    import sre_parse as _re_parser
+    import sre_constants as _re_constants
+
+# 允许导入的模块（只允许纯计算类的标准库和常用文本处理库）
+ALLOWED_IMPORTS = frozenset({
+    're', 'string', 'math', 'collections', 'itertools', 'functools',
+    'json', 'unicodedata', 'statistics', 'textwrap', 'datetime',
+    'typing', 'operator', 'difflib', 'random', 'nltk', 'langdetect',
+    'emoji', 'numpy',
+})
+
+# 禁止使用的内置函数
+FORBIDDEN_CALLS = frozenset({
+    'eval', 'exec', 'compile', 'open', '__import__', 'exit', 'quit',
+    'input', 'breakpoint', 'globals', 'locals', 'vars', 'getattr',
+    'setattr', 'delattr', 'memoryview', 'help',
+})
+
+# 禁止访问的属性名：网络访问（nltk.download）、文件读写（numpy的save/load/fromfile等、nltk.data）
+# 和可以编译、执行外部代码的子模块
+FORBIDDEN_ATTRS = frozenset({
+    'download', 'data',
+    'save', 'savez', 'savez_compressed', 'savetxt', 'load', 'loadtxt', 'genfromtxt', 'fromfile',
+    'tofile', 'fromregex', 'memmap', 'open_memmap', 'DataSource', 'npyio', 'lib',
+    'ctypeslib', 'f2py', 'distutils', 'testing',
+})
+
+# 第一个参数为正则表达式的re模块函数
+REGEX_FUNCS = frozenset({
+    'compile', 'search', 'match', 'fullmatch', 'findall', 'finditer', 'sub', 'subn', 'split',
+})
+
+
+def _root_module(name: str) -> str:
+    return name.split('.')[0]
+
+
+def is_safe_code(code: str, allowed_imports: Iterable[str] = ALLOWED_IMPORTS) -> bool:
+    """基于AST检查代码是否安全：导入白名单 + 禁止使用的内置函数和属性 + 禁止访问双下划线属性
+
+    禁止的内置函数不论是否直接调用都不允许引用（如 f = open），禁止的属性同样不允许访问或导入。
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+
+    allowed = set(allowed_imports)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if _root_module(alias.name) not in allowed or FORBIDDEN_ATTRS & set(alias.name.split('.')):
+                    return False
+        elif isinstance(node, ast.ImportFrom):
+            if node.level or _root_module(node.module or '') not in allowed:
+                return False
+            if FORBIDDEN_ATTRS & set(node.module.split('.')) or any(
+                    alias.name in FORBIDDEN_ATTRS or alias.name in FORBIDDEN_CALLS for alias in node.names):
+                return False
+        elif isinstance(node, ast.Attribute):
+            if node.attr.startswith('__') and node.attr.endswith('__'):
+                return False
+            if node.attr in FORBIDDEN_ATTRS:
+                return False
+        elif isinstance(node, ast.Name):
+            if node.id.startswith('__') and node.id.endswith('__'):
+                return False
+            if node.id in FORBIDDEN_CALLS:
+                return False
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            return False
+    return True
+
+
+class _Canonicalizer(ast.NodeTransformer):
+    """去掉文档字符串，并将局部变量、参数按出现顺序重命名"""
+
+    def __init__(self, bound_names: set):
+        self.bound_names = bound_names
+        self.mapping = {}
+
+    def _rename(self, name: str) -> str:
+        if name not in self.bound_names:
+            return name
+        if name not in self.mapping:
+            self.mapping[name] = f"_v{len(self.mapping)}"
+        return self.mapping[name]
+
+    def _strip_docstring(self, node):
+        body = node.body
+        if (body and isinstance(body[0], ast.Expr)
+                and isinstance(body[0].value, ast.Constant)
+                and isinstance(body[0].value.value, str)):
+            node.body = body[1:] or [ast.Pass()]
+        return node
+
+    def visit_Module(self, node):
+        self._strip_docstring(node)
+        self.generic_visit(node)
+        return node
+
+    def visit_FunctionDef(self, node):
+        self._strip_docstring(node)
+        if node.name != 'evaluate':
+            node.name = self._rename(node.name)
+        node.returns = None
+        self.generic_visit(node)
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_arg(self, node):
+        node.arg = self._rename(node.arg)
+        node.annotation = None
+        return node
+
+    def visit_Name(self, node):
+        node.id = self._rename(node.id)
+        return node
+
+
+def _bound_names(tree: ast.AST) -> set:
+    """收集代码中绑定的局部名字（赋值目标、参数、嵌套函数名），不包括导入名"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name != 'evaluate':
+            names.add(node.name)
+    return names
+
+
+def canonicalize_func(code: str) -> Optional[str]:
+    """返回代码的规范化形式（忽略空白、注释、文档字符串和变量命名），解析失败返回None"""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    tree = _Canonicalizer(_bound_names(tree)).visit(tree)
+    return ast.unparse(tree)
+
+
+def dedup_funcs(funcs: Iterable[str]) -> List[str]:
+    """按规范化AST去重，保留每组中第一次出现的原始代码"""
+    seen = {}
+    for func in funcs:
+        key = canonicalize_func(func)
+        if key is None:
+            continue
+        seen.setdefault(key, func)
+    return list(seen.values())
+
+
+def _is_unbounded_repeat(op, av) -> bool:
+    return op in (_re_constants.MAX_REPEAT, _re_constants.MIN_REPEAT) and av[1] == _re_constants.MAXREPEAT
+
+
+def _is_ambiguous_body(sub) -> bool:
+    """重复体中是否存在无上限重复，且重复体的其余部分可以匹配空串
+
+    此时一段文本可以按指数多种方式分配给外层和内层重复（如 (\\w+\\s?)+），匹配失败时发生灾难性回溯。
+    """
+    items = list(sub)
+    for i, (op, av) in enumerate(items):
+        others = _re_parser.SubPattern(sub.state, items[:i] + items[i + 1:])
+        if others.getwidth()[0] != 0:
+            continue
+        if _is_unbounded_repeat(op, av):
+            return True
+        if op == _re_constants.SUBPATTERN and _is_ambiguous_body(av[-1]):
+            return True
+        if op == _re_constants.BRANCH and any(_is_ambiguous_body(branch) for branch in av[1]):
+            return True
+        if op in (_re_constants.MAX_REPEAT, _re_constants.MIN_REPEAT) and _is_ambiguous_body(av[2]):
+            return True
+    return False
+
+
+def _has_nested_repeat(parsed) -> bool:
+    """查找重复体有歧义的无上限重复，如 (a+)+、(\\w+\\s?)*、(a|b+)*"""
+    for op, av in parsed:
+        if op in (_re_constants.MAX_REPEAT, _re_constants.MIN_REPEAT):
+            if _is_unbounded_repeat(op, av) and _is_ambiguous_body(av[2]):
+                return True
+            if _has_nested_repeat(av[2]):
+                return True
+        elif op == _re_constants.SUBPATTERN:
+            if _has_nested_repeat(av[-1]):
+                return True
+        elif op == _re_constants.BRANCH:
+            if any(_has_nested_repeat(branch) for branch in av[1]):
+                return True
+        elif op in (_re_constants.ASSERT, _re_constants.ASSERT_NOT):
+            if _has_nested_repeat(av[1]):
+                return True
+    return False
+
+
+def is_redos_pattern(pattern: str) -> bool:
+    """判断正则表达式是否可能灾难性回溯，无法解析的表达式视为安全（运行时会报错）"""
+    try:
+        return _has_nested_repeat(_re_parser.parse(pattern))
+    except Exception:
+        return False
+
+
+def has_redos_pattern(code: str) -> bool:
+    """检查代码中直接传给re模块函数的字面量正则是否可能灾难性回溯"""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in REGEX_FUNCS
+                and isinstance(node.func.value, ast.Name) and node.func.value.id == 're'
+                and node.args and isinstance(node.args[0], ast.Constant)
+                and isinstance(node.args[0].value, str)):
+            if is_redos_pattern(node.args[0].value):
+                return True
+    return False
@@ -0,0 +1,179 @@
+# 跨指令收割：用其他指令的验证函数包检查已生成的回复，通过的回复作为该指令的额外样本，不增加LLM调用
+import os
+import random
+from collections import Counter
+from concurrent.futures import as_completed
+from typing import Callable, Dict, Generic, Iterator, List, Sequence, Tuple
+from tqdm import tqdm
+from .base import T, BaseAutoIFProtocol
+from .query import QueryMixin
+from .worker import chunk_by_cost, get_shared
+from autoif.reward.bundle import BUNDLE_FILE, instruction_id, load_verifier_bundle, load_bundle_funcs
+from autoif.utils import md5
+
+# 每条指令用于探测兼容性的回复数
+HARVEST_PROBE_RESPONSES = 4
+# 回复需通过目标指令的全部验证函数才收割（回复不是按目标指令生成的，比步骤7的要求更严格）
+HARVEST_MIN_SCORE = 1.0
+
+# worker内加载的验证函数包和按指令ID缓存的evaluate函数
+_bundle: Dict = {}
+_bundle_funcs: Dict[str, List[Callable]] = {}
+
+# 按指令分组的步骤7验证结果：指令 -> [(query, [(回复, 通过率)])]
+VerifiedGroups = Dict[str, List[Tuple[str, List[Tuple[str, float]]]]]
+
+
+def bundle_funcs(iid: str) -> List[Callable]:
+    """worker中加载共享数据harvest_bundle指定的验证函数包中某条指令的evaluate函数"""
+    path = get_shared('harvest_bundle')
+    if _bundle.get('path') != path:
+        _bundle.clear()
+        _bundle.update(load_verifier_bundle(path), path=path)
+        _bundle_funcs.clear()
+    if iid not in _bundle_funcs:
+        entry = _bundle['instructions'].get(iid)
+        _bundle_funcs[iid] = load_bundle_funcs(entry, _bundle['magic']) if entry else []
+    return _bundle_funcs[iid]
+
+
+def score_against(iid: str, responses: List[str]) -> List[float]:
+    """回复对指令iid的验证函数的通过率，出错或超时时全部记为0"""
+    funcs = bundle_funcs(iid)
+    if not funcs:
+        return [0.0] * len(responses)
+    try:
+        return QueryMixin.score_responses(funcs, responses)
+    except Exception:
+        return [0.0] * len(responses)
+
+
+class HarvestMixin(Generic[T]):
+    """跨指令收割的Mixin类
+
+    步骤7验证完每个回复在自身指令上的得分后，用其他指令的验证函数包检查这些回复：
+    1. 探测：每条指令取少量回复，在最多harvest_candidates条其他指令上打分。探测回复全部不通过的指令对
+       视为不兼容（如全小写与全大写、要求特定关键词），之后不再检查；
+       在其他指令的探测回复上通过率超过harvest_max_pass_rate的指令视为过于宽松（验证函数几乎不做约束），不收割。
+    2. 收割：兼容的指令对上检查全部回复，通过目标指令全部验证函数的回复成为 (目标指令, query, 回复) 的样本，
+       每个回复最多收割到harvest_per_response条指令。
+    SFT样本沿用来源回复在步骤8的质量评分（步骤9中与来源样本一起过滤），DPO样本在步骤12中与步骤7的得分一起采样。
+    """
+    def __init__(self: T):
+        self: BaseAutoIFProtocol
+
+    @staticmethod
+    def probe_chunk(chunk: List[Tuple[str, List[str], List[str]]]) -> List[Tuple[str, List[Tuple[str, int]]]]:
+        """在worker中探测兼容性：(来源指令ID, 探测回复, 候选指令ID) -> (来源, [(候选, 通过的回复数)])"""
+        outputs = []
+        for source, responses, candidates in chunk:
+            outputs.append((source, [(target, sum(score >= HARVEST_MIN_SCORE for score in score_against(target, responses)))
+                                     for target in candidates]))
+        return outputs
+
+    @staticmethod
+    def harvest_chunk(chunk: List[Tuple[str, List[Tuple[int, List[str]]], List[str]]]) -> List[Tuple[str, int, str, List[float]]]:
+        """在worker中收割：(来源指令ID, [(记录序号, 回复)], 目标指令ID) -> [(来源, 记录序号, 目标, 通过率)]，只返回有回复通过的"""
+        outputs = []
+        for source, items, targets in chunk:
+            for target in targets:
+                for position, responses in items:
+                    scores = score_against(target, responses)
+                    if max(scores, default=0.0) >= HARVEST_MIN_SCORE:
+                        outputs.append((source, position, target, scores))
+        return outputs
+
+    def run_harvest_chunks(self: T, process_pool, func: Callable, chunks: List[List], desc: str) -> Iterator:
+        futures = [process_pool.submit(func, chunk) for chunk in chunks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            try:
+                yield from future.result()
+            except Exception as e:
+                print(f"Error processing result: {e}")
+
+    def harvest_responses(self: T, groups: VerifiedGroups) -> Tuple[List[Dict], List[Dict]]:
+        """对步骤7的验证结果做跨指令收割，返回 (SFT候选样本, DPO打分记录)"""
+        bundle_path = os.path.join(self.output_dir, BUNDLE_FILE)
+        if not os.path.exists(bundle_path):
+            print(f"未找到验证函数包 {bundle_path}，跳过跨指令收割（需重新运行步骤3）")
+            return [], []
+        available = load_verifier_bundle(bundle_path)['instructions']
+        # 只在通过反向验证、参与了步骤6的指令之间收割
+        texts = {instruction_id(instruction): instruction for instruction in groups
+                 if instruction_id(instruction) in available}
+        del available
+        stats = self.get_step_stats()
+
+        # 1. 探测兼容性
+        probes = []
+        for iid, instruction in texts.items():
+            responses = [response for _, scored in groups[instruction] for response, _ in scored][:HARVEST_PROBE_RESPONSES]
+            others = sorted(set(texts) - {iid})
+            rng = random.Random(f"{self.seed}-harvest-{iid}")
+            candidates = rng.sample(others, min(self.harvest_candidates, len(others)))
+            if responses and candidates:
+                probes.append((iid, responses, candidates))
+        probe_sizes = {iid: len(responses) for iid, responses, _ in probes}
+        chunks = chunk_by_cost(probes, [len(responses) * len(candidates) for _, responses, candidates in probes],
+                               self.num_task_chunks(len(probes)))
+
+        with self.get_process_pool({'harvest_bundle': bundle_path}) as process_pool:
+            passed, probed = Counter(), Counter()
+            probe_results = []
+            for source, counts in self.run_harvest_chunks(process_pool, HarvestMixin.probe_chunk, chunks, "Probing"):
+                probe_results.append((source, counts))
+                for target, count in counts:
+                    passed[target] += count
+                    probed[target] += probe_sizes[source]
+            permissive = {target for target in probed if passed[target] > self.harvest_max_pass_rate * probed[target]}
+            compatible = {}
+            for source, counts in probe_results:
+                targets = [target for target, count in counts if count > 0 and target not in permissive]
+                if targets:
+                    compatible[source] = targets
+            stats.add_metric('harvest_permissive', len(permissive))
+            stats.add_metric('harvest_pairs', sum(len(targets) for targets in compatible.values()))
+            print(f"探测 {sum(len(candidates) for _, _, candidates in probes)} 个指令对，"
+                  f"兼容 {stats.metrics['harvest_pairs']:.0f} 个，过于宽松的指令 {len(permissive)} 条")
+
+            # 2. 在兼容的指令对上检查全部回复，结果按记录在groups中的序号对应（同一指令下query可能重复）
+            units = []
+            for source, targets in compatible.items():
+                items = [(position, [response for response, _ in scored])
+                         for position, (_, scored) in enumerate(groups[texts[source]])]
+                for i in range(0, len(items), 64):
+                    units.append((source, items[i:i + 64], targets))
+            chunks = chunk_by_cost(units, [len(targets) * sum(len(responses) for _, responses in items)
+                                           for _, items, targets in units],
+                                   self.num_task_chunks(len(units)))
+            harvested: Dict[Tuple[str, int], Dict[str, List[float]]] = {}
+            for source, position, target, scores in self.run_harvest_chunks(process_pool, HarvestMixin.harvest_chunk, chunks, "Harvesting"):
+                harvested.setdefault((source, position), {})[target] = scores
+
+        return self.build_harvest_records(groups, texts, harvested)
+
+    def build_harvest_records(self: T, groups: VerifiedGroups, texts: Dict[str, str],
+                              harvested: Dict[Tuple[str, int], Dict[str, List[float]]]) -> Tuple[List[Dict], List[Dict]]:
+        """按每个回复最多harvest_per_response条目标指令选择收割结果，选择由seed和回复内容决定"""
+        samples, score_records = [], []
+        for instruction, items in groups.items():
+            source = instruction_id(instruction)
+            for position, (query, scored) in enumerate(items):
+                by_target = harvested.get((source, position))
+                if not by_target:
+                    continue
+                chosen_targets = set()
+                for i, (response, acc) in enumerate(scored):
+                    passing = sorted(target for target, scores in by_target.items() if scores[i] >= HARVEST_MIN_SCORE)
+                    rng = random.Random(f"{self.seed}-{md5(response)}")
+                    targets = sorted(rng.sample(passing, min(self.harvest_per_response, len(passing))))
+                    chosen_targets.update(targets)
+                    # 只有通过自身指令（进入步骤8评分）的回复才能沿用质量评分成为SFT样本
+                    if acc > 0:
+                        samples.extend({'instruction': texts[target], 'query': query, 'response': response,
+                                        'source_instruction': instruction} for target in targets)
+                for target in sorted(chosen_targets):
+                    score_records.append({'instruction': texts[target], 'query': query,
+                                          'response': [[response, score] for (response, _), score in zip(scored, by_target[target])],
+                                          'source_instruction': instruction})
+        return samples, score_records
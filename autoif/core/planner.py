@@ -0,0 +1,158 @@
+# 运行计划：根据已有输出和配置估计每个步骤的请求数、token数和耗时，不访问服务器
+import math
+import os
+from typing import Dict, List, Optional
+from .stats import load_run_stats, estimate_tokens
+from autoif.utils import count_lines
+
+# 各LLM步骤的默认估计：每请求样本数n，每请求prompt token，每样本completion token
+STEP_SPECS = {
+    1: {'name': 'RFT生成指令', 'n': 1, 'prompt_tokens': 600, 'completion_tokens': 800},
+    2: {'name': '生成验证函数和测试用例', 'n': 8, 'prompt_tokens': 250, 'completion_tokens': 350},
+    4: {'name': '反向翻译', 'n': 1, 'prompt_tokens': 120, 'completion_tokens': 80},
+    5: {'name': '反向验证过滤', 'n': 8, 'prompt_tokens': 90, 'completion_tokens': 2},
+    6: {'name': '拼接ShareGPT查询', 'n': 4, 'prompt_tokens': 150, 'completion_tokens': 300},
+    8: {'name': '评分', 'n': 1, 'prompt_tokens': 450, 'completion_tokens': 150},
+}
+
+CPU_STEPS = {
+    3: '交叉验证',
+    7: '查询验证',
+    9: '过滤',
+    10: '构建SFT数据',
+    11: 'DPO打分',
+    12: '构建DPO数据',
+}
+
+# prompt完全相同的步骤（步骤1的扩增请求），同一批的任务合并为n更大的请求
+IDENTICAL_PROMPT_STEPS = frozenset({1})
+
+# 上游输出不存在时使用的经验比例
+DEFAULT_RATIOS = {
+    'instructions_per_rft_request': 25,
+    'cross_validation_pass': 0.5,
+    'nli_pass': 0.8,
+    'queries_per_instruction': 16,
+    'responses_per_query': 4,
+    'response_pass': 0.5,
+}
+
+
+class StepPlan:
+    def __init__(self, step: int, name: str, requests: float = 0, samples: float = 0,
+                 prompt_tokens: float = 0, completion_tokens: float = 0, seconds: Optional[float] = None,
+                 source: str = ''):
+        self.step = step
+        self.name = name
+        self.requests = requests
+        self.samples = samples
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.seconds = seconds
+        self.source = source
+
+
+def plan_run(output_dir: str,
+             N: int,
+             seed_instruction_path: str = "./sample_data/seed_instruction.txt",
+             start_step: int = 1,
+             end_step: int = 12,
+             tokens_per_sec: float = 5000.0,
+             ratios: Optional[Dict[str, float]] = None,
+             output_counts: Optional[Dict[str, int]] = None,
+             max_n: int = 128) -> List[StepPlan]:
+    """估计每个步骤的工作量
+
+    优先使用已有的步骤输出计算输入规模（output_counts中给出的记录数优先于文件行数，
+    用于文件仍在后台写入的情况），缺失时按经验比例从上游推算；
+    token数优先使用run_stats.json中实测的每请求平均值；耗时按实测的completion token吞吐
+    （当前步骤实测值，其次为所有步骤的平均值，最后为tokens_per_sec）估计。
+    请求数按max_n计算：prompt相同的任务合并为一个请求，n超过max_n的任务拆分为多个请求。
+    """
+    ratios = {**DEFAULT_RATIOS, **(ratios or {})}
+    stats = load_run_stats(output_dir)
+
+    def from_output(name: str, estimate: float):
+        """已有输出时使用其行数，否则使用估计值"""
+        count = (output_counts or {}).get(name)
+        if count is None:
+            count = count_lines(os.path.join(output_dir, name))
+        return (estimate, '估计') if count is None else (count, name)
+
+    seed_count = count_lines(seed_instruction_path) or 0
+    augment, augment_source = from_output("augment_instructions.txt", N * ratios['instructions_per_rft_request'])
+    instructions = seed_count + augment
+    cross_validated, cross_source = from_output("cross_validation.jsonl", instructions * ratios['cross_validation_pass'])
+    backtranslated, back_source = from_output("backtranslator.jsonl", cross_validated)
+    nli_passed, nli_source = from_output("backtranslator_filter.jsonl", backtranslated * ratios['nli_pass'])
+    verified, verified_source = from_output("query_verification.jsonl",
+                                            nli_passed * ratios['queries_per_instruction']
+                                            * ratios['responses_per_query'] * ratios['response_pass'])
+
+    step_tasks = {
+        1: (N, 'seed-num'),
+        2: (instructions, augment_source),
+        4: (cross_validated, cross_source),
+        5: (backtranslated * 3, back_source),
+        6: (nli_passed * ratios['queries_per_instruction'], nli_source),
+        8: (verified, verified_source),
+    }
+
+    measured_tps = [s.completion_tokens_per_sec for s in stats.values() if s.completion_tokens_per_sec > 0]
+    default_tps = sum(measured_tps) / len(measured_tps) if measured_tps else tokens_per_sec
+
+    plans = []
+    for step in range(start_step, end_step + 1):
+        if step in CPU_STEPS:
+            plans.append(StepPlan(step, CPU_STEPS[step], source='CPU'))
+            continue
+        spec = STEP_SPECS[step]
+        tasks, source = step_tasks[step]
+        if step in IDENTICAL_PROMPT_STEPS:
+            requests = math.ceil(tasks * spec['n'] / max_n)
+        else:
+            requests = tasks * math.ceil(spec['n'] / max_n)
+        prompt_per_request = spec['prompt_tokens']
+        completion_per_sample = spec['completion_tokens']
+        step_tps = default_tps
+        measured = stats.get(step)
+        if measured is not None and measured.requests > 0:
+            prompt_per_request = estimate_tokens(measured.prompt_chars / measured.requests)
+            if measured.samples > 0:
+                completion_per_sample = estimate_tokens(measured.completion_chars / measured.samples)
+            if measured.completion_tokens_per_sec > 0:
+                step_tps = measured.completion_tokens_per_sec
+        samples = tasks * spec['n']
+        completion_tokens = samples * completion_per_sample
+        plans.append(StepPlan(
+            step, spec['name'],
+            requests=requests,
+            samples=samples,
+            prompt_tokens=requests * prompt_per_request,
+            completion_tokens=completion_tokens,
+            seconds=completion_tokens / step_tps if step_tps > 0 else None,
+            source=source,
+        ))
+    return plans
+
+
+def format_plan(plans: List[StepPlan]) -> str:
+    def fmt_time(seconds: Optional[float]) -> str:
+        if seconds is None:
+            return '-'
+        seconds = int(seconds)
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+    lines = [f"{'步骤':<6}{'请求数':>12}{'样本数':>12}{'prompt tokens':>16}{'completion tokens':>20}{'预计耗时':>12}  依据"]
+    total = StepPlan(0, '合计', seconds=0)
+    for plan in plans:
+        lines.append(f"{plan.step:<6}{plan.requests:>12.0f}{plan.samples:>12.0f}{plan.prompt_tokens:>16.0f}"
+                     f"{plan.completion_tokens:>20.0f}{fmt_time(plan.seconds):>12}  {plan.name} ({plan.source})")
+        total.requests += plan.requests
+        total.samples += plan.samples
+        total.prompt_tokens += plan.prompt_tokens
+        total.completion_tokens += plan.completion_tokens
+        total.seconds += plan.seconds or 0
+    lines.append(f"{'合计':<6}{total.requests:>12.0f}{total.samples:>12.0f}{total.prompt_tokens:>16.0f}"
+                 f"{total.completion_tokens:>20.0f}{fmt_time(total.seconds):>12}")
+    return '\n'.join(lines)
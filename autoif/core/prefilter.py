@@ -0,0 +1,77 @@
+# 质量评分前的启发式过滤：不调用模型即可判定为低质量的回复
+import re
+from typing import List, Optional
+
+STOPWORDS = frozenset({
+    'about', 'above', 'after', 'again', 'also', 'been', 'before', 'being', 'below', 'between',
+    'both', 'could', 'does', 'doing', 'down', 'during', 'each', 'from', 'further', 'have',
+    'having', 'here', 'into', 'just', 'more', 'most', 'once', 'only', 'other', 'over', 'please',
+    'same', 'should', 'some', 'such', 'than', 'that', 'their', 'them', 'then', 'there', 'these',
+    'they', 'this', 'those', 'through', 'under', 'until', 'very', 'what', 'when', 'where', 'which',
+    'while', 'with', 'would', 'your', 'yours', 'will', 'want', 'know', 'like', 'make', 'tell',
+    'give', 'help', 'need', 'used', 'using', 'write', 'explain', 'describe',
+})
+
+# 截断的回复通常停在这些字符上（引号、破折号常是格式约束要求的结尾，不在其中）
+TRUNCATED_ENDINGS = (',', ':', ';', '(', '[', '{')
+# 指令中出现这些名称（或字符本身）时视为指令要求了该结尾，不按截断处理
+ENDING_NAMES = {
+    ',': ('comma',),
+    ':': ('colon',),
+    ';': ('semicolon', 'semi-colon'),
+    '(': ('parenthes', 'bracket'),
+    '[': ('bracket',),
+    '{': ('brace', 'curly', 'json'),
+}
+
+
+def word_tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def repetition_ratio(words: List[str], n: int = 3) -> float:
+    """重复n-gram占比：1 - 不同n-gram数 / n-gram总数"""
+    ngrams = [tuple(words[i:i + n]) for i in range(len(words) - n + 1)]
+    if not ngrams:
+        return 0.0
+    return 1 - len(set(ngrams)) / len(ngrams)
+
+
+def content_words(text: str) -> set:
+    """去掉停用词和短词后的词干（取前5个字母，粗略合并词形变化）"""
+    return {word[:5] for word in word_tokens(text) if len(word) > 3 and word not in STOPWORDS}
+
+
+def names_ending(instruction: str, char: str) -> bool:
+    """指令是否提到了结尾字符（字符本身或其英文名称）"""
+    lowered = instruction.lower()
+    return char in instruction or any(name in lowered for name in ENDING_NAMES.get(char, ()))
+
+
+def prefilter_reason(instruction: str, query: str, response: str,
+                     max_repetition: float = 0.5,
+                     min_words_for_repetition: int = 40,
+                     min_words_for_overlap: int = 80) -> Optional[str]:
+    """返回回复被过滤的原因，通过时返回None
+
+    - empty: 空回复
+    - truncated: 代码块未闭合，或较长的回复停在逗号、冒号、左括号等位置（指令提到该结尾字符时不算）
+    - repetitive: 重复3-gram占比超过max_repetition（指令要求重复时不检查）
+    - off_query: 较长的回复与query的实词没有任何重叠
+    判断都较保守，只过滤明显的低质量回复，其余仍交给模型评分。
+    """
+    text = response.strip()
+    if not text:
+        return 'empty'
+    words = word_tokens(text)
+    if text.count('```') % 2 == 1 or (len(words) >= 20 and text.endswith(TRUNCATED_ENDINGS)
+                                       and not names_ending(instruction, text[-1])):
+        return 'truncated'
+    if ('repeat' not in instruction.lower() and len(words) >= min_words_for_repetition
+            and repetition_ratio(words) > max_repetition):
+        return 'repetitive'
+    query_words = content_words(query)
+    if (len(query_words) >= 5 and len(words) >= min_words_for_overlap
+            and not query_words & {word[:5] for word in words}):
+        return 'off_query'
+    return None
@@ -0,0 +1,230 @@
+# 性能剖析：按步骤记录主进程和进程池worker的调用栈采样（或cProfile）、事件循环延迟和tracemalloc快照
+import asyncio
+import cProfile
+import glob
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from multiprocessing import util
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_DIR = "profile"
+PROFILE_MODES = ('sample', 'cprofile')
+# 调用栈采样间隔（秒）
+SAMPLE_INTERVAL = 0.01
+# 事件循环延迟的采样间隔（秒）
+LOOP_LAG_INTERVAL = 0.05
+# tracemalloc记录的调用栈深度
+TRACEMALLOC_FRAMES = 1
+
+
+def profile_prefix(profile_dir: str, step: int, role: str) -> str:
+    """剖析文件的路径前缀，如 profile/step3.worker"""
+    return os.path.join(profile_dir, f"step{step}.{role}")
+
+
+class StackSampler:
+    """在后台线程中定时采样指定线程的调用栈，开销与被采样代码的调用次数无关
+
+    结果为 {调用栈: 采样次数}，写出为折叠栈格式（每行 "外层;...;内层 次数"），
+    多个文件直接合并即可，也可直接用于flamegraph等工具。
+    """
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, thread_id: Optional[int] = None) -> None:
+        target = thread_id if thread_id is not None else threading.get_ident()
+        self._thread = threading.Thread(target=self._run, args=(target,), daemon=True)
+        self._thread.start()
+
+    def _run(self, thread_id: int) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = self._labels.get(code)
+                if label is None:
+                    label = self._labels[code] = f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})".replace(';', ',')
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.counts
+
+    def dump(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProcessProfile:
+    """单个进程的剖析：调用栈采样或cProfile，可选tracemalloc，stop时写出 prefix.stacks/.prof/.tracemalloc"""
+    def __init__(self, prefix: str, mode: str = 'sample', memory: bool = False):
+        self.prefix = prefix
+        self.mode = mode
+        self.memory = memory
+        self._sampler: Optional[StackSampler] = None
+        self._profile: Optional[cProfile.Profile] = None
+
+    def start(self) -> None:
+        if self.memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler()
+            self._sampler.start()
+
+    def stop(self) -> None:
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.prefix + '.prof')
+            self._profile = None
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler.dump(self.prefix + '.stacks')
+            self._sampler = None
+        if self.memory:
+            tracemalloc.take_snapshot().dump(self.prefix + '.tracemalloc')
+            tracemalloc.stop()
+
+
+class StepProfiler:
+    """主进程按步骤剖析
+
+    每个步骤写出 stepN.main.stacks（调用栈采样）或 stepN.main.prof（cProfile），
+    开启memory时写出 stepN.main.tracemalloc，异步步骤另写出 stepN.loop_lag.json（事件循环延迟）；
+    该步骤创建的进程池worker写出 stepN.worker-PID.* 。同类文件可用 `autoif profile-report` 合并。
+
+    Args:
+        output_dir: 输出目录，剖析文件写入其中的profile子目录
+        mode: sample为低开销的调用栈采样，cprofile为确定性剖析（开销较大，但有精确的调用次数）
+        memory: 是否记录tracemalloc快照（开销较大）
+    """
+    def __init__(self, output_dir: str, mode: str = 'sample', memory: bool = False):
+        self.profile_dir = os.path.join(output_dir, PROFILE_DIR)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.mode = mode
+        self.memory = memory
+        self.step = None
+        self._profile: Optional[ProcessProfile] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._lags: List[float] = []
+
+    def worker_config(self) -> Optional[Dict]:
+        """当前步骤中创建的进程池worker的剖析配置，不在步骤中时为None"""
+        if self.step is None:
+            return None
+        return {'prefix': profile_prefix(self.profile_dir, self.step, 'worker'), 'mode': self.mode, 'memory': self.memory}
+
+    def start(self, step: int, monitor_loop: bool = True) -> None:
+        """开始剖析步骤，monitor_loop为True时在当前事件循环中采样延迟（需在协程中调用）"""
+        self.step = step
+        self._lags = []
+        if monitor_loop:
+            self._monitor = asyncio.ensure_future(self._sample_loop_lag())
+        self._profile = ProcessProfile(profile_prefix(self.profile_dir, step, 'main'), self.mode, self.memory)
+        self._profile.start()
+
+    async def _sample_loop_lag(self) -> None:
+        """每隔LOOP_LAG_INTERVAL醒来一次，实际醒来时间与预期的差即事件循环被阻塞的时间"""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self._lags.append(time.perf_counter() - start - LOOP_LAG_INTERVAL)
+
+    def stop(self) -> Dict[str, float]:
+        """结束剖析并写出文件，返回事件循环延迟的统计（毫秒）"""
+        self._profile.stop()
+        self._profile = None
+
+        metrics = {}
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+            lags = sorted(self._lags)
+            if lags:
+                metrics = {
+                    'loop_lag_mean_ms': sum(lags) / len(lags) * 1000,
+                    'loop_lag_p99_ms': lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+                    'loop_lag_max_ms': lags[-1] * 1000,
+                }
+            with open(profile_prefix(self.profile_dir, self.step, 'loop_lag.json'), 'w', encoding='utf-8') as f:
+                json.dump({'interval': LOOP_LAG_INTERVAL, 'lags': self._lags, **metrics}, f)
+        self.step = None
+        return metrics
+
+
+def start_worker_profile(config: Dict) -> None:
+    """在进程池worker中开始剖析，worker正常退出（进程池关闭）时写出 prefix-PID.*"""
+    profile = ProcessProfile(f"{config['prefix']}-{os.getpid()}", config['mode'], config['memory'])
+    profile.start()
+    # multiprocessing的子进程退出前执行Finalize注册的函数（atexit在子进程中不会执行）
+    util.Finalize(None, profile.stop, exitpriority=10)
+
+
+def profile_files(profile_dir: str, step: Optional[int] = None, role: str = '*', suffix: str = '.prof') -> List[str]:
+    step_pattern = '*' if step is None else str(step)
+    return sorted(glob.glob(os.path.join(profile_dir, f"step{step_pattern}.{role}{suffix}")))
+
+
+def merge_profiles(paths: List[str]) -> Optional[pstats.Stats]:
+    """合并多个cProfile文件（如一个步骤的主进程和所有worker）"""
+    if not paths:
+        return None
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+    return stats
+
+
+def merge_stacks(paths: List[str]) -> Counter:
+    """合并多个折叠栈文件"""
+    counts = Counter()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                counts[stack] += int(count)
+    return counts
+
+
+def top_functions(counts: Counter, limit: int = 30) -> List[Tuple[str, int, int]]:
+    """按调用栈采样统计函数的 (函数, 自身采样数, 包含子调用的采样数)，按自身采样数排序"""
+    own = Counter()
+    inclusive = Counter()
+    for stack, count in counts.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    return [(frame, count, inclusive[frame]) for frame, count in own.most_common(limit)]
+
+
+def top_allocations(paths: List[str], limit: int = 20) -> List[Tuple[str, int, int, int]]:
+    """合并多个tracemalloc快照，按分配位置统计内存占用，返回 (文件, 行号, 字节数, 分配次数)"""
+    sizes: Dict[tuple, List[int]] = {}
+    for path in paths:
+        for stat in tracemalloc.Snapshot.load(path).statistics('lineno'):
+            frame = stat.traceback[0]
+            entry = sizes.setdefault((frame.filename, frame.lineno), [0, 0])
+            entry[0] += stat.size
+            entry[1] += stat.count
+    top = sorted(sizes.items(), key=lambda item: -item[1][0])[:limit]
+    return [(filename, lineno, size, count) for (filename, lineno), (size, count) in top]
@@ -7,16 +7,27 @@ from functools import partial
 from concurrent.futures import as_completed
 import json
 import numpy as np
-from typing import Generic, Dict, List
+import jsonlines
+from typing import Generic, Dict, List, Tuple, Iterable, Iterator
 from .base import T, BaseAutoIFProtocol
+from .worker import chunk_by_cost, get_shared, load_eval_funcs
 from autoif.utils import (
     save_jsonl, 
     load_jsonl, 
     contains_chinese, 
-    with_timeout
+    with_timeout,
+    md5,
+    OrderedJsonlSink
 )
+from .prefilter import prefilter_reason
+from collections import Counter
 import os
 
+# 质量评分的平均分高于该值时保留
+QUALITY_THRESHOLD = 8
+# 每条指令拼接的ShareGPT查询数
+QUERIES_PER_INSTRUCTION = 16
+
 class QueryMixin(Generic[T]):
     def __init__(self: T):
         self: BaseAutoIFProtocol
@@ -25,7 +36,7 @@ class QueryMixin(Generic[T]):
         print("开始拼接ShareGPT查询")
         
         # 读取过滤后的结果
-        filter_results = load_jsonl(os.path.join(self.output_dir, "backtranslator_filter.jsonl"))
+        instructions = self.read_output("backtranslator_filter.jsonl")
         
         # 读取并处理ShareGPT数据
         sft_data = load_jsonl(self.seed_dir)
@@ -34,52 +45,55 @@ class QueryMixin(Generic[T]):
         # 只保留长度在20-300之间且不包含中文的问题
         queries = [each for each in queries if len(each) > 20 and not contains_chinese(each)]
         
-        # 构建输入数据
-        inputs = []
-        for instruction in tqdm(filter_results, desc="Preparing inputs"):
-            ins_queries = random.sample(queries, 16)  # 拼16个
-            for q in ins_queries:
-                prompt = f"Please answer the query strictly following the instruction.\n[instruction] {instruction['instruction']}\n[Query] {q}"
-                item = copy.deepcopy(instruction)
-                item['prompt'] = prompt
-                inputs.append(item)
-        
         def process_result(result: List[str], item: Dict) -> Dict:
             """处理单个结果"""
             responses = [each.strip() for each in result]
             item['gpt-answer'] = responses
             return item
         
-        print(f"开始生成回复，共 {len(inputs)} 个查询")
+        def iter_tasks():
+            """逐条构建输入，有空闲并发位置时才生成"""
+            index = 0
+            for instruction in instructions:
+                # 按指令确定随机种子，采样结果与运行顺序和分片无关
+                rng = random.Random(f"{self.seed}-{md5(instruction['instruction'])}")
+                ins_queries = rng.sample(queries, QUERIES_PER_INSTRUCTION)  # 拼16个
+                # 下标与每条指令使用的查询数无关，预算不同的运行之间缓存仍然对应
+                for j, q in enumerate(ins_queries):
+                    if j >= queries_per_instruction:
+                        sink.put(index, None)
+                    else:
+                        prompt = f"Please answer the query strictly following the instruction.\n[instruction] {instruction['instruction']}\n[Query] {q}"
+                        item = copy.deepcopy(instruction)
+                        item['prompt'] = prompt
+                        yield index, self.client.build_messages(prompt), partial(process_result, item=item)
+                    index += 1
+        
+        # 有运行预算时，按预算能覆盖的比例减少每条指令的查询数，而不是只处理前面的指令
+        queries_per_instruction = QUERIES_PER_INSTRUCTION
+        if self.budget is not None and self.budget.step_fraction < 1:
+            queries_per_instruction = max(1, int(QUERIES_PER_INSTRUCTION * self.budget.step_fraction))
+            print(f"预算不足以覆盖全部查询，每条指令使用 {queries_per_instruction} 个查询")
+        total = len(instructions) * queries_per_instruction
+        print(f"开始生成回复，共 {total} 个查询")
         
-        # 批量处理生成回复
-        await self.batch_process_async(
-            messages=[self.client.build_messages(item['prompt']) for item in inputs],
-            total=len(inputs),
-            process_funcs=[partial(process_result, item=item) for item in inputs],
-            n=4  # 每个query生成4个回复
-        )
+        # 批量处理生成回复，按输入顺序流式写出
+        with OrderedJsonlSink(os.path.join(self.output_dir, "sharegpt_query.jsonl")) as sink:
+            await self.batch_process_async(
+                tasks=iter_tasks(),
+                total=total,
+                sink=sink,
+                n=4  # 每个query生成4个回复
+            )
         
-        print(f"生成完成，共 {len(self._current_cache)} 个结果")
-        save_jsonl(list(self._current_cache.values()), os.path.join(self.output_dir, "sharegpt_query.jsonl"))
+        print(f"生成完成，共 {sink.count} 个结果")
     
     @staticmethod
     @with_timeout
-    def process_single_result(result: Dict) -> List[Dict]:
-        """处理单个结果的函数"""
-        eval_funcs = []
-        for func, score in result['eval_func']:
-            local_vars = {}
-            try:
-                exec(func, {}, local_vars) 
-            except Exception as e:
-                print(e)
-                continue
-            if 'evaluate' in local_vars:
-                eval_funcs.append(local_vars['evaluate'])
-
-        filter_responses = []
-        for response in result['gpt-answer']:
+    def score_responses(eval_funcs: List, responses: List[str]) -> List[float]:
+        """计算每个回复通过验证函数的比例"""
+        scores = []
+        for response in responses:
             acc = []
             for eval_func in eval_funcs:
                 try:
@@ -88,58 +102,127 @@ class QueryMixin(Generic[T]):
                         acc.append(int(res))
                 except:
                     continue
-            acc = np.mean(acc) if acc else 0
-
-            if acc > 0:
-                filter_responses.append(response)
-
-        samples = []
-        for each in filter_responses:
-            try:
-                samples.append({
-                    'instruction': result['instruction'],
-                    'query': re.findall(r'\[Query\](.*)$', result['prompt'], re.DOTALL)[0].strip(),
-                    'response': each
-                })
-            except IndexError:
-                print(result['prompt'])
-        return samples
+            scores.append(float(np.mean(acc)) if acc else 0.0)
+        return scores
+
+    @staticmethod
+    def verify_chunk(chunk: List[Tuple[str, List[Tuple[str, List[str]]]]]) -> List[Tuple[str, str, List[Tuple[str, float]]]]:
+        """在worker中验证一块按指令分组的回复，验证函数源码从共享数据中读取"""
+        outputs = []
+        for instruction, items in chunk:
+            eval_funcs = load_eval_funcs(get_shared(instruction, []))
+            for query, responses in items:
+                try:
+                    scores = QueryMixin.score_responses(eval_funcs, responses)
+                except Exception as e:
+                    print(f"Error processing result: {e}")
+                    continue
+                outputs.append((instruction, query, list(zip(responses, scores))))
+        return outputs
+
+    def build_verification_chunks(self: T, results: Iterable[Dict], group_size: int = 64,
+                                  extract_query: bool = True) -> Tuple[Dict[str, List[str]], List]:
+        """按指令分组构建验证任务
+
+        返回 (共享数据, 任务块)。共享数据为 指令 -> 验证函数源码，只随进程池初始化传输一次；
+        任务块中只包含 (指令, [(query, 回复列表)])，按 函数数×回复数 均衡分块。
+        extract_query为False时直接使用完整prompt作为query。
+        """
+        shared: Dict[str, List[str]] = {}
+        groups: Dict[str, List[Tuple[str, List[str]]]] = {}
+        for result in results:
+            if extract_query:
+                try:
+                    query = re.findall(r'\[Query\](.*)$', result['prompt'], re.DOTALL)[0].strip()
+                except IndexError:
+                    print(result['prompt'])
+                    continue
+            else:
+                query = result['prompt']
+            instruction = result.get('instruction', query)
+            if instruction not in shared:
+                shared[instruction] = [func for func, score in result['eval_func']]
+            groups.setdefault(instruction, []).append((query, result['gpt-answer']))
+
+        units, costs = [], []
+        for instruction, items in groups.items():
+            for i in range(0, len(items), group_size):
+                unit_items = items[i:i+group_size]
+                units.append((instruction, unit_items))
+                costs.append(len(shared[instruction]) * sum(len(responses) for _, responses in unit_items))
+        return shared, chunk_by_cost(units, costs, self.num_task_chunks(len(units)))
+
+    def verify_responses(self: T, results: Iterable[Dict], scores_path: str,
+                         extract_query: bool = True) -> Iterator[Tuple[str, str, List[Tuple[str, float]]]]:
+        """并行计算每个回复的通过率，边计算边写入scores_path并逐条返回 (指令, query, [(回复, 通过率)])"""
+        shared, chunks = self.build_verification_chunks(results, extract_query=extract_query)
+        
+        # 验证函数源码通过进程池initializer传给每个worker一次，任务中只传输回复
+        with self.get_process_pool(shared) as process_pool, jsonlines.open(scores_path, mode='w') as writer:
+            futures = {process_pool.submit(QueryMixin.verify_chunk, chunk): sum(len(items) for _, items in chunk)
+                       for chunk in chunks}
+            with tqdm(total=sum(futures.values()), desc="Verifying") as pbar:
+                for future in as_completed(futures):
+                    try:
+                        verified = future.result()
+                    except Exception as e:
+                        print(f"Error processing result: {e}")
+                        verified = []
+                    for instruction, query, scored in verified:
+                        writer.write({
+                            'instruction': instruction,
+                            # 未抽取query时记录完整prompt
+                            ('query' if extract_query else 'prompt'): query,
+                            'response': [[response, acc] for response, acc in scored]
+                        })
+                        yield instruction, query, scored
+                    pbar.update(futures[future])
     
     async def query_verification(self: T):
         print("开始查询验证")
         results = load_jsonl(os.path.join(self.output_dir, "sharegpt_query.jsonl"))
         all_samples = []
         
-        # 使用进程池处理结果
+        # 使用进程池处理结果，每个回复的通过率同时保存到query_scores.jsonl供DPO阶段复用
         print(f"开始处理 {len(results)} 个结果")
-        batch_size = self.process_num * 4096
-        
-        # 使用上下文管理器创建进程池
-        with self.get_process_pool() as process_pool:
-            for i in range(0, len(results), batch_size):
-                batch_results = results[i:i+batch_size]
-                futures = [process_pool.submit(QueryMixin.process_single_result, result) 
-                          for result in batch_results]
-                
-                for future in tqdm(as_completed(futures), total=len(futures), 
-                                 desc=f"Processing batch {i//batch_size + 1}"):
-                    try:
-                        samples = future.result()
-                        if samples:
-                            all_samples.extend(samples)
-                    except Exception as e:
-                        print(f"Error processing result: {e}")
-                        continue
+        scores_path = os.path.join(self.output_dir, "query_scores.jsonl")
+        # 跨指令收割需要按指令分组的全部验证结果
+        groups: Dict[str, List] = {}
+
+        def collect():
+            for instruction, query, scored in self.verify_responses(results, scores_path):
+                if self.harvest:
+                    groups.setdefault(instruction, []).append((query, scored))
+                for response, acc in scored:
+                    if acc > 0:
+                        all_samples.append({
+                            'instruction': instruction,
+                            'query': query,
+                            'response': response
+                        })
+
+        await self.run_blocking(collect)
 
         print(f"初始样本数: {len(all_samples)}")
         # 去重
         all_samples = list(map(json.loads, set(map(json.dumps, all_samples))))
         print(f"去重后样本数: {len(all_samples)}")
-        save_jsonl(all_samples, os.path.join(self.output_dir, "query_verification.jsonl"))
+        self.write_output("query_verification.jsonl", all_samples)
+
+        if self.harvest:
+            print("开始跨指令收割")
+            harvested, harvest_scores = await self.run_blocking(self.harvest_responses, groups)
+            stats = self.get_step_stats()
+            stats.add_metric('harvested_samples', len(harvested))
+            stats.add_metric('harvested_groups', len(harvest_scores))
+            self.save_step_stats()
+            print(f"收割样本数: {len(harvested)}，DPO打分记录: {len(harvest_scores)}")
+            self.write_output("harvested_samples.jsonl", harvested)
+            self.write_output("harvest_scores.jsonl", harvest_scores)
     
     
     async def score_quality(self: T):
-        all_samples = load_jsonl(os.path.join(self.output_dir, "query_verification.jsonl"))
+        samples = self.read_output("query_verification.jsonl")
         # 构建评分prompt
         prompt_template = """You are an expert that is good at judging whether a response is following the instruction and query.
         [Instruction] {instruction}
@@ -150,64 +233,135 @@ class QueryMixin(Generic[T]):
         Scoring 0 means the response is totally unrelated to the query, while scoring 10 means the response is helpful and highly related to the query.
         Please only provide a score in the format `Score: {{score}}` without any other contents at the last line."""
 
-        # 添加评分prompt
-        for sample in all_samples:
-            sample['prompt'] = prompt_template.format(
-                instruction=sample['instruction'],
-                query=sample['query'],
-                response=sample['response']
-            )
-
         def process_score_result(result: List[str], item: Dict) -> Dict | None:
             """处理评分结果"""
             score_text = result[0].strip()
-            score = re.findall(r'Score: (\d+?)$', score_text)
-            if score:
+            if QueryMixin.parse_score(score_text) is not None:
                 item['gen'] = [score_text]
                 return item
             return None
 
+        def process_rejudge_result(result: List[str]) -> List[str]:
+            """复评结果只保留能解析出分数的评分"""
+            return [text.strip() for text in result if QueryMixin.parse_score(text.strip()) is not None]
+
+        # 第一级：启发式过滤，明显低质量的回复不调用模型；缓存键为样本行号
+        prefiltered = Counter()
+        def iter_tasks():
+            """逐条读取样本，通过启发式过滤的样本添加评分prompt"""
+            for index, sample in enumerate(samples):
+                if self.prefilter:
+                    reason = prefilter_reason(sample['instruction'], sample['query'], sample['response'])
+                    if reason is not None:
+                        prefiltered[reason] += 1
+                        continue
+                # 输入记录可能仍在后台写入文件，复制后再修改
+                sample = {**sample, 'prompt': prompt_template.format(
+                    instruction=sample['instruction'],
+                    query=sample['query'],
+                    response=sample['response']
+                )}
+                yield index, self.client.build_messages(sample['prompt']), partial(process_score_result, item=sample)
+
+        total = len(samples)
         print("开始生成质量评分")
-        # 使用异步批处理进行评分
-        await self.batch_process_async(
-            messages=[self.client.build_messages(item['prompt']) for item in all_samples],
-            total=len(all_samples),
-            process_funcs=[partial(process_score_result, item=item) for item in all_samples],
-        )
-        
-        # 过滤None结果
-        scored_results = []
-        for result in list(self._current_cache.values()):
-            if result is not None:
-                scored_results.append(result)
-        print(f"评分完成，共 {len(scored_results)} 个有效结果")
-        save_jsonl(scored_results, os.path.join(self.output_dir, "score_quality.jsonl"))
+        # 第二级：每个样本评分一次
+        await self.batch_process_async(tasks=iter_tasks(), total=total)
+        stats = self.get_step_stats()
+        for reason, count in prefiltered.items():
+            stats.add_metric(f'prefilter_{reason}', count)
+        print(f"启发式过滤: {dict(prefiltered)}")
+
+        # 第三级：分数接近阈值的样本追加评分，复评结果的缓存键为 total + 行号
+        def iter_rejudge_tasks():
+            for index in range(total):
+                item = self._current_cache.get(index)
+                if item is not None and self.is_borderline_score(item['gen']):
+                    yield total + index, self.client.build_messages(item['prompt']), process_rejudge_result
+
+        if self.rejudge_samples > 0:
+            await self.batch_process_async(tasks=iter_rejudge_tasks(), n=self.rejudge_samples)
+
+        scored = []
+        rejudged = 0
+        for index in range(total):
+            item = self._current_cache.get(index)
+            if item is None:
+                continue
+            extra = self._current_cache.get(total + index)
+            if extra:
+                item['gen'] = item['gen'] + extra
+                rejudged += 1
+            scored.append(item)
+        self.write_output("score_quality.jsonl", scored)
+        stats.add_metric('rejudged', rejudged)
+        self.save_step_stats()
+        print(f"评分完成，共 {len(scored)} 个有效结果，其中 {rejudged} 个接近阈值的结果追加评分")
+
+    @staticmethod
+    def parse_score(text: str) -> int | None:
+        """从评分最后一行解析 Score: N"""
+        score = re.findall(r'Score: (\d+?)$', text)
+        return int(score[0]) if score else None
+
+    @staticmethod
+    def mean_score(gen: List[str]) -> float:
+        scores = [score for score in map(QueryMixin.parse_score, gen) if score is not None]
+        return float(np.mean(scores)) if scores else 0.0
+
+    def is_borderline_score(self: T, gen: List[str]) -> bool:
+        """平均分在 (阈值 - margin, 阈值 + margin] 内时，单次评分不足以确定是否通过"""
+        score = QueryMixin.mean_score(gen)
+        return QUALITY_THRESHOLD - self.rejudge_margin < score <= QUALITY_THRESHOLD + self.rejudge_margin
       
     def score_filter(self: T):
         print("开始查询评分过滤")
         filter_results = []
-        scored_results = load_jsonl(os.path.join(self.output_dir, "score_quality.jsonl"))
+        scored_results = self.read_output("score_quality.jsonl")
         print(f"初始结果数: {len(scored_results)}")
         
         for result in tqdm(scored_results, desc="Filtering results"):
-            scores = []
-            for each in result['gen']:
-                score = re.findall(r'Score: (\d+?)$', each)
-                if score:
-                    scores.append(int(score[0]))
-            score = np.mean(scores) if scores else 0
-            if score > 8:  # quality score
+            if QueryMixin.mean_score(result['gen']) > QUALITY_THRESHOLD:  # quality score
                 filter_results.append(result)
         
         print(f"过滤后结果数: {len(filter_results)}")
         
+        harvest_path = os.path.join(self.output_dir, "harvested_samples.jsonl")
+        self.wait_outputs("harvested_samples.jsonl")
+        if self.harvest and os.path.exists(harvest_path):
+            # 收割的样本沿用来源回复的质量评分，来源样本通过过滤时一起保留
+            kept = {(each['instruction'], each['query'], each['response']): each for each in filter_results}
+            harvested = 0
+            for sample in self.read_output("harvested_samples.jsonl"):
+                source = kept.get((sample['source_instruction'], sample['query'], sample['response']))
+                if source is not None:
+                    filter_results.append({**sample, 'gen': source['gen']})
+                    harvested += 1
+            self.get_step_stats().add_metric('harvested', harvested)
+            self.save_step_stats()
+            print(f"加入收割样本: {harvested}")
+        
         # 统计唯一指令数
         unique_instructions = set()
         for each in filter_results:
             unique_instructions.add(each['instruction'])
         print(f"唯一指令数: {len(unique_instructions)}")
         
-        save_jsonl(filter_results, os.path.join(self.output_dir, "score_filter.jsonl")) 
+        self.write_output("score_filter.jsonl", filter_results)
+
+    @staticmethod
+    def build_sft_input(query: str, instruction: str) -> str:
+        """将query和指令拼接为训练数据的用户输入"""
+        # 首字母大写处理
+        query = query[0].upper() + query[1:]
+        instruction = instruction[0].upper() + instruction[1:]
+        
+        # 构建输入文本
+        if "?" in query:
+            return f"{query} {instruction}."
+        elif "." in query:
+            return f"{query} {instruction}."
+        return f"{query}. {instruction}."
 
     def construct_sft_data(self: T):
         """
@@ -215,21 +369,11 @@ class QueryMixin(Generic[T]):
         将query_score_filter.jsonl转换为标准的对话格式
         """
         print("开始构建SFT数据")
-        data = load_jsonl(os.path.join(self.output_dir, "score_filter.jsonl"))
+        data = self.read_output("score_filter.jsonl")
         
         processed_data = []
         for item in data:
-            # 首字母大写处理
-            query = item['query'][0].upper() + item['query'][1:]
-            instruction = item['instruction'][0].upper() + item['instruction'][1:]
-            
-            # 构建输入文本
-            if "?" in query:
-                inputs = f"{query} {instruction}."
-            elif "." in query:
-                inputs = f"{query} {instruction}."
-            else:
-                inputs = f"{query}. {instruction}."
+            inputs = QueryMixin.build_sft_input(item['query'], item['instruction'])
 
             # 构建对话格式数据
             new_item = {
@@ -247,4 +391,4 @@ class QueryMixin(Generic[T]):
             processed_data.append(new_item)
         
         print(f"生成SFT数据 {len(processed_data)} 条, 保存到 {os.path.join(self.output_dir, 'sft_data.jsonl')}")
-        save_jsonl(processed_data, os.path.join(self.output_dir, "sft_data.jsonl")) 
\ No newline at end of file
+        self.write_output("sft_data.jsonl", processed_data)
\ No newline at end of file
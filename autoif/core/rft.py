@@ -1,15 +1,47 @@
 # RFT相关函数
 import json
-import re
 import numpy as np
 from tqdm import tqdm
 from concurrent.futures import as_completed
 from functools import partial
 from typing import Generic, Dict, List, Tuple, Any, Optional
+from collections import Counter
 from .base import T, BaseAutoIFProtocol
 from autoif.client.api_client import OpenAIClient
-from autoif.utils import with_timeout, save_data, save_jsonl, load_jsonl
+from autoif.utils import with_timeout, save_data, save_jsonl, load_jsonl, OrderedJsonlSink, extract_json_object
+from .func_analysis import is_safe_code, dedup_funcs, has_redos_pattern
+from .worker import chunk_by_cost, get_shared
+from autoif.reward.bundle import BUNDLE_FILE, build_verifier_bundle, save_verifier_bundle
 import os
+import time
+
+# 验证函数单次调用的默认耗时预算（毫秒）
+FUNC_COST_BUDGET = 5.0
+# 行为相同（测试用例上判断一致）的函数默认只保留的个数
+FUNC_CLUSTER_TOPK = 1
+# 判断中同一取值占比不低于该值的函数视为近似常量
+FUNC_CONSTANT_RATIO = 0.95
+
+# 步骤2的回复格式，开启结构化输出时作为JSON schema约束生成
+EVAL_FUNC_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "func": {"type": "string"},
+        "cases": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "input": {"type": "string"},
+                    "output": {"type": "boolean"}
+                },
+                "required": ["input", "output"]
+            },
+            "minItems": 1
+        }
+    },
+    "required": ["func", "cases"]
+}
 
 class RFTMixin(Generic[T]):
     """RFT相关功能的Mixin类"""
@@ -17,7 +49,7 @@ class RFTMixin(Generic[T]):
         self: BaseAutoIFProtocol
         
     async def RFT(self: T):
-        seed_instructions = [each.strip() for each in open("./sample_data/seed_instruction.txt").readlines()]
+        seed_instructions = [each.strip() for each in open(self.seed_instructions).readlines()]
 
         augment_instruction_prompt = """You are an expert for writing instructions. Please provide 50 different instructions that meet the following requirements:
         - Instructions are about the format but not style of a response
@@ -55,13 +87,13 @@ class RFTMixin(Generic[T]):
                 augment_instructions_list.extend(result)
             else:
                 augment_instructions_list.append(result)
-        augment_instructions_set = set(augment_instructions_list)
+        augment_instructions_set = dict.fromkeys(augment_instructions_list)
         print("生成", len(augment_instructions_set))
-        save_data(augment_instructions_set, os.path.join(self.output_dir, "augment_instructions.txt"))
+        save_data(augment_instructions_set, os.path.join(self.run_dir, "augment_instructions.txt"))
     
     async def verification_funcs_cases_generation(self: T):
-        seed_instructions = [each.strip() for each in open("./sample_data/seed_instruction.txt").readlines()]
-        augment_instructions_processed = [each.strip() for each in open(os.path.join(self.output_dir, "augment_instructions.txt")).readlines()]
+        seed_instructions = [each.strip() for each in open(self.seed_instructions).readlines()]
+        augment_instructions_processed = [each.strip() for each in open(os.path.join(self.run_dir, "augment_instructions.txt")).readlines()]
 
         prompt_template = """You are an expert for writing evaluation functions in Python to evaluate whether a response strictly follows an instruction.
         Here is the instruction: {instruction}
@@ -71,6 +103,9 @@ class RFTMixin(Generic[T]):
 
         outputs: List[Dict[str, str]] = []
         for instruction in seed_instructions + augment_instructions_processed:
+            # 分片运行时只处理属于当前分片的指令
+            if not self.in_shard(instruction):
+                continue
             prompt = prompt_template.format(instruction=instruction)
             outputs.append({
                 "prompt": prompt,
@@ -78,56 +113,77 @@ class RFTMixin(Generic[T]):
             })
         print("开始生成验证函数和测试用例")
         
+        stats = self.get_step_stats()
+
         def process_result(output: Dict[str, str], result: List[str]) -> Dict[str, Any]:
-            """处理生成的函数和测试用例"""
-            output["gpt-answer"] = [each.strip() for each in result]  
+            """处理生成的函数和测试用例，按解析结果统计 parse_{fenced,bare,embedded,failed,invalid}"""
+            output["gpt-answer"] = [each.strip() for each in result]
+            for each in output["gpt-answer"]:
+                stats.add_metric(f"parse_{RFTMixin.parse_func_cases(each)[1]}")
             return output
             
-        await self.batch_process_async(
-            messages=[self.client.build_messages(output["prompt"]) for output in outputs],
-            total=len(outputs),
-            process_funcs=[partial(process_result, output) for output in outputs],
-            n=8
-        )
-        outputs=list(self._current_cache.values())
+        with OrderedJsonlSink(os.path.join(self.output_dir, "verification_funcs_cases.jsonl")) as sink:
+            await self.batch_process_async(
+                messages=[self.client.build_messages(output["prompt"]) for output in outputs],
+                total=len(outputs),
+                process_funcs=[partial(process_result, output) for output in outputs],
+                sink=sink,
+                n=8,
+                **self.structured_output_kwargs("eval_func", EVAL_FUNC_SCHEMA)
+            )
             
-        print("生成", len(outputs))
-        save_jsonl(outputs, os.path.join(self.output_dir, "verification_funcs_cases.jsonl"))
+        print("生成", sink.count)
+        parsed = sum(stats.metrics.get(f"parse_{how}", 0) for how in ('fenced', 'bare', 'embedded'))
+        failed = sum(stats.metrics.get(f"parse_{how}", 0) for how in ('failed', 'invalid'))
+        if parsed + failed:
+            print(f"可解析的样本 {parsed:.0f}/{parsed + failed:.0f}（本次运行新生成的部分）")
+
+    @staticmethod
+    def parse_func_cases(text: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """解析步骤2的单个回复，返回 ({'func': str, 'cases': [(input, output)]}, 提取方式)
+
+        提取方式见extract_json_object；缺少func/cases或类型不对时为 (None, 'invalid')。
+        output为"true"/"false"字符串时转换为布尔值，格式不对的测试用例被跳过。
+        """
+        obj, how = extract_json_object(text)
+        if obj is None:
+            return None, how
+        func, cases = obj.get('func'), obj.get('cases')
+        if not isinstance(func, str) or not isinstance(cases, list):
+            return None, 'invalid'
+        parsed_cases = []
+        for case in cases:
+            if not isinstance(case, dict) or not isinstance(case.get('input'), str):
+                continue
+            output = case.get('output')
+            if isinstance(output, str) and output.strip().lower() in ('true', 'false'):
+                output = output.strip().lower() == 'true'
+            if isinstance(output, bool):
+                parsed_cases.append((case['input'], output))
+        return {'func': func, 'cases': parsed_cases}, how
         
         
     @staticmethod
     @with_timeout
-    def process_result(index: int, result: Dict[str, Any]) -> Optional[Tuple[int, Dict[str, Any]]]:
-        """处理和验证生成的函数和测试用例"""
-        def is_safe_code(code: str) -> bool:
-            """检查代码是否安全"""
-            dangerous_keywords = [
-                'exit', 'quit', 'os.', 'sys.', 'subprocess', 'eval(', 'exec(', 
-                'open(', '__import__', 'import os', 'import sys', 'import subprocess',
-                'shutil', 'pathlib', 'remove', 'rmdir', 'unlink', 'delete'
-            ]
-            return not any(keyword in code for keyword in dangerous_keywords)
-
+    def process_result(index: int, result: Dict[str, Any]) -> Tuple[Optional[int], Optional[Dict[str, Any]], Dict[str, int]]:
+        """处理和验证生成的函数和测试用例，返回 (下标, 结果, 各原因淘汰的函数数)"""
         res = result['gpt-answer']
         eval_funcs: List[str] = []
         test_cases: List[Tuple[str, bool]] = []
 
         # 处理每个生成的结果
         for each in res:
-            try:
-                json_dict = re.findall(r'```json(.*?)```', each, re.DOTALL)[0].strip()
-                res_dict = json.loads(json_dict)
-            except (IndexError, json.JSONDecodeError):
+            res_dict, _ = RFTMixin.parse_func_cases(each)
+            if res_dict is None:
                 continue
 
             func = res_dict['func'].strip()
-            if not is_safe_code(func):
-                continue
-                
             func = '\n'.join([line for line in func.split('\n') 
                             if 'download' not in line and 'requests' not in line])
             if '\\n' in func:
                 func = func.replace('\\n', '\n')
+            if not is_safe_code(func):
+                continue
 
             try:
                 exec(func, {}, {})
@@ -135,17 +191,19 @@ class RFTMixin(Generic[T]):
             except Exception:
                 continue
 
-            for case in res_dict['cases']:
-                try:
-                    test_cases.append((case['input'], case['output']))
-                except KeyError:
-                    print(case)
+            test_cases.extend(res_dict['cases'])
                     
-        eval_funcs = list(set(eval_funcs))
+        eval_funcs = dedup_funcs(eval_funcs)
         test_cases = list(map(json.loads, set(map(json.dumps, test_cases))))
         
+        # 静态检查可能灾难性回溯的正则
+        rejected = {'redos': 0, 'cost': 0, 'constant': 0, 'duplicate': 0}
+        safe_funcs = [func for func in eval_funcs if not has_redos_pattern(func)]
+        rejected['redos'] = len(eval_funcs) - len(safe_funcs)
+        eval_funcs = safe_funcs
+        
         if len(eval_funcs) < 3 or len(test_cases) < 10:
-            return None, None
+            return None, None, rejected
 
         # 过滤和评分测试用例
         filtered_test_cases = []
@@ -153,32 +211,98 @@ class RFTMixin(Generic[T]):
             if any(RFTMixin._validate_test_case(func, test_case) for func in eval_funcs):
                 filtered_test_cases.append(test_case)
 
-        # 评分函数
+        # 评分函数并统计单次调用耗时，超出预算（毫秒）的函数不保留，其余按耗时从低到高排列
+        budget_us = get_shared('func_cost_budget', FUNC_COST_BUDGET) * 1000
         scored_funcs = []
         for func in eval_funcs:
-            score = RFTMixin._score_function(func, filtered_test_cases)
-            if score >= 0.8:
-                scored_funcs.append((func, score))
+            try:
+                score, cost, verdicts = RFTMixin._score_function(func, filtered_test_cases)
+            except TimeoutError:
+                rejected['cost'] += 1
+                continue
+            if score < 0.8:
+                continue
+            if cost['mean_us'] > budget_us:
+                rejected['cost'] += 1
+                continue
+            scored_funcs.append((func, score, cost, verdicts))
 
+        # 按测试用例上的判断去掉近似常量的函数，行为相同的函数只保留最便宜的几个
+        scored_funcs = RFTMixin.prune_funcs(
+            scored_funcs,
+            [out for _, out in filtered_test_cases],
+            topk=get_shared('func_cluster_topk', FUNC_CLUSTER_TOPK),
+            constant_ratio=get_shared('func_constant_ratio', FUNC_CONSTANT_RATIO),
+            rejected=rejected
+        )
         if not scored_funcs:
-            return None, None
+            return None, None, rejected
 
+        scored_funcs.sort(key=lambda each: each[2]['mean_us'])
         return index, {
             "instruction": result['instruction'],
-            "eval_func": scored_funcs,
+            "eval_func": [(func, score) for func, score, _, _ in scored_funcs],
+            "func_stats": [cost for _, _, cost, _ in scored_funcs],
             "cases": filtered_test_cases
-        }
+        }, rejected
+
+    @staticmethod
+    def process_result_chunk(chunk: List[Tuple[int, Dict[str, Any]]]) -> Tuple[List[Tuple[int, Dict[str, Any]]], Dict[str, int]]:
+        """在worker中处理一块记录，每条记录单独超时保护，返回 (结果, 各原因淘汰的函数数)"""
+        outputs = []
+        rejected = {'redos': 0, 'cost': 0, 'constant': 0, 'duplicate': 0}
+        for index, result in chunk:
+            try:
+                index, result, result_rejected = RFTMixin.process_result(index, result)
+            except Exception as e:
+                print(f"Error processing result: {e}")
+                continue
+            for reason, count in result_rejected.items():
+                rejected[reason] += count
+            if result is not None:
+                outputs.append((index, result))
+        return outputs, rejected
+
+    @staticmethod
+    def prune_funcs(scored_funcs: List[Tuple[str, float, Dict[str, float], Tuple]], labels: List[bool],
+                    topk: int = 1, constant_ratio: float = 0.95,
+                    rejected: Optional[Dict[str, int]] = None) -> List[Tuple[str, float, Dict[str, float], Tuple]]:
+        """按函数在测试用例上的判断向量剪枝
+
+        测试用例标签本身不是近似常量时，去掉判断中同一取值占比不低于constant_ratio的函数（几乎总返回True或False）；
+        其余函数按判断向量聚类，每类保留耗时最低的topk个，并在耗时统计中记录类大小。
+        """
+        rejected = rejected if rejected is not None else {'constant': 0, 'duplicate': 0}
+
+        def majority_ratio(values) -> float:
+            return Counter(values).most_common(1)[0][1] / len(values) if values else 1.0
+
+        if majority_ratio(labels) < constant_ratio:
+            informative = [each for each in scored_funcs if majority_ratio(each[3]) < constant_ratio]
+            rejected['constant'] += len(scored_funcs) - len(informative)
+            scored_funcs = informative
+
+        clusters: Dict[Tuple, List] = {}
+        for each in scored_funcs:
+            clusters.setdefault(each[3], []).append(each)
+        kept = []
+        for members in clusters.values():
+            members.sort(key=lambda each: each[2]['mean_us'])
+            for func, score, cost, verdicts in members[:topk]:
+                kept.append((func, score, {**cost, 'cluster_size': len(members)}, verdicts))
+            rejected['duplicate'] += max(0, len(members) - topk)
+        return kept
 
     @staticmethod
     @with_timeout(timeout=1)
     def _validate_test_case(func: str, test_case: Tuple[str, bool]) -> bool:
         """验证单个测试用例"""
-        local_vars = {}
+        namespace = {}  # 导入和函数定义位于同一命名空间，evaluate才能访问导入的模块
         try:
-            exec(func, {}, local_vars)
-            if 'evaluate' not in local_vars:
+            exec(func, namespace)
+            if 'evaluate' not in namespace:
                 return False
-            eval_func = local_vars['evaluate']
+            eval_func = namespace['evaluate']
             res = eval_func(test_case[0])
             return res is not None and res == test_case[1]
         except Exception:
@@ -186,26 +310,51 @@ class RFTMixin(Generic[T]):
 
     @staticmethod
     @with_timeout(timeout=1)
-    def _score_function(func: str, test_cases: List[Tuple[str, bool]]) -> float:
-        """评分单个函数"""
-        local_vars = {}
+    def _score_function(func: str, test_cases: List[Tuple[str, bool]]) -> Tuple[float, Dict[str, float], Tuple]:
+        """评分单个函数，返回 (得分, 单次调用耗时统计, 各测试用例上的判断)
+
+        耗时单位为微秒，首次调用作为预热不计时；判断为True/False，出错或返回非布尔值时为None。超时抛出TimeoutError。
+        """
+        no_cost = {'mean_us': 0.0, 'max_us': 0.0}
+        namespace = {}
         try:
-            exec(func, {}, local_vars)
-            if 'evaluate' not in local_vars:
-                return 0.0
-            eval_func = local_vars['evaluate']
-            
-            scores = []
-            for inp, out in test_cases:
-                try:
-                    res = eval_func(inp)
-                    scores.append(1 if res is not None and res == out else 0)
-                except Exception:
-                    scores.append(0)
-            
-            return np.mean(scores) if scores else 0.0
+            exec(func, namespace)
+        except TimeoutError:
+            raise
         except Exception:
-            return 0.0
+            return 0.0, no_cost, ()
+        if 'evaluate' not in namespace:
+            return 0.0, no_cost, ()
+        eval_func = namespace['evaluate']
+        
+        if test_cases:
+            try:
+                eval_func(test_cases[0][0])
+            except TimeoutError:
+                raise
+            except Exception:
+                pass
+        
+        scores = []
+        elapsed = []
+        verdicts = []
+        for inp, out in test_cases:
+            start = time.perf_counter()
+            try:
+                res = eval_func(inp)
+                scores.append(1 if res is not None and res == out else 0)
+                verdicts.append(res if isinstance(res, bool) else None)
+            except TimeoutError:
+                raise
+            except Exception:
+                scores.append(0)
+                verdicts.append(None)
+            elapsed.append((time.perf_counter() - start) * 1e6)
+        
+        if not scores:
+            return 0.0, no_cost, ()
+        cost = {'mean_us': float(np.mean(elapsed)), 'max_us': float(max(elapsed))}
+        return float(np.mean(scores)), cost, tuple(verdicts)
         
     def cross_validation(self: T):   
         results = load_jsonl(os.path.join(self.output_dir, "verification_funcs_cases.jsonl"))
@@ -214,22 +363,43 @@ class RFTMixin(Generic[T]):
         
         batch_size = self.process_num * 4096
         
-        with self.get_process_pool() as process_pool:
+        stats = self.get_step_stats()
+        shared = {
+            'func_cost_budget': self.func_cost_budget,
+            'func_cluster_topk': self.func_cluster_topk,
+            'func_constant_ratio': self.func_constant_ratio,
+        }
+        with self.get_process_pool(shared) as process_pool:
             for i in range(0, len(results), batch_size):
                 result_dict={}
-                futures = []
-                for j in range(i, min(i+batch_size, len(results))):
-                    if j not in self._current_cache:
-                        futures.append(process_pool.submit(RFTMixin.process_result, j, results[j]))
+                # 只传输worker需要的字段，并按生成内容长度均衡分块
+                items = [(j, {'instruction': results[j]['instruction'], 'gpt-answer': results[j]['gpt-answer']})
+                         for j in range(i, min(i+batch_size, len(results)))
+                         if j not in self._current_cache]
+                costs = [sum(len(each) for each in item['gpt-answer']) for _, item in items]
+                chunks = chunk_by_cost(items, costs, self.num_task_chunks(len(items)))
+                futures = {process_pool.submit(RFTMixin.process_result_chunk, chunk): len(chunk) for chunk in chunks}
                 
-                for future in tqdm(as_completed(futures), total=len(futures)):
-                    try:
-                        index, result = future.result()
-                        if result is not None:
-                            result_dict[index] = result
-                    except Exception as e:
-                        print(f"Error processing result: {e}")
+                with tqdm(total=len(items)) as pbar:
+                    for future in as_completed(futures):
+                        try:
+                            outputs, rejected = future.result()
+                            result_dict.update(outputs)
+                            for reason, count in rejected.items():
+                                stats.add_metric(f'funcs_rejected_{reason}', count)
+                        except Exception as e:
+                            print(f"Error processing result: {e}")
+                        pbar.update(futures[future])
                 self._current_cache.update(result_dict)
                 
+        self.save_step_stats()
         filter_results = list(self._current_cache.values())
-        save_jsonl(filter_results, os.path.join(self.output_dir, "cross_validation.jsonl")) 
\ No newline at end of file
+        print(f"因正则回溯风险淘汰函数: {stats.metrics.get('funcs_rejected_redos', 0)}，"
+              f"因耗时超出预算淘汰函数: {stats.metrics.get('funcs_rejected_cost', 0)}，"
+              f"近似常量函数: {stats.metrics.get('funcs_rejected_constant', 0)}，"
+              f"行为重复函数: {stats.metrics.get('funcs_rejected_duplicate', 0)}")
+        self.write_output("cross_validation.jsonl", filter_results)
+        # 同时输出预编译的验证函数包，供下游和打分服务直接加载
+        bundle = build_verifier_bundle(filter_results)
+        save_verifier_bundle(bundle, os.path.join(self.output_dir, BUNDLE_FILE))
+        print(f"验证函数包: {len(bundle['instructions'])} 条指令") 
\ No newline at end of file
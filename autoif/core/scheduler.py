@@ -0,0 +1,220 @@
+# 请求调度：按预计耗时对待发送的任务排序，以及多个任务之间公平分配并发
+import asyncio
+import collections
+import contextlib
+import json
+import math
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Sequence, Tuple
+
+SCHEDULE_POLICIES = ('fifo', 'longest', 'bucket')
+
+# 预计耗时中prompt长度的权重（prefill比逐token生成快得多）
+PREFILL_WEIGHT = 0.1
+
+
+class LengthModel:
+    """在线最小二乘拟合 每个样本的输出长度 ≈ a + b × prompt长度（字符数）
+
+    样本数不足min_samples时使用先验值（如上次运行的平均输出长度）或已有样本的均值。
+    """
+    def __init__(self, prior: Optional[float] = None, min_samples: int = 20):
+        self.prior = prior
+        self.min_samples = min_samples
+        self.n = 0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+
+    def update(self, prompt_chars: float, completion_chars: float) -> None:
+        self.n += 1
+        self.sum_x += prompt_chars
+        self.sum_y += completion_chars
+        self.sum_xx += prompt_chars * prompt_chars
+        self.sum_xy += prompt_chars * completion_chars
+
+    def predict(self, prompt_chars: float) -> float:
+        if self.n == 0:
+            return self.prior or 0.0
+        mean_x = self.sum_x / self.n
+        mean_y = self.sum_y / self.n
+        if self.n < self.min_samples:
+            return self.prior if self.prior is not None else mean_y
+        var_x = self.sum_xx / self.n - mean_x * mean_x
+        if var_x <= 1e-6:
+            return mean_y
+        slope = (self.sum_xy / self.n - mean_x * mean_y) / var_x
+        return max(0.0, mean_y + slope * (prompt_chars - mean_x))
+
+    def expected_cost(self, prompt_chars: float) -> float:
+        """请求的预计耗时（以输出字符数计）：n个样本并行生成，耗时取决于单个样本的输出长度"""
+        return self.predict(prompt_chars) + PREFILL_WEIGHT * prompt_chars
+
+
+def schedule_order(costs: Sequence[float], policy: str) -> List[int]:
+    """返回待发送任务的发送顺序
+
+    - fifo: 输入顺序
+    - longest: 预计耗时从长到短，长请求尽早开始，不会在步骤末尾拖尾
+    - bucket: 按预计耗时的2的幂分桶，从长到短逐桶发送，桶内保持输入顺序（重排缓冲区占用更小）
+    """
+    positions = range(len(costs))
+    if policy == 'longest':
+        return sorted(positions, key=lambda i: -costs[i])
+    if policy == 'bucket':
+        return sorted(positions, key=lambda i: -int(math.log2(costs[i] + 1)))
+    return list(positions)
+
+
+def split_n(n: int, max_n: int) -> List[int]:
+    """把n个样本拆分为每个不超过max_n的请求，如 split_n(8, 3) == [3, 3, 2]"""
+    max_n = max(1, max_n)
+    return [min(max_n, n - start) for start in range(0, n, max_n)] or [n]
+
+
+# 待发送的任务 (下标, 消息, 处理函数)；请求为若干 (消息, [(下标, 处理函数)]) 块，打包时最多pack个块
+Task = Tuple[int, Any, Callable]
+Chunk = Tuple[Any, List[Tuple[int, Callable]]]
+
+
+class DispatchWindow:
+    """batch_process_async的发送窗口：已读取、尚未发出的任务，以及已发出、尚未完成的请求
+
+    每轮从窗口中按调度策略选出任务，消息相同的任务每per_request个合并为一个请求，
+    每个并发位置容纳pack个请求（completions传输方式打包，否则pack为1），n超过max_n的任务拆分的每个请求都占用一个并发位置。
+    重排缓冲区满时只在窗口中最小的下标小于所有在途下标时发送它（它可能正是缓冲区等待写出的下标），
+    否则等待在途请求完成，保证缓冲区有界。
+    """
+    def __init__(self, size: int, slots: int, policy: str = 'fifo', per_request: int = 1,
+                 pack: int = 1, request_parts: int = 1):
+        self.size = size
+        self.slots = slots
+        self.policy = policy
+        self.per_request = per_request
+        self.pack = pack
+        self.request_parts = request_parts
+        self.entries: List[Tuple[float, Task]] = []  # (预计耗时, 任务)
+        self.in_flight: Dict[Hashable, List[int]] = {}  # 请求 -> 下标
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def full(self) -> bool:
+        return len(self.entries) >= self.size
+
+    def add(self, cost: float, task: Task) -> None:
+        self.entries.append((cost, task))
+
+    def clear(self) -> List[Task]:
+        """清空窗口，返回其中的任务"""
+        tasks = [task for _, task in self.entries]
+        self.entries = []
+        return tasks
+
+    def order(self, sink_full: bool = False) -> List[int]:
+        """本轮考虑发送的窗口位置，按发送顺序排列"""
+        if not sink_full:
+            return schedule_order([cost for cost, _ in self.entries], self.policy)
+        if not self.entries:
+            return []
+        head = min(range(len(self.entries)), key=lambda pos: self.entries[pos][1][0])
+        in_flight = min((index for indices in self.in_flight.values() for index in indices), default=None)
+        return [head] if in_flight is None or self.entries[head][1][0] < in_flight else []
+
+    def take(self, sink_full: bool = False) -> List[List[Chunk]]:
+        """按空闲并发位置选出本轮发送的任务并从窗口中移除，返回分组后的请求"""
+        groups: Dict[str, Chunk] = {}
+        free_slots = (self.slots - len(self.in_flight)) * self.pack
+        planned = 0
+        placed = set()
+        for pos in self.order(sink_full):
+            index, msg, process_func = self.entries[pos][1]
+            key = json.dumps(msg, sort_keys=True, ensure_ascii=False)
+            group = groups.get(key)
+            if group is None or len(group[1]) % self.per_request == 0:
+                if planned >= free_slots:
+                    break
+                planned += self.request_parts
+            if group is None:
+                group = groups[key] = (msg, [])
+            group[1].append((index, process_func))
+            placed.add(pos)
+        if placed:
+            self.entries = [entry for pos, entry in enumerate(self.entries) if pos not in placed]
+
+        chunks = [(msg, items[i:i + self.per_request])
+                  for msg, items in groups.values() for i in range(0, len(items), self.per_request)]
+        return [chunks[i:i + self.pack] for i in range(0, len(chunks), self.pack)]
+
+    def start(self, key: Hashable, request: List[Chunk]) -> List[int]:
+        """记录已发出的请求，返回其包含的下标"""
+        indices = self.in_flight[key] = [index for _, chunk in request for index, _ in chunk]
+        return indices
+
+    def finish(self, key: Hashable) -> List[int]:
+        """移除已完成的请求，返回其包含的下标"""
+        return self.in_flight.pop(key)
+
+
+class FairLimiter:
+    """多个使用方（如服务模式下的多个任务）共享的并发上限
+
+    并发位置用完时，释放的位置优先分给当前占用最少的等待方（同一等待方内先到先得），
+    请求多的任务不会挤占请求少的任务，各任务的并发数趋于均分。
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active: Dict[Hashable, int] = {}
+        self._total = 0
+        self._waiters: Dict[Hashable, Deque[asyncio.Future]] = {}
+
+    def _grant(self) -> None:
+        while self._total < self.limit:
+            waiting = [key for key, queue in self._waiters.items() if queue]
+            if not waiting:
+                return
+            # 字典保持插入顺序，占用数相同时先登记的等待方优先
+            key = min(waiting, key=lambda each: self.active.get(each, 0))
+            future = self._waiters[key].popleft()
+            if future.done():
+                continue
+            self._acquired(key)
+            future.set_result(None)
+
+    def _acquired(self, key: Hashable) -> None:
+        self._total += 1
+        self.active[key] = self.active.get(key, 0) + 1
+
+    async def acquire(self, key: Hashable) -> None:
+        if self._total < self.limit and not any(self._waiters.values()):
+            self._acquired(key)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, collections.deque()).append(future)
+        # 队列中可能只剩已取消的等待，此时直接分配
+        self._grant()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已分到位置后被取消时归还
+            if future.done() and not future.cancelled():
+                self.release(key)
+            raise
+
+    def release(self, key: Hashable) -> None:
+        self._total -= 1
+        self.active[key] -= 1
+        if not self.active[key]:
+            del self.active[key]
+            if not self._waiters.get(key):
+                self._waiters.pop(key, None)
+        self._grant()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, key: Hashable):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
@@ -0,0 +1,252 @@
+# 服务模式：在一个进程中并发运行多个流程，共享客户端、进程池、长度模型，并在任务之间公平分配LLM并发
+import asyncio
+import concurrent.futures
+import contextvars
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+from .worker import init_worker, run_with_shared
+from .scheduler import FairLimiter, LengthModel
+
+# 任务目录的子目录：待运行、运行中、已完成、失败和任务日志
+JOB_STATES = ('pending', 'running', 'done', 'failed')
+JOB_LOG_DIR = 'logs'
+
+
+def _noop() -> None:
+    pass
+
+
+class PoolSession:
+    """常驻进程池上的一次使用，接口与 `with ProcessPoolExecutor(...)` 相同
+
+    共享数据写入临时pickle文件，任务只携带文件路径，每个worker每个文件只加载一次；
+    退出时等待本次提交的任务完成并删除文件，不关闭进程池。
+    """
+    def __init__(self, pool: concurrent.futures.ProcessPoolExecutor, shared_dir: str, shared: Dict):
+        self.pool = pool
+        self.path = os.path.join(shared_dir, f"{uuid.uuid4().hex}.pkl")
+        with open(self.path, 'wb') as f:
+            pickle.dump(shared, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._futures: List[concurrent.futures.Future] = []
+
+    def submit(self, fn: Callable, *args) -> concurrent.futures.Future:
+        future = self.pool.submit(run_with_shared, self.path, fn, *args)
+        self._futures.append(future)
+        return future
+
+    def __enter__(self) -> 'PoolSession':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        concurrent.futures.wait(self._futures)
+        self._futures = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SharedResources:
+    """服务模式下各任务共享的资源
+
+    - 客户端：按创建参数（地址、模型、请求方式等）共用，模型列表只查询一次，连接池在任务之间复用
+    - 进程池：常驻，验证函数的编译缓存在任务之间保留
+    - 长度模型：按 (模型, 步骤) 共用，新任务直接使用之前任务拟合的输出长度
+    - 并发：所有任务的LLM请求共用max_concurrency个并发位置，按任务公平分配
+
+    Args:
+        process_num: 常驻进程池的进程数
+        max_concurrency: 所有任务合计的最大并发请求数
+    """
+    def __init__(self, process_num: int, max_concurrency: int):
+        self.process_num = process_num
+        self.limiter = FairLimiter(max_concurrency)
+        self.length_models: Dict[Tuple[str, int], LengthModel] = {}
+        self._clients: Dict[Hashable, Any] = {}
+        self._clients_lock = threading.Lock()
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._shared_dir = tempfile.mkdtemp(prefix='autoif-shared-')
+
+    def get_client(self, key: Hashable, create: Callable[[], Any]) -> Any:
+        """返回key对应的客户端，不存在时调用create创建（在后台线程中创建也是安全的）"""
+        with self._clients_lock:
+            if key not in self._clients:
+                self._clients[key] = create()
+            return self._clients[key]
+
+    def process_pool(self, shared: Optional[Dict] = None) -> PoolSession:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.process_num,
+                    initializer=init_worker,
+                    initargs=({},)
+                )
+                # 预先启动所有worker
+                for future in [self._pool.submit(_noop) for _ in range(self.process_num)]:
+                    future.result()
+        return PoolSession(self._pool, self._shared_dir, shared or {})
+
+    async def close_clients(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        shutil.rmtree(self._shared_dir, ignore_errors=True)
+
+
+# 当前任务的日志文件，服务模式下sys.stdout/sys.stderr按任务写入各自的日志
+_job_stream: contextvars.ContextVar[Optional[io.TextIOBase]] = contextvars.ContextVar('autoif_job_stream', default=None)
+
+
+class JobStream(io.TextIOBase):
+    """按当前任务（contextvars，asyncio任务和to_thread会继承）分发输出的流，不在任务中时写入原来的流"""
+    def __init__(self, default):
+        self.default = default
+
+    def _target(self):
+        return _job_stream.get() or self.default
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def isatty(self) -> bool:
+        return False
+
+
+class JobService:
+    """监视任务目录并发运行流程
+
+    任务是 job_dir/pending 下的JSON文件（先写入其他文件名再重命名，避免读到未写完的文件），
+    内容为run命令的参数。任务开始时移入running，结束后写入运行结果（result字段）并移入done或failed，
+    输出写入 job_dir/logs/任务名.log。服务重启时running中的任务放回pending，从缓存继续运行。
+
+    Args:
+        job_dir: 任务目录
+        build_job: 任务参数 -> (流程实例, 起始步骤, 结束步骤)，在后台线程中调用
+        resources: 共享资源
+        max_jobs: 同时运行的最大任务数
+        poll_interval: 检查新任务的间隔（秒）
+    """
+    def __init__(self, job_dir: str, build_job: Callable[[str, Dict], Tuple[Any, Optional[int], Optional[int]]],
+                 resources: SharedResources, max_jobs: int = 4, poll_interval: float = 2.0):
+        self.job_dir = job_dir
+        self.build_job = build_job
+        self.resources = resources
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        # 运行中任务的输出目录，输出目录相同的任务依次运行
+        self._busy_dirs: Dict[str, asyncio.Event] = {}
+        for state in JOB_STATES + (JOB_LOG_DIR,):
+            os.makedirs(os.path.join(job_dir, state), exist_ok=True)
+
+    def job_path(self, state: str, name: str) -> str:
+        return os.path.join(self.job_dir, state, name)
+
+    def recover(self) -> None:
+        """上次服务中断时仍在运行的任务放回pending"""
+        for name in sorted(os.listdir(os.path.join(self.job_dir, 'running'))):
+            os.replace(self.job_path('running', name), self.job_path('pending', name))
+            print(f"恢复未完成的任务: {name}")
+
+    def pending_jobs(self) -> List[str]:
+        """按提交时间排列的待运行任务"""
+        pending_dir = os.path.join(self.job_dir, 'pending')
+        names = [name for name in os.listdir(pending_dir) if name.endswith('.json')]
+        return sorted(names, key=lambda name: (os.path.getmtime(os.path.join(pending_dir, name)), name))
+
+    async def run_job(self, name: str) -> None:
+        path = self.job_path('running', name)
+        os.replace(self.job_path('pending', name), path)
+        record: Dict[str, Any] = {}
+        result: Dict[str, Any] = {}
+        log_path = os.path.join(self.job_dir, JOB_LOG_DIR, os.path.splitext(name)[0] + '.log')
+        start_time = time.time()
+        with open(log_path, 'a', encoding='utf-8', buffering=1) as log:
+            token = _job_stream.set(log)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    record = json.load(f)
+                record.pop('result', None)
+                autoif, start_step, end_step = await asyncio.to_thread(self.build_job, name, record)
+                result['run_dir'] = autoif.output_dir
+                while autoif.output_dir in self._busy_dirs:
+                    print(f"等待输出目录相同的任务完成: {autoif.output_dir}")
+                    await self._busy_dirs[autoif.output_dir].wait()
+                self._busy_dirs[autoif.output_dir] = asyncio.Event()
+                try:
+                    await autoif.run_pipeline(start_step, end_step)
+                finally:
+                    self._busy_dirs.pop(autoif.output_dir).set()
+                state = 'done'
+            except (Exception, SystemExit) as e:
+                traceback.print_exc()
+                result['error'] = f"{type(e).__name__}: {e}"
+                state = 'failed'
+            finally:
+                _job_stream.reset(token)
+        result['elapsed'] = round(time.time() - start_time, 1)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({**record, 'result': result}, f, ensure_ascii=False, indent=2)
+        os.replace(path, self.job_path(state, name))
+        print(f"任务 {name} {'完成' if state == 'done' else '失败'}，用时 {result['elapsed']} 秒")
+
+    async def serve(self, once: bool = False) -> None:
+        """运行服务，once为True时处理完当前所有任务后退出"""
+        self.recover()
+        running: Dict[asyncio.Task, str] = {}
+        print(f"监视任务目录: {os.path.join(self.job_dir, 'pending')}，最多同时运行 {self.max_jobs} 个任务")
+        try:
+            while True:
+                for name in self.pending_jobs():
+                    if len(running) >= self.max_jobs:
+                        break
+                    if name in running.values():
+                        continue
+                    print(f"开始任务: {name}")
+                    running[asyncio.create_task(self.run_job(name))] = name
+                if once and not running:
+                    break
+                if running:
+                    done, _ = await asyncio.wait(running, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        running.pop(task)
+                else:
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            await self.resources.close_clients()
+
+
+def run_service(job_dir: str, build_job: Callable, process_num: int = 16, max_concurrency: int = 256,
+                max_jobs: int = 4, poll_interval: float = 2.0, once: bool = False) -> None:
+    """启动服务，build_job的参数为 (任务名, 任务内容, 共享资源)"""
+    resources = SharedResources(process_num, max_concurrency)
+    service = JobService(job_dir, lambda name, record: build_job(name, record, resources),
+                         resources, max_jobs=max_jobs, poll_interval=poll_interval)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = JobStream(stdout), JobStream(stderr)
+    try:
+        asyncio.run(service.serve(once=once))
+    except KeyboardInterrupt:
+        print("\n服务已停止，运行中的任务下次启动时继续")
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        resources.close()
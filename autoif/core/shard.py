@@ -0,0 +1,83 @@
+# 按指令哈希分片运行与分片结果合并
+import glob
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional
+from autoif.utils import md5
+from autoif.reward.bundle import BUNDLE_FILE, merge_verifier_bundles
+
+
+def shard_dir_name(shard_id: int, num_shards: int) -> str:
+    """分片输出子目录名"""
+    return f"shard-{shard_id:05d}-of-{num_shards:05d}"
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    """按md5哈希计算key所属分片，与进程和机器无关"""
+    return int(md5(key), 16) % num_shards
+
+
+def merge_shard_outputs(run_dir: str, num_shards: int, filenames: Optional[List[str]] = None) -> Dict[str, int]:
+    """合并各分片的JSONL输出和验证函数包到run_dir
+
+    同名文件逐行合并，按规范化JSON去重，并按内容哈希排序，结果与分片完成顺序无关。
+    返回 文件名 -> 合并后行数。
+    """
+    shard_dirs = [os.path.join(run_dir, shard_dir_name(i, num_shards)) for i in range(num_shards)]
+    missing = [d for d in shard_dirs if not os.path.isdir(d)]
+    if missing:
+        raise FileNotFoundError(f"缺少分片输出目录: {missing}")
+
+    merge_bundle = filenames is None or BUNDLE_FILE in filenames
+    if filenames is None:
+        filenames = sorted({os.path.basename(path)
+                            for d in shard_dirs
+                            for path in glob.glob(os.path.join(d, "*.jsonl"))})
+    filenames = [filename for filename in filenames if filename != BUNDLE_FILE]
+
+    merged_counts = {}
+    for filename in filenames:
+        lines = {}
+        for d in shard_dirs:
+            path = os.path.join(d, filename)
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    canonical = json.dumps(json.loads(line), sort_keys=True, ensure_ascii=False)
+                    lines.setdefault(md5(canonical), canonical)
+        with open(os.path.join(run_dir, filename), 'w', encoding='utf-8') as f:
+            for key in sorted(lines):
+                f.write(lines[key] + '\n')
+        merged_counts[filename] = len(lines)
+        print(f"合并 {filename}: {len(lines)} 条")
+
+    # 验证函数包按指令ID合并
+    bundle_paths = [os.path.join(d, BUNDLE_FILE) for d in shard_dirs if os.path.exists(os.path.join(d, BUNDLE_FILE))]
+    if merge_bundle and bundle_paths:
+        merged_counts[BUNDLE_FILE] = merge_verifier_bundles(bundle_paths, os.path.join(run_dir, BUNDLE_FILE))
+        print(f"合并 {BUNDLE_FILE}: {merged_counts[BUNDLE_FILE]} 条指令")
+    return merged_counts
+
+
+def launch_local_shards(cli_args: List[str], num_shards: int, log_dir: str) -> List[int]:
+    """在本机以独立进程启动所有分片并等待结束，返回各分片退出码"""
+    os.makedirs(log_dir, exist_ok=True)
+    procs = []
+    for shard_id in range(num_shards):
+        log_path = os.path.join(log_dir, f"{shard_dir_name(shard_id, num_shards)}.log")
+        log_file = open(log_path, 'w', encoding='utf-8')
+        cmd = [sys.executable, '-m', 'autoif.cli.cli', 'run', *cli_args,
+               '--num-shards', str(num_shards), '--shard-id', str(shard_id)]
+        procs.append((subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT), log_file))
+        print(f"启动分片 {shard_id}/{num_shards}，日志: {log_path}")
+
+    return_codes = []
+    for proc, log_file in procs:
+        return_codes.append(proc.wait())
+        log_file.close()
+    return return_codes
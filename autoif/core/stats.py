@@ -0,0 +1,64 @@
+# 运行统计：每个步骤的请求数、token估计和耗时，保存在输出目录的run_stats.json中
+import json
+import os
+from typing import Dict
+
+RUN_STATS_FILE = "run_stats.json"
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(chars: float) -> float:
+    """按约4个字符一个token粗略估计token数"""
+    return chars / CHARS_PER_TOKEN
+
+
+class StepStats:
+    """单个步骤的请求统计"""
+    def __init__(self, **kwargs):
+        self.requests = kwargs.get('requests', 0)
+        self.samples = kwargs.get('samples', 0)
+        self.errors = kwargs.get('errors', 0)
+        self.prompt_chars = kwargs.get('prompt_chars', 0)
+        self.completion_chars = kwargs.get('completion_chars', 0)
+        self.elapsed = kwargs.get('elapsed', 0.0)
+        # 步骤自定义的计数指标
+        self.metrics: Dict[str, float] = dict(kwargs.get('metrics', {}))
+
+    def add_metric(self, name: str, value: float = 1) -> None:
+        self.metrics[name] = self.metrics.get(name, 0) + value
+
+    @property
+    def requests_per_sec(self) -> float:
+        return self.requests / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def completion_tokens_per_sec(self) -> float:
+        return estimate_tokens(self.completion_chars) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'requests': self.requests,
+            'samples': self.samples,
+            'errors': self.errors,
+            'prompt_chars': self.prompt_chars,
+            'completion_chars': self.completion_chars,
+            'elapsed': self.elapsed,
+            'metrics': self.metrics,
+        }
+
+
+def load_run_stats(output_dir: str) -> Dict[int, StepStats]:
+    path = os.path.join(output_dir, RUN_STATS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return {int(step): StepStats(**item) for step, item in json.load(f).items()}
+
+
+def save_run_stats(output_dir: str, stats: Dict[int, StepStats]) -> None:
+    """与已有统计合并后写入，同一步骤以本次运行为准"""
+    merged = load_run_stats(output_dir)
+    merged.update(stats)
+    path = os.path.join(output_dir, RUN_STATS_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({str(step): item.to_dict() for step, item in sorted(merged.items())}, f, indent=2)
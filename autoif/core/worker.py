@@ -0,0 +1,94 @@
+# 进程池worker端的共享数据、函数编译缓存与任务分块
+import heapq
+import pickle
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+from autoif.utils import with_timeout
+
+# 由进程池initializer写入，每个worker只接收一次
+_shared: Dict[Hashable, Any] = {}
+# 每个worker内按源码缓存编译好的evaluate函数
+_func_cache: Dict[str, Optional[Callable]] = {}
+# 常驻进程池（服务模式）中按文件路径缓存的共享数据，最多保留SHARED_FILES_CACHED份
+_shared_files: "OrderedDict[str, Dict[Hashable, Any]]" = OrderedDict()
+SHARED_FILES_CACHED = 4
+# 常驻进程池中编译缓存的上限，超出时清空
+FUNC_CACHE_LIMIT = 100000
+
+
+def init_worker(shared: Dict[Hashable, Any], profile: Optional[Dict[str, Any]] = None) -> None:
+    """进程池initializer：保存共享数据并清空编译缓存，指定profile（剖析配置）时剖析该worker"""
+    global _shared
+    _shared = shared
+    _func_cache.clear()
+    if profile is not None:
+        from .profiling import start_worker_profile
+        start_worker_profile(profile)
+
+
+def run_with_shared(path: str, func: Callable, *args) -> Any:
+    """常驻进程池中执行任务：共享数据不随initializer传输，而是由任务指定的pickle文件加载，每个worker每个文件只加载一次"""
+    global _shared
+    shared = _shared_files.get(path)
+    if shared is None:
+        with open(path, 'rb') as f:
+            shared = _shared_files[path] = pickle.load(f)
+        while len(_shared_files) > SHARED_FILES_CACHED:
+            _shared_files.popitem(last=False)
+        if len(_func_cache) > FUNC_CACHE_LIMIT:
+            _func_cache.clear()
+    _shared_files.move_to_end(path)
+    _shared = shared
+    return func(*args)
+
+
+def get_shared(key: Hashable, default: Any = None) -> Any:
+    """读取worker端的共享数据"""
+    return _shared.get(key, default)
+
+
+@with_timeout
+def exec_module(code: Any) -> Dict[str, Any]:
+    """执行验证函数的模块级代码（源码或代码对象）并返回命名空间，与打分使用相同的超时，
+    模块级代码死循环时抛出TimeoutError，不会一直占用worker"""
+    namespace: Dict[str, Any] = {}
+    exec(code, namespace)
+    return namespace
+
+
+def compile_eval_func(source: str) -> Optional[Callable]:
+    """编译单个验证函数源码，返回其中的evaluate函数（带缓存）"""
+    if source in _func_cache:
+        return _func_cache[source]
+    try:
+        func = exec_module(source).get('evaluate')
+    except Exception as e:
+        print(e)
+        func = None
+    _func_cache[source] = func
+    return func
+
+
+def load_eval_funcs(sources: Sequence[str]) -> List[Callable]:
+    """编译一组验证函数源码，跳过编译失败的函数"""
+    funcs = [compile_eval_func(source) for source in sources]
+    return [func for func in funcs if func is not None]
+
+
+def chunk_by_cost(items: Sequence[Any], costs: Sequence[float], num_chunks: int) -> List[List[Any]]:
+    """按代价均衡分块（最长处理时间优先的贪心装箱）
+
+    返回的块按总代价从大到小排列，先提交昂贵的块，空闲worker从队列中领取后续块，
+    从而避免个别昂贵任务拖住整批任务。
+    """
+    num_chunks = max(1, min(num_chunks, len(items)))
+    heap = [(0.0, i) for i in range(num_chunks)]
+    chunks: List[List[Any]] = [[] for _ in range(num_chunks)]
+    loads = [0.0] * num_chunks
+    for idx in sorted(range(len(items)), key=lambda i: -costs[i]):
+        load, chunk_id = heapq.heappop(heap)
+        chunks[chunk_id].append(items[idx])
+        loads[chunk_id] = load + costs[idx]
+        heapq.heappush(heap, (loads[chunk_id], chunk_id))
+    order = sorted(range(num_chunks), key=lambda i: -loads[i])
+    return [chunks[i] for i in order if chunks[i]]
@@ -0,0 +1,31 @@
+from .bundle import (
+    BUNDLE_FILE,
+    instruction_id,
+    build_verifier_bundle,
+    save_verifier_bundle,
+    load_verifier_bundle,
+    merge_verifier_bundles,
+)
+
+__all__ = [
+    'BUNDLE_FILE',
+    'instruction_id',
+    'build_verifier_bundle',
+    'save_verifier_bundle',
+    'load_verifier_bundle',
+    'merge_verifier_bundles',
+    'VerifierScorer',
+    'RewardServer',
+    'run_reward_server',
+]
+
+
+def __getattr__(name):
+    # 延迟导入，流水线写出验证函数包时无需加载打分依赖（避免与autoif.core循环导入）
+    if name == 'VerifierScorer':
+        from .scorer import VerifierScorer
+        return VerifierScorer
+    if name in ('RewardServer', 'run_reward_server'):
+        from . import server
+        return getattr(server, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
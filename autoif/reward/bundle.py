@@ -0,0 +1,96 @@
+# 验证函数包：交叉验证通过的验证函数按指令ID保存为marshal后的代码对象，供下游直接加载打分
+import importlib.util
+import marshal
+import os
+import pickle
+from typing import Any, Callable, Dict, Iterable, List
+from autoif.utils import md5
+from autoif.core.worker import exec_module
+
+BUNDLE_FILE = "verifier_bundle.pkl"
+BUNDLE_FORMAT = 1
+
+
+def instruction_id(instruction: str) -> str:
+    """指令ID：指令文本的md5"""
+    return md5(instruction)
+
+
+def build_verifier_bundle(records: Iterable[Dict]) -> Dict[str, Any]:
+    """由交叉验证结果构建验证函数包
+
+    每条指令保存 {'instruction', 'funcs': [{'code', 'source', 'score', 'cost'}]}，函数按得分从高到低排列，
+    cost为交叉验证时测得的单次调用耗时统计（没有时为None）。
+    code为marshal后的模块代码对象，只能由相同Python版本加载，版本不一致时回退到source重新编译。
+    """
+    instructions = {}
+    for record in records:
+        funcs = []
+        costs = record.get('func_stats') or [None] * len(record['eval_func'])
+        for (source, score), cost in sorted(zip(record['eval_func'], costs), key=lambda each: -each[0][1]):
+            try:
+                code = marshal.dumps(compile(source, '<eval_func>', 'exec'))
+            except (SyntaxError, ValueError):
+                continue
+            funcs.append({'code': code, 'source': source, 'score': float(score), 'cost': cost})
+        if funcs:
+            instructions[instruction_id(record['instruction'])] = {
+                'instruction': record['instruction'],
+                'funcs': funcs,
+            }
+    return {
+        'format': BUNDLE_FORMAT,
+        'magic': importlib.util.MAGIC_NUMBER,
+        'instructions': instructions,
+    }
+
+
+def save_verifier_bundle(bundle: Dict[str, Any], path: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_verifier_bundle(path: str) -> Dict[str, Any]:
+    """加载验证函数包（pickle格式，只加载可信的文件）"""
+    with open(path, 'rb') as f:
+        bundle = pickle.load(f)
+    if bundle.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f"不支持的验证函数包格式: {bundle.get('format')}")
+    return bundle
+
+
+def merge_verifier_bundles(paths: List[str], path: str) -> int:
+    """合并多个验证函数包（如各分片的输出），返回指令数"""
+    merged = None
+    for each in paths:
+        bundle = load_verifier_bundle(each)
+        if merged is None:
+            merged = bundle
+        elif bundle['magic'] != merged['magic']:
+            # 不同Python版本生成的代码对象不能放在同一个包中
+            raise ValueError(f"验证函数包的Python版本不一致: {each}")
+        else:
+            merged['instructions'].update(bundle['instructions'])
+    if merged is None:
+        return 0
+    merged['instructions'] = dict(sorted(merged['instructions'].items()))
+    save_verifier_bundle(merged, path)
+    return len(merged['instructions'])
+
+
+def load_bundle_funcs(entry: Dict[str, Any], magic: bytes) -> List[Callable]:
+    """加载一条指令的evaluate函数，跳过加载失败的函数"""
+    same_version = magic == importlib.util.MAGIC_NUMBER
+    funcs = []
+    for func in entry['funcs']:
+        try:
+            code = marshal.loads(func['code']) if same_version else compile(func['source'], '<eval_func>', 'exec')
+            namespace = exec_module(code)
+        except Exception as e:
+            print(e)
+            continue
+        if namespace.get('evaluate') is not None:
+            funcs.append(namespace['evaluate'])
+    return funcs
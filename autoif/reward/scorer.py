@@ -0,0 +1,153 @@
+# 基于验证函数包的批量打分，在常驻进程池中执行
+import asyncio
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from autoif.core.worker import init_worker, get_shared
+from autoif.utils import with_timeout
+from .bundle import load_verifier_bundle, load_bundle_funcs, instruction_id
+
+# worker内按指令ID缓存加载好的evaluate函数
+_loaded_funcs: Dict[str, List[Callable]] = {}
+
+
+def init_scorer_worker(bundle_path: str) -> None:
+    """进程池initializer：每个worker加载一次验证函数包"""
+    bundle = load_verifier_bundle(bundle_path)
+    init_worker({'instructions': bundle['instructions'], 'magic': bundle['magic']})
+    _loaded_funcs.clear()
+
+
+def get_instruction_funcs(iid: str) -> List[Callable]:
+    if iid not in _loaded_funcs:
+        _loaded_funcs[iid] = load_bundle_funcs(get_shared('instructions')[iid], get_shared('magic'))
+    return _loaded_funcs[iid]
+
+
+@with_timeout
+def score_response(eval_funcs: List[Callable], response: str) -> float:
+    """单个回复通过验证函数的比例（与步骤7一致），超时单独计时，超时时抛出TimeoutError而不是跳过该函数"""
+    acc = []
+    for eval_func in eval_funcs:
+        try:
+            res = eval_func(response)
+        except TimeoutError:
+            raise
+        except Exception:
+            continue
+        if res is not None:
+            acc.append(int(res))
+    return float(np.mean(acc)) if acc else 0.0
+
+
+def score_chunk(chunk: List[Tuple[str, List[str]]]) -> List[List[Optional[float]]]:
+    """在worker中对一块 (指令ID, 回复列表) 打分，超时或出错的回复记为None（由调用方报告错误，不当作0分）"""
+    outputs = []
+    for iid, responses in chunk:
+        funcs = get_instruction_funcs(iid)
+        scores = []
+        for response in responses:
+            try:
+                scores.append(score_response(funcs, response))
+            except Exception as e:
+                print(f"Error scoring response: {e}")
+                scores.append(None)
+        outputs.append(scores)
+    return outputs
+
+
+def _noop() -> None:
+    pass
+
+
+class VerifierScorer:
+    """验证函数包打分器
+
+    回复的得分为通过验证函数的比例，与步骤7一致；每个回复单独计算超时，超时或出错的回复得分为None。
+    请求按chunk_size个回复切分后分发到进程池，进程池常驻，验证函数在每个worker中只加载一次。
+
+    Args:
+        bundle_path: 验证函数包路径
+        process_num: 进程数
+        chunk_size: 每个进程池任务包含的最大回复数
+    """
+    def __init__(self, bundle_path: str, process_num: int = 4, chunk_size: int = 256):
+        bundle = load_verifier_bundle(bundle_path)
+        self.instructions = {iid: entry['instruction'] for iid, entry in bundle['instructions'].items()}
+        del bundle
+        self.chunk_size = chunk_size
+        self.pool = ProcessPoolExecutor(
+            max_workers=process_num,
+            initializer=init_scorer_worker,
+            initargs=(bundle_path,)
+        )
+        # 预先启动所有worker并加载验证函数包
+        for future in [self.pool.submit(_noop) for _ in range(process_num)]:
+            future.result()
+
+    def resolve(self, instruction_id_or_text: str) -> str:
+        """指令ID或指令文本 -> 指令ID，不在包中时抛出KeyError"""
+        if instruction_id_or_text in self.instructions:
+            return instruction_id_or_text
+        iid = instruction_id(instruction_id_or_text)
+        if iid in self.instructions:
+            return iid
+        raise KeyError(instruction_id_or_text)
+
+    def _submit(self, items: Sequence[Tuple[str, List[str]]]) -> Tuple[List[Future], List[List[Tuple[int, int]]]]:
+        """把请求切分打包为进程池任务，返回 (任务, 每个任务中各片段对应的 (请求序号, 回复数))"""
+        futures, layouts = [], []
+        chunk, layout, size = [], [], 0
+
+        def flush():
+            nonlocal chunk, layout, size
+            if chunk:
+                futures.append(self.pool.submit(score_chunk, chunk))
+                layouts.append(layout)
+            chunk, layout, size = [], [], 0
+
+        for i, (iid, responses) in enumerate(items):
+            iid = self.resolve(iid)
+            for start in range(0, len(responses), self.chunk_size):
+                piece = responses[start:start + self.chunk_size]
+                if size + len(piece) > self.chunk_size:
+                    flush()
+                chunk.append((iid, piece))
+                layout.append((i, len(piece)))
+                size += len(piece)
+        flush()
+        return futures, layouts
+
+    @staticmethod
+    def _assemble(num_items: int, results: List[List[List[Optional[float]]]],
+                  layouts: List[List[Tuple[int, int]]]) -> List[List[Optional[float]]]:
+        scores: List[List[Optional[float]]] = [[] for _ in range(num_items)]
+        for chunk_scores, layout in zip(results, layouts):
+            for piece_scores, (i, _) in zip(chunk_scores, layout):
+                scores[i].extend(piece_scores)
+        return scores
+
+    def score_batch(self, items: Sequence[Tuple[str, List[str]]]) -> List[List[Optional[float]]]:
+        """批量打分，items为 (指令ID或指令文本, 回复列表)，超时或出错的回复得分为None"""
+        futures, layouts = self._submit(items)
+        return self._assemble(len(items), [future.result() for future in futures], layouts)
+
+    def score(self, instruction_id: str, responses: List[str]) -> List[Optional[float]]:
+        return self.score_batch([(instruction_id, responses)])[0]
+
+    async def ascore_batch(self, items: Sequence[Tuple[str, List[str]]]) -> List[List[Optional[float]]]:
+        futures, layouts = self._submit(items)
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+        return self._assemble(len(items), list(results), layouts)
+
+    async def ascore(self, instruction_id: str, responses: List[str]) -> List[Optional[float]]:
+        return (await self.ascore_batch([(instruction_id, responses)]))[0]
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,94 @@
+# 本地奖励打分服务：基于验证函数包和常驻进程池为在线RL提供批量打分
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from aiohttp import web
+from .scorer import VerifierScorer
+
+
+class RewardServer:
+    """HTTP打分服务
+
+    POST /score        {"instruction_id" 或 "instruction", "responses": [...]} -> {"scores": [...]}
+    POST /score_batch  {"items": [{"instruction_id" 或 "instruction", "responses": [...]}]} -> {"scores": [[...]]}
+    GET  /health       {"instructions": 指令数, "requests": 请求数, "responses": 回复数}
+
+    有回复打分超时或出错时返回504，error中给出失败的回复数，scores中这些回复为null，其余回复的得分照常返回。
+    """
+    def __init__(self, scorer: VerifierScorer):
+        self.scorer = scorer
+        self.requests = 0
+        self.responses = 0
+        self.start_time = time.time()
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.router.add_get('/health', self.handle_health)
+        app.router.add_post('/score', self.handle_score)
+        app.router.add_post('/score_batch', self.handle_score_batch)
+        return app
+
+    def _error(self, status: int, message: str, **extra: Any) -> web.Response:
+        return web.json_response({"error": {"message": message, "code": status}, **extra}, status=status)
+
+    def _scores_response(self, scores: Any, failed: int) -> web.Response:
+        if failed:
+            return self._error(504, f"{failed} 个回复打分超时或出错", scores=scores)
+        return web.json_response({"scores": scores})
+
+    @staticmethod
+    def _parse_item(item: Dict) -> Tuple[str, List[str]]:
+        if not isinstance(item, dict):
+            raise ValueError("请求项应为JSON对象")
+        key = item.get('instruction_id') or item.get('instruction')
+        responses = item.get('responses')
+        if not key or not isinstance(responses, list):
+            raise ValueError("需要 instruction_id（或 instruction）和 responses 列表")
+        return key, responses
+
+    async def _score(self, items: List[Tuple[str, List[str]]]) -> List[List[Optional[float]]]:
+        scores = await self.scorer.ascore_batch(items)
+        self.requests += 1
+        self.responses += sum(len(responses) for _, responses in items)
+        return scores
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "instructions": len(self.scorer.instructions),
+            "requests": self.requests,
+            "responses": self.responses,
+            "uptime": time.time() - self.start_time,
+        })
+
+    async def handle_score(self, request: web.Request) -> web.Response:
+        try:
+            item = self._parse_item(await request.json())
+        except ValueError as e:
+            return self._error(400, str(e))
+        try:
+            scores = await self._score([item])
+        except KeyError as e:
+            return self._error(404, f"instruction not found: {e.args[0]}")
+        return self._scores_response(scores[0], scores[0].count(None))
+
+    async def handle_score_batch(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+            items = body.get('items', []) if isinstance(body, dict) else None
+            if not isinstance(items, list):
+                raise ValueError("需要 items 列表")
+            items = [self._parse_item(item) for item in items]
+        except ValueError as e:
+            return self._error(400, str(e))
+        try:
+            scores = await self._score(items)
+        except KeyError as e:
+            return self._error(404, f"instruction not found: {e.args[0]}")
+        return self._scores_response(scores, sum(each.count(None) for each in scores))
+
+
+def run_reward_server(bundle_path: str, host: str = '127.0.0.1', port: int = 8100,
+                      process_num: int = 4, chunk_size: int = 256) -> None:
+    """启动打分服务（阻塞）"""
+    with VerifierScorer(bundle_path, process_num=process_num, chunk_size=chunk_size) as scorer:
+        print(f"打分服务: http://{host}:{port} ({len(scorer.instructions)} 条指令, {process_num} 个进程)")
+        web.run_app(RewardServer(scorer).build_app(), host=host, port=port, print=None)
@@ -1,11 +1,15 @@
 import signal
-from typing import Callable, TypeVar, Any, List, Dict
+from typing import Callable, TypeVar, Any, List, Dict, Iterator, Optional, Tuple
 from functools import wraps
+import json
 import jsonlines
 import re
-from diskcache import Index
 import threading
-from queue import Queue
+import asyncio
+import sqlite3
+import pickle
+import zlib
+from collections import OrderedDict
 import hashlib
 import os
 T = TypeVar('T')
@@ -18,77 +22,257 @@ def ensure_output_dir(output_dir: str) -> None:
         os.makedirs(output_dir)
         print(f"创建输出目录: {output_dir}")
 
-class AsyncCache(Index):
-    """异步缓存类，继承自diskcache.Index，提供定时写入功能"""
-    def __init__(self, directory, flush_interval=5, **kwargs):
-        super().__init__(directory, **kwargs)
+def get_run_dir(output_dir: str, model: str, seed_dir: str) -> str:
+    """一次运行的输出目录，由模型名和参考文件路径决定"""
+    return os.path.join(output_dir, f"{model}-{md5(seed_dir)}")
+
+class AsyncCache:
+    """步骤缓存：SQLite存储，启动时一次性加载已完成的键集合，写入先进缓冲区再批量落盘
+
+    - 成员判断只查内存中的键集合，不访问SQLite
+    - 在事件循环中调用async_update时，由后台写入任务每flush_interval秒或缓冲区达到
+      batch_size条时，在一个事务中批量写入
+    - 可选zlib压缩条目，读取时经过内存LRU热缓存
+    """
+    def __init__(self, directory, flush_interval=5, batch_size=1000, compress=False, lru_size=4096):
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, 'cache.sqlite3'),
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache (key PRIMARY KEY, value BLOB)')
+        self._keys = {row[0] for row in self._conn.execute('SELECT key FROM cache')}
         self._cache_buffer: Dict = {}
         self._cache_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
         self._flush_interval = flush_interval
-        self._timer = None
-        self._start_timer()
-    
-    def _start_timer(self):
-        """启动定时器"""
-        if self._timer is None:
-            self._timer = threading.Timer(self._flush_interval, self._flush_buffer)
-            self._timer.daemon = True
-            self._timer.start()
+        self._batch_size = batch_size
+        self._compress = compress
+        self._lru: OrderedDict = OrderedDict()
+        self._lru_size = lru_size
+        self._writer_task = None
+        self._flush_event = None
+
+    def _encode(self, value) -> bytes:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._compress:
+            return b'z' + zlib.compress(data)
+        return b'p' + data
+
+    @staticmethod
+    def _decode(blob: bytes):
+        data = blob[1:]
+        if blob[:1] == b'z':
+            data = zlib.decompress(data)
+        return pickle.loads(data)
+
+    def _remember(self, key, value):
+        """写入LRU热缓存"""
+        if self._lru_size <= 0:
+            return
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self._lru_size:
+            self._lru.popitem(last=False)
+
+    def _write(self, items: dict):
+        """在一个事务中批量写入"""
+        if not items:
+            return
+        rows = [(key, self._encode(value)) for key, value in items.items()]
+        with self._db_lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany('INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)', rows)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
 
     def _flush_buffer(self):
-        """将缓冲区数据写入磁盘"""
-        try:
+        """将缓冲区数据写入磁盘
+
+        整个取出和写入过程持有_flush_lock：后台线程中正在进行的写入完成之前，
+        其他调用（stop、items等）会等待，不会读到已取出缓冲区但尚未提交的数据缺失的状态。
+        """
+        with self._flush_lock:
             with self._cache_lock:
-                if self._cache_buffer:
-                    self.update(self._cache_buffer)
-                    self._cache_buffer.clear()
-        except Exception as e:
-            print(f"缓存写入出错: {e}")
-        finally:
-            # 重置定时器
-            if self._timer is not None:
-                self._timer.cancel()  # 取消当前定时器
-                self._timer = None
-            self._start_timer()
+                items, self._cache_buffer = self._cache_buffer, {}
+            try:
+                self._write(items)
+            except Exception as e:
+                print(f"缓存写入出错: {e}")
+                with self._cache_lock:
+                    items.update(self._cache_buffer)
+                    self._cache_buffer = items
+
+    async def _writer(self):
+        """后台写入任务：定时或缓冲区满时批量落盘"""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await asyncio.to_thread(self._flush_buffer)
+
+    def _ensure_writer(self):
+        if self._writer_task is not None and not self._writer_task.done():
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_event = asyncio.Event()
+        self._writer_task = asyncio.create_task(self._writer())
 
     def async_update(self, other: dict):
-        """异步更新缓存"""
-        if other:
-            with self._cache_lock:
-                self._cache_buffer.update(other)
+        """异步更新缓存：写入缓冲区，由后台任务批量落盘；不在事件循环中时缓冲区满即同步写入"""
+        if not other:
+            return
+        with self._cache_lock:
+            self._cache_buffer.update(other)
+            self._keys.update(other)
+            buffered = len(self._cache_buffer)
+        for key, value in other.items():
+            self._remember(key, value)
+        self._ensure_writer()
+        if buffered >= self._batch_size:
+            if self._writer_task is not None:
+                self._flush_event.set()
+            else:
+                self._flush_buffer()
+
+    def update(self, other: dict):
+        """同步批量写入"""
+        if not other:
+            return
+        self._write(other)
+        with self._cache_lock:
+            self._keys.update(other)
+        for key, value in other.items():
+            self._remember(key, value)
 
     def stop(self):
-        """停止定时器并确保数据写入"""
-        if self._timer:
-            self._timer.cancel()
-            self._timer = None
-            # 最后一次写入
-            with self._cache_lock:
-                try:
-                    self.update(self._cache_buffer)
-                    self._cache_buffer.clear()
-                except Exception as e:
-                    print(f"最终缓存写入出错: {e}")
+        """停止后台写入任务并确保数据写入（等待后台线程中正在进行的写入完成）"""
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
+        self._flush_buffer()
+
+    def close(self):
+        self.stop()
+        self._conn.close()
 
     def __getitem__(self, key):
-        """获取数据时先检查缓冲区"""
+        """获取数据时依次检查缓冲区、LRU热缓存和磁盘"""
         with self._cache_lock:
             if key in self._cache_buffer:
                 return self._cache_buffer[key]
-        return super().__getitem__(key)
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return self._lru[key]
+        if key not in self._keys:
+            raise KeyError(key)
+        with self._db_lock:
+            row = self._conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = self._decode(row[0])
+        self._remember(key, value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
     def __contains__(self, key):
-        """检查键是否存在时同时检查缓冲区"""
-        with self._cache_lock:
-            if key in self._cache_buffer:
-                return True
-        return super().__contains__(key)
+        """只查询内存中的键集合"""
+        return key in self._keys
 
     def __len__(self):
-        """计算长度时排除元数据和缓冲区"""
-        with self._cache_lock:
-            total = super().__len__()
-            return total + len(self._cache_buffer)
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return sorted(self._keys)
+
+    def items(self, fetch_size: int = 1000):
+        """按键顺序分页流式读取所有条目"""
+        self._flush_buffer()
+        last_key = None
+        while True:
+            with self._db_lock:
+                if last_key is None:
+                    rows = self._conn.execute('SELECT key, value FROM cache ORDER BY key LIMIT ?',
+                                              (fetch_size,)).fetchall()
+                else:
+                    rows = self._conn.execute('SELECT key, value FROM cache WHERE key > ? ORDER BY key LIMIT ?',
+                                              (last_key, fetch_size)).fetchall()
+            if not rows:
+                return
+            for key, blob in rows:
+                yield key, self._decode(blob)
+            last_key = rows[-1][0]
+
+    def values(self):
+        """按键顺序流式读取所有值"""
+        for _, value in self.items():
+            yield value
+
+class OrderedJsonlSink:
+    """按输入下标顺序流式写出JSONL
+
+    乱序完成的结果暂存在重排缓冲区中，下标连续时依次写出；结果为None的下标直接跳过。
+    缓冲区达到max_pending条时full为True，调用方应暂停发出新任务。
+    """
+    def __init__(self, path: str, max_pending: int = 4096, start: int = 0, keep: bool = False):
+        self.path = path
+        self.max_pending = max_pending
+        self.count = 0
+        # keep为True时同时在内存中保留写出的结果，供下一个步骤直接使用
+        self.records: Optional[List[Any]] = [] if keep else None
+        self._next = start
+        self._pending: Dict[int, Any] = {}
+        self._writer = jsonlines.open(path, mode='w')
+
+    @property
+    def full(self) -> bool:
+        return len(self._pending) >= self.max_pending
+
+    def put(self, index: int, result: Any) -> None:
+        self._pending[index] = result
+        while self._next in self._pending:
+            result = self._pending.pop(self._next)
+            self._next += 1
+            if result is not None:
+                self._write(result)
+
+    def _write(self, result: Any) -> None:
+        self._writer.write(result)
+        self.count += 1
+        if self.records is not None:
+            self.records.append(result)
+
+    def close(self) -> None:
+        if self._pending:
+            print(f"警告: {len(self._pending)} 个结果未能按顺序写出 (等待下标 {self._next})")
+            for index in sorted(self._pending):
+                if self._pending[index] is not None:
+                    self._write(self._pending[index])
+            self._pending.clear()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 def save_data(data: List[str], path: str, mode: str = 'w') -> None:
     """保存文本数据到文件"""
@@ -106,6 +290,56 @@ def load_jsonl(path: str) -> List[Dict]:
     with jsonlines.open(path) as reader:
         return list(reader)
 
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    """逐行读取JSONL文件"""
+    with jsonlines.open(path) as reader:
+        yield from reader
+
+def count_lines(path: str) -> Optional[int]:
+    """统计文件的非空行数，文件不存在时返回None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+# strict=False允许字符串中出现未转义的换行等控制字符（模型输出的代码常见）
+_JSON_DECODER = json.JSONDecoder(strict=False)
+
+
+def extract_json_object(text: str, max_starts: int = 32) -> Tuple[Optional[Dict], str]:
+    """从模型回复中提取JSON对象，返回 (对象, 提取方式)
+
+    依次尝试 ```json 代码块、任意代码块、整段文本、文本中第一个能解析的 {...}，
+    提取方式为 fenced / bare / embedded，失败时返回 (None, 'failed')。
+    """
+    for pattern in (r'```json(.*?)```', r'```[a-zA-Z]*\n(.*?)```'):
+        for block in re.findall(pattern, text, re.DOTALL):
+            try:
+                obj = _JSON_DECODER.decode(block.strip())
+            except ValueError:
+                continue
+            if isinstance(obj, dict):
+                return obj, 'fenced'
+    stripped = text.strip()
+    try:
+        obj = _JSON_DECODER.decode(stripped)
+        if isinstance(obj, dict):
+            return obj, 'bare'
+    except ValueError:
+        pass
+    start = stripped.find('{')
+    for _ in range(max_starts):
+        if start < 0:
+            break
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(stripped, start)
+            if isinstance(obj, dict):
+                return obj, 'embedded'
+        except ValueError:
+            pass
+        start = stripped.find('{', start + 1)
+    return None, 'failed'
+
 def contains_chinese(text: str) -> bool:
     """判断字符串是否包含中文"""
     pattern = re.compile(r'[\u4e00-\u9fff]')
@@ -0,0 +1,37 @@
+import pytest
+from autoif.core.budget import RunBudget
+from autoif.core.planner import StepPlan
+
+
+def plans():
+    return [StepPlan(2, "a", requests=10, prompt_tokens=100, completion_tokens=300),
+            StepPlan(3, "b"),
+            StepPlan(4, "c", requests=30, prompt_tokens=600, completion_tokens=1000)]
+
+
+def test_begin_step_allocates_by_estimate():
+    budget = RunBudget(max_tokens=1000, max_requests=20)
+    # 步骤2的token估计占剩余步骤的1/5，请求估计占1/4（取整为5）
+    assert budget.begin_step(2, plans()) == pytest.approx(0.5)
+    assert budget.describe() == {'fraction': 0.5, 'tokens': 200, 'requests': 5}
+    budget.consume(5, 0, 4 * 100)
+    assert budget.exhausted()
+    # 前面步骤的用量从剩余预算中扣除，由后面的步骤分摊
+    budget.begin_step(4, plans()[2:])
+    assert budget.describe()['requests'] == 15
+    assert not budget.exhausted()
+
+
+def test_begin_step_without_llm_work():
+    budget = RunBudget(max_requests=1)
+    assert budget.begin_step(3, plans()) == 1.0
+    assert budget.describe() == {'fraction': 1.0}
+
+
+def test_pending_requests_count_against_budget():
+    budget = RunBudget(max_requests=10)
+    budget.begin_step(4, plans()[2:])
+    reserved = [budget.reserve(0) for _ in range(10)]
+    assert budget.exhausted()
+    budget.release(reserved.pop())
+    assert not budget.exhausted()
@@ -0,0 +1,21 @@
+import random
+from autoif.core.dpo import DPOMixin
+
+
+def test_sample_dpo_pairs():
+    responses = [("a", 1.0), ("b", 0.5), ("c", 0.0), ("d", 0.0), ("e", 0.3), ("a", 1.0)]
+    pairs = DPOMixin.sample_dpo_pairs(responses, random.Random(0))
+    assert len(pairs) == 4
+    assert {positive for positive, _ in pairs} == {"a", "b"}
+    assert {negative for _, negative in pairs} == {"c", "d"}
+    # 相同种子结果相同，与回复顺序无关
+    assert DPOMixin.sample_dpo_pairs(list(reversed(responses)), random.Random(0)) == pairs
+
+
+def test_sample_dpo_pairs_needs_both_sides():
+    assert DPOMixin.sample_dpo_pairs([("a", 1.0), ("b", 1.0)], random.Random(0)) == []
+    assert DPOMixin.sample_dpo_pairs([("a", 0.3)], random.Random(0)) == []
+    # 一侧有两个以上候选时每侧最多取两个
+    assert DPOMixin.sample_dpo_pairs([("a", 1.0), ("b", 0.0), ("c", 0.0)], random.Random(0)) == [
+        ("a", "b"), ("a", "c")]
+    assert DPOMixin.sample_dpo_pairs([("a", 1.0), ("b", 0.0)], random.Random(0)) == [("a", "b")]
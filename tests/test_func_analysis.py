@@ -0,0 +1,29 @@
+import pytest
+from autoif.core.func_analysis import is_safe_code
+
+
+@pytest.mark.parametrize("code", [
+    "import re\ndef evaluate(response):\n    return bool(re.search(r'\\d', response))",
+    "import numpy as np\ndef evaluate(response):\n    return np.mean([len(w) for w in response.split()]) > 3",
+    "import json\ndef evaluate(response):\n    try:\n        json.loads(response)\n        return True\n    except ValueError:\n        return False",
+])
+def test_safe_code(code):
+    assert is_safe_code(code)
+
+
+@pytest.mark.parametrize("code", [
+    "def evaluate(response):\n    return open('/etc/passwd').read() == response",
+    "def evaluate(response):\n    f = open\n    return f('/etc/passwd').read() == response",
+    "def evaluate(response, g=eval):\n    return g(response)",
+    "import numpy as np\ndef evaluate(response):\n    np.save('/tmp/x', [1])\n    return True",
+    "import numpy as np\ndef evaluate(response):\n    return np.fromfile('/etc/passwd', dtype=np.uint8).size > 0",
+    "import numpy as np\ndef evaluate(response):\n    f = np.load\n    return f('/tmp/x.npy') is not None",
+    "from numpy import loadtxt\ndef evaluate(response):\n    return loadtxt('/tmp/x') is not None",
+    "import numpy.f2py\ndef evaluate(response):\n    return True",
+    "import nltk\ndef evaluate(response):\n    nltk.download('punkt')\n    return True",
+    "import nltk\ndef evaluate(response):\n    return nltk.data.load('/etc/passwd') is not None",
+    "import os\ndef evaluate(response):\n    return True",
+    "def evaluate(response):\n    return response.__class__ is str",
+])
+def test_unsafe_code(code):
+    assert not is_safe_code(code)
@@ -0,0 +1,39 @@
+import asyncio
+from autoif.client.hedging import HedgePolicy
+
+
+def test_threshold_is_per_key():
+    policy = HedgePolicy(percentile=90, min_samples=10)
+    for i in range(100):
+        policy.record(0.01 * (i + 1), key='short')
+    assert abs(policy.threshold('short') - 0.91) < 1e-9
+    assert policy.threshold('long') is None
+    for _ in range(10):
+        policy.record(5.0, key='long')
+    assert policy.threshold('long') == 5.0
+    assert abs(policy.threshold('short') - 0.91) < 1e-9
+
+
+def test_quota_is_per_key():
+    policy = HedgePolicy(max_ratio=0.1)
+    policy._get_window('a').requests = 100
+    assert sum(policy.try_acquire('a') for _ in range(20)) == 10
+    # 其他key之前积累的请求数不会放大配额
+    policy._get_window('b').requests = 10
+    assert sum(policy.try_acquire('b') for _ in range(5)) == 1
+    assert policy.hedged == 11
+
+
+def test_run_hedges_slow_request_with_copy():
+    policy = HedgePolicy(percentile=50, max_ratio=1.0, min_samples=1)
+    policy.record(0.01, key='k')
+
+    async def make_request(attempt):
+        await asyncio.sleep(1.0 if attempt == 0 else 0.01)
+        return attempt
+
+    assert asyncio.run(policy.run(make_request, key='k')) == 1
+    assert (policy.requests, policy.hedged, policy.hedge_wins) == (1, 1, 1)
+    # 没有样本的key不对冲
+    assert asyncio.run(policy.run(make_request, key='other')) == 0
+    assert policy.hedged == 1
@@ -0,0 +1,26 @@
+from autoif.core.planner import plan_run
+
+
+def plans_by_step(tmp_path, **kwargs):
+    seed = tmp_path / "seed.txt"
+    seed.write_text("a\nb\n")
+    return {plan.step: plan for plan in plan_run(str(tmp_path), 10, str(seed), **kwargs)}
+
+
+def test_identical_prompts_are_coalesced(tmp_path):
+    plans = plans_by_step(tmp_path, max_n=4)
+    assert plans[1].requests == 3
+    assert plans[1].samples == 10
+
+
+def test_n_above_max_n_is_split(tmp_path):
+    plans = plans_by_step(tmp_path, max_n=4)
+    # 步骤2每个任务n=8，拆分为2个请求
+    assert plans[2].requests == 2 * plans[2].samples / 8
+    assert plans_by_step(tmp_path, max_n=128)[2].requests == plans[2].samples / 8
+
+
+def test_output_counts_override_files(tmp_path):
+    (tmp_path / "cross_validation.jsonl").write_text("{}\n" * 3)
+    assert plans_by_step(tmp_path)[4].requests == 3
+    assert plans_by_step(tmp_path, output_counts={"cross_validation.jsonl": 7})[4].requests == 7
@@ -0,0 +1,50 @@
+from autoif.core.prefilter import prefilter_reason
+
+QUERY = "How do volcanoes form and why do they erupt?"
+BODY = ("Volcanoes form where magma rises through the crust, usually at plate boundaries or hot spots, "
+        "and they erupt when pressure from dissolved gases in the magma exceeds the strength of the rock above")
+
+
+def test_passes_normal_response():
+    assert prefilter_reason("Answer in one paragraph.", QUERY, BODY + ".") is None
+
+
+def test_empty():
+    assert prefilter_reason("", QUERY, "   \n") == 'empty'
+
+
+def test_truncated_on_comma_and_open_code_block():
+    assert prefilter_reason("Answer in one paragraph.", QUERY, BODY + ",") == 'truncated'
+    assert prefilter_reason("Include a code sample.", QUERY, "```python\nprint(1)\n") == 'truncated'
+
+
+def test_short_response_ending_in_comma_is_kept():
+    assert prefilter_reason("", QUERY, "Magma rises,") is None
+
+
+def test_quoted_response_is_not_truncated():
+    instruction = "Wrap your entire response with double quotation marks."
+    assert prefilter_reason(instruction, QUERY, '"' + BODY + '."') is None
+    assert prefilter_reason(instruction, QUERY, '"' + BODY + '"') is None
+
+
+def test_dash_ending_is_not_truncated():
+    assert prefilter_reason("End your response with a dash.", QUERY, BODY + " -") is None
+
+
+def test_instruction_naming_the_ending_skips_check():
+    assert prefilter_reason("End your response with a colon.", QUERY, BODY + ":") is None
+    assert prefilter_reason("Finish with the exact phrase 'Details follow;'", QUERY, BODY + " details follow;") is None
+    assert prefilter_reason("End your response with a colon.", QUERY, BODY + ",") == 'truncated'
+
+
+def test_repetitive_unless_asked_to_repeat():
+    response = " ".join(["lava flows down the mountain"] * 20)
+    assert prefilter_reason("Answer briefly.", "lava mountain", response) == 'repetitive'
+    assert prefilter_reason("Repeat the sentence twenty times.", "lava mountain", response) is None
+
+
+def test_off_query():
+    query = "Explain photosynthesis chlorophyll sunlight glucose production in plants"
+    response = " ".join(f"token{i}" for i in range(100))
+    assert prefilter_reason("", query, response) == 'off_query'
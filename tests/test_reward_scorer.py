@@ -0,0 +1,27 @@
+import pytest
+from autoif.reward.scorer import score_response
+
+
+def lowercase(response):
+    return response.islower()
+
+
+def broken(response):
+    raise ValueError(response)
+
+
+def hang(response):
+    while True:
+        pass
+
+
+def test_score_is_pass_fraction_and_skips_errors():
+    assert score_response([lowercase, lambda r: len(r) > 3], "hello") == 1.0
+    assert score_response([lowercase, lambda r: len(r) > 10], "hello") == 0.5
+    assert score_response([broken, lowercase], "Hello") == 0.0
+    assert score_response([], "hello") == 0.0
+
+
+def test_timeout_is_raised_not_scored():
+    with pytest.raises(TimeoutError):
+        score_response([hang, lowercase], "hello")
@@ -0,0 +1,120 @@
+import asyncio
+from autoif.core.scheduler import DispatchWindow, FairLimiter, schedule_order, split_n
+
+
+def test_split_n():
+    assert split_n(8, 4) == [4, 4]
+    assert split_n(8, 3) == [3, 3, 2]
+    assert split_n(2, 128) == [2]
+    assert split_n(5, 0) == [1, 1, 1, 1, 1]
+
+
+def test_schedule_order():
+    costs = [1.0, 10.0, 3.0, 100.0]
+    assert schedule_order(costs, 'fifo') == [0, 1, 2, 3]
+    assert schedule_order(costs, 'longest') == [3, 1, 2, 0]
+    # 同一个桶内保持输入顺序
+    assert schedule_order([5.0, 6.0, 100.0], 'bucket') == [2, 0, 1]
+
+
+def make_window(tasks, **kwargs):
+    window = DispatchWindow(size=len(tasks), **kwargs)
+    for index, (cost, msg) in enumerate(tasks):
+        window.add(cost, (index, msg, None))
+    return window
+
+
+def indices(request):
+    return [index for _, chunk in request for index, _ in chunk]
+
+
+def test_dispatch_window_groups_identical_messages():
+    msg = [{"role": "user", "content": "a"}]
+    other = [{"role": "user", "content": "b"}]
+    window = make_window([(1.0, msg), (1.0, other), (1.0, msg), (1.0, msg)], slots=8, per_request=2)
+    requests = window.take()
+    assert [indices(request) for request in requests] == [[0, 2], [3], [1]]
+    assert len(window) == 0
+
+
+def test_dispatch_window_respects_free_slots():
+    window = make_window([(1.0, [str(i)]) for i in range(5)], slots=2)
+    requests = window.take()
+    assert [indices(request) for request in requests] == [[0], [1]]
+    for key, request in enumerate(requests):
+        window.start(key, request)
+    # 并发位置都被占用时不发出新请求
+    assert window.take() == []
+    assert window.finish(0) == [0]
+    assert [indices(request) for request in window.take()] == [[2]]
+    assert len(window) == 2
+
+
+def test_dispatch_window_split_requests_use_slots():
+    window = make_window([(1.0, [str(i)]) for i in range(4)], slots=4, request_parts=2)
+    assert [indices(request) for request in window.take()] == [[0], [1]]
+
+
+def test_dispatch_window_packs_requests():
+    window = make_window([(1.0, [str(i)]) for i in range(5)], slots=1, pack=2)
+    assert [indices(request) for request in window.take()] == [[0, 1]]
+
+
+def test_dispatch_window_sink_full_waits_for_head():
+    window = make_window([(1.0, [str(i)]) for i in range(4)], slots=8)
+    window.entries.pop(0)
+    window.start('head', [(["0"], [(0, None)])])
+    # 缓冲区等待的下标0仍在途，不发送新任务
+    assert window.take(sink_full=True) == []
+    window.finish('head')
+    # 在途下标都大于窗口中最小的下标时只发送它
+    window.start('later', [(["9"], [(9, None)])])
+    assert [indices(request) for request in window.take(sink_full=True)] == [[1]]
+    assert len(window) == 2
+
+
+def test_dispatch_window_clear():
+    window = make_window([(1.0, ["a"]), (2.0, ["b"])], slots=1)
+    assert [index for index, _, _ in window.clear()] == [0, 1]
+    assert len(window) == 0 and not window.full
+
+
+def test_fair_limiter_prefers_least_active():
+    async def run():
+        limiter = FairLimiter(2)
+        await limiter.acquire('a')
+        await limiter.acquire('a')
+        waiters = [asyncio.create_task(limiter.acquire(key)) for key in ('a', 'a', 'b')]
+        await asyncio.sleep(0)
+        assert not any(waiter.done() for waiter in waiters)
+        # 释放的位置先分给占用最少的b，而不是先到的a
+        limiter.release('a')
+        await asyncio.sleep(0)
+        assert [waiter.done() for waiter in waiters] == [False, False, True]
+        assert limiter.active == {'a': 1, 'b': 1}
+        limiter.release('b')
+        await asyncio.sleep(0)
+        assert [waiter.done() for waiter in waiters] == [True, False, True]
+        assert limiter.active == {'a': 2}
+        waiters[1].cancel()
+        await asyncio.sleep(0)
+        limiter.release('a')
+        limiter.release('a')
+        assert limiter.active == {} and limiter._total == 0
+
+    asyncio.run(run())
+
+
+def test_fair_limiter_slot_releases_on_error():
+    async def run():
+        limiter = FairLimiter(1)
+        try:
+            async with limiter.slot('a'):
+                raise ValueError()
+        except ValueError:
+            pass
+        async with limiter.slot('b'):
+            assert limiter.active == {'b': 1}
+        assert limiter.active == {}
+
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+import json
+import pytest
+from autoif.core.shard import merge_shard_outputs, shard_dir_name
+
+
+def write_shard(run_dir, shard_id, num_shards, filename, rows):
+    shard_dir = run_dir / shard_dir_name(shard_id, num_shards)
+    shard_dir.mkdir(exist_ok=True)
+    with open(shard_dir / filename, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def merged(run_dir, filename):
+    return (run_dir / filename).read_text(encoding='utf-8').splitlines()
+
+
+def test_merge_dedups_and_ignores_shard_order(tmp_path):
+    a, b = tmp_path / "a", tmp_path / "b"
+    for run_dir, order in ((a, (0, 1)), (b, (1, 0))):
+        run_dir.mkdir()
+        rows = {0: [{"x": 1, "y": "中"}, {"x": 2}], 1: [{"y": "中", "x": 1}, {"x": 3}]}
+        for shard_id in order:
+            write_shard(run_dir, shard_id, 2, "out.jsonl", rows[shard_id])
+        assert merge_shard_outputs(str(run_dir), 2) == {"out.jsonl": 3}
+    # 键顺序不同的相同记录只保留一条，输出与分片写出顺序无关
+    assert merged(a, "out.jsonl") == merged(b, "out.jsonl")
+    assert sorted(map(json.loads, merged(a, "out.jsonl")), key=lambda row: row["x"]) == [
+        {"x": 1, "y": "中"}, {"x": 2}, {"x": 3}]
+
+
+def test_merge_selected_files_and_missing_shard(tmp_path):
+    write_shard(tmp_path, 0, 2, "a.jsonl", [{"a": 1}])
+    write_shard(tmp_path, 0, 2, "b.jsonl", [{"b": 1}])
+    with pytest.raises(FileNotFoundError):
+        merge_shard_outputs(str(tmp_path), 2)
+    (tmp_path / shard_dir_name(1, 2)).mkdir()
+    assert merge_shard_outputs(str(tmp_path), 2, ["a.jsonl"]) == {"a.jsonl": 1}
+    assert not (tmp_path / "b.jsonl").exists()
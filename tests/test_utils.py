@@ -0,0 +1,46 @@
+import asyncio
+from autoif.utils import AsyncCache, OrderedJsonlSink, load_jsonl
+
+
+def test_sink_reorders_results(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    sink = OrderedJsonlSink(path, max_pending=2, keep=True)
+    sink.put(2, {"i": 2})
+    sink.put(1, None)
+    assert sink.count == 0 and sink.full
+    sink.put(0, {"i": 0})
+    assert not sink.full
+    sink.put(3, {"i": 3})
+    sink.close()
+    # 结果为None的下标跳过，其余按下标顺序写出
+    assert load_jsonl(path) == [{"i": 0}, {"i": 2}, {"i": 3}]
+    assert sink.records == load_jsonl(path) and sink.count == 3
+
+
+def test_sink_flushes_pending_on_close(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    with OrderedJsonlSink(path) as sink:
+        sink.put(3, {"i": 3})
+        sink.put(1, {"i": 1})
+        sink.put(2, None)
+    # 缺少下标0时关闭，缓冲区中的结果仍按下标顺序写出
+    assert load_jsonl(path) == [{"i": 1}, {"i": 3}]
+
+
+def test_cache_persists_across_reopen(tmp_path):
+    cache = AsyncCache(str(tmp_path), compress=True)
+    cache.update({0: "a"})
+
+    async def write():
+        cache.async_update({1: ["b"], 2: {"c": 3}})
+        assert 1 in cache and cache[1] == ["b"]
+
+    asyncio.run(write())
+    cache.close()
+
+    reopened = AsyncCache(str(tmp_path), compress=True, lru_size=0)
+    assert len(reopened) == 3 and 5 not in reopened
+    assert reopened[0] == "a" and reopened[2] == {"c": 3}
+    assert list(reopened.items()) == [(0, "a"), (1, ["b"]), (2, {"c": 3})]
+    assert reopened.get(5) is None
+    reopened.close()
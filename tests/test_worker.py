@@ -0,0 +1,35 @@
+import time
+from autoif.core.worker import chunk_by_cost, compile_eval_func, load_eval_funcs
+
+
+def test_compile_eval_func():
+    func = compile_eval_func("def evaluate(response):\n    return response.islower()")
+    assert func("abc") and not func("ABC")
+    assert compile_eval_func("def evaluate(response):\n    return response.islower()") is func
+    assert compile_eval_func("def evaluate(:") is None
+
+
+def test_module_level_infinite_loop_times_out():
+    start = time.time()
+    assert compile_eval_func("while True:\n    pass\ndef evaluate(response):\n    return True") is None
+    assert time.time() - start < 5
+
+
+def test_load_eval_funcs_skips_failures():
+    funcs = load_eval_funcs(["def evaluate(r):\n    return True", "raise ValueError()", "x = 1"])
+    assert len(funcs) == 1
+
+
+def test_chunk_by_cost_balances_load():
+    costs = [7, 5, 4, 3, 3, 2, 1]
+    chunks = chunk_by_cost(list(range(len(costs))), costs, 3)
+    loads = [sum(costs[i] for i in chunk) for chunk in chunks]
+    assert sorted(i for chunk in chunks for i in chunk) == list(range(len(costs)))
+    # 最长处理时间优先：最贵的任务各自开一个块，块按总代价从大到小排列
+    assert loads == sorted(loads, reverse=True) and max(loads) - min(loads) <= 1
+    assert chunks[0][0] == 0
+
+
+def test_chunk_by_cost_small_inputs():
+    assert chunk_by_cost(["a", "b"], [1, 1], 8) == [["a"], ["b"]]
+    assert chunk_by_cost([], [], 4) == []